@@ -6,9 +6,12 @@ import os
 import time
 import sys
 from datetime import datetime, timedelta
-from math import floor
 from typing import Dict, Any, Optional
 
+import numpy as np
+
+_BOOT_T0 = time.perf_counter() # Process start reference for the startup report
+
 # --- Django Environment Setup ---
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'algotrader.settings')
@@ -20,7 +23,24 @@ from django.conf import settings
 from django.db import transaction
 from django.utils import timezone
 from dashboard.models import CashBreakoutTrade, StrategySettings
-from django.db import transaction, connections # <--- IMPORT connections
+import latency
+from latency import LatencyRecorder
+from partitions import (
+    PartitionMembership, partition_count, partition_for, partition_stream,
+    route_stream, base_stream, remember_order
+)
+from sim_broker import get_simulated_broker, order_id_from, leg_number
+from engine_settings import EngineSettings, TRADE_RELEVANT_FIELDS
+from trade_state import TradeState, TRADE_FIELDS, IDLE_ORDER_STATES
+from pnl_tracker import PnLTracker
+from squareoff import SquareOffJob, query_order, OPEN_ORDER_STATUSES
+from broker_limiter import BrokerLimiter, LimitedBroker, BrokerRateLimited
+from price_triggers import TriggerRegistrar, SIDE_ABOVE, SIDE_BELOW
+from batch_signals import evaluate_breakouts
+from db_health import DBConnectionManager
+from prev_day_levels import levels_key, load_highs, parse_levels
+from trading_calendar import expected_session
+from trade_events import TradeEventLog
 
 # --- Robust Dhan SDK Import ---
 try:
@@ -32,7 +52,7 @@ except ImportError:
     dhanhq = lambda ctx: None
 
 # --- Configuration & Constants ---
-r = redis.from_url(settings.REDIS_URL, decode_responses=True, ssl_cert_reqs=None)
+r = redis.from_url(settings.REDIS_URL, **settings.REDIS_CONN_KWARGS)
 IST = settings.IST
 
 # --- Reverse Map (ID -> Symbol) ---
@@ -40,27 +60,156 @@ SECURITY_ID_TO_SYMBOL = {str(v): k for k, v in settings.SECURITY_ID_MAP.items()}
 
 # --- Global State ---
 DHAN_CLIENT = None
+LATENCY = LatencyRecorder(r) # Per-hop histograms, flushed to Redis from the main loop
+BROKER_LIMITER = BrokerLimiter(r, LATENCY) # Shared Dhan REST budget (all engines, dashboard, commands)
+TRIGGERS = TriggerRegistrar(r) if settings.PRICE_TRIGGERS_ENABLED else None # Crossings watched by the data worker
+DB = DBConnectionManager(settings.REDIS_CONSUMER_NAME, redis_conn=r) # Health-checked persistent DB connection
+
+# Security-partitioned data streams, in pending-replay order: fills first, then signals, prices
+PARTITIONED_STREAMS = [
+    settings.REDIS_STREAM_ORDERS,
+    settings.REDIS_STREAM_SIGNALS if settings.SIGNAL_FILTER_ENABLED else settings.REDIS_STREAM_CANDLES,
+    settings.REDIS_STREAM_MARKET,
+]
+if settings.PRICE_TRIGGERS_ENABLED: PARTITIONED_STREAMS.insert(2, settings.REDIS_STREAM_TRIGGER_EVENTS)
+
+# Trade fields carried in the warm-restart snapshot
+SNAPSHOT_TRADE_FIELDS = (
+    'id', 'strategy_id', 'symbol', 'security_id', 'quantity', 'status', 'exit_reason',
+    'prev_day_high', 'entry_level', 'stop_level', 'target_level', 'entry_price',
+    'entry_order_id', 'exit_order_id', 'order_state', 'correlation_id', 'order_sent_at',
+    'candle_ts', 'entry_time'
+)
+SNAPSHOT_TIME_FIELDS = ('candle_ts', 'entry_time', 'order_sent_at')
+
+def correlation_id_for(trade, leg: str) -> str:
+    """Dhan order tag of a trade leg: T<id>-E (T<id>-B bracket) for the entry, T<id>-X<n> for the n-th exit attempt."""
+    if leg in ('E', 'B'): return f"T{trade.id}-{leg}"
+    prev = trade.correlation_id or ''
+    n = int(prev.rsplit('-X', 1)[1]) + 1 if '-X' in prev else 1
+    return f"T{trade.id}-X{n}"
+
+def to_tick(value: float) -> float:
+    return round(round(value / settings.PRICE_TICK_SIZE) * settings.PRICE_TICK_SIZE, 2)
+
+def is_bracket(trade) -> bool:
+    """Filled bracket order: the exit legs live under the entry order id."""
+    return bool(trade.entry_order_id) and trade.exit_order_id == trade.entry_order_id
+
+def idle_state(trade) -> str:
+    """order_state once nothing is in flight."""
+    return 'BRACKET' if is_bracket(trade) else ''
+
+def needs_ticks(trade) -> bool:
+    """A bracket position whose stop is already at breakeven has nothing left to monitor."""
+    return trade.order_state != 'BRACKET' or trade.stop_level < trade.entry_level
+
+# --- CLOCK & PERSISTENCE (swapped by backtest.py for replay) ---
+def now_ist() -> datetime:
+    return datetime.now(IST)
+
+class DjangoTradeStore:
+    """
+    Trade persistence used by the strategy; maps TradeState <-> CashBreakoutTrade rows.
+    Saves go through a TradeEventLog (one TradeEvent per change): order-state / order-id
+    changes are written before save() returns, monitoring-only changes in periodic
+    batches. The replay engine swaps in an in-memory store.
+    """
+
+    def __init__(self):
+        self.log = TradeEventLog()
+
+    def active(self):
+        rows = CashBreakoutTrade.objects.filter(
+            status__in=['OPEN', 'PENDING_ENTRY', 'PENDING_EXIT']
+        ).values(*TRADE_FIELDS)
+        trades = [TradeState(**row) for row in rows]
+        for t in trades: self.log.track(t)
+        return trades
+
+    def create(self, **fields):
+        with transaction.atomic():
+            trade = TradeState.from_model(CashBreakoutTrade.objects.create(**fields))
+        self.log.created(trade)
+        return trade
+
+    def save(self, trade) -> bool:
+        """False if a durable change could not be written (it stays buffered for retry)."""
+        return self.log.record(trade)
+
+    def flush(self):
+        return self.log.flush()
+
+    def maybe_flush(self):
+        self.log.maybe_flush()
+
+    def active_strategy_ids(self):
+        """Strategy ids that still hold active trades (their fills must keep reconciling)."""
+        self.log.flush()
+        return set(CashBreakoutTrade.objects.filter(
+            status__in=['OPEN', 'PENDING_ENTRY', 'PENDING_EXIT']
+        ).values_list('strategy_id', flat=True).distinct())
+
+    def _find(self, **lookup):
+        row = CashBreakoutTrade.objects.filter(**lookup).values(*TRADE_FIELDS).first()
+        if not row: return None
+        pending = self.log.pending(row['id']) # Unflushed changes are newer than the row
+        if pending is not None: return pending
+        trade = TradeState(**row)
+        self.log.track(trade)
+        return trade
+
+    def find_by_order_id(self, oid):
+        """Returns (trade, is_entry) or (None, False)."""
+        for trade, _ in self.log.dirty.values():
+            if trade.entry_order_id == oid: return trade, True
+            if trade.exit_order_id == oid: return trade, False
+        trade = self._find(entry_order_id=oid)
+        if trade: return trade, True
+        return self._find(exit_order_id=oid), False
+
+TRADE_STORE = DjangoTradeStore()
 
 # --- SETUP HELPERS ---
-def setup_consumer_groups():
-    """Ensures consumer groups exist for all streams."""
-    streams = [
-        settings.REDIS_STREAM_CANDLES, # Consuming completed candles
-        settings.REDIS_STREAM_MARKET,  # Consuming LTP for monitoring
-        settings.REDIS_STREAM_ORDERS,  # Consuming Fills
-        settings.REDIS_STREAM_CONTROL
-    ]
+def owned_streams(owned) -> list:
+    """Data streams this instance consumes for its partitions (replay order)."""
+    streams = [partition_stream(base, p) for base in PARTITIONED_STREAMS for p in sorted(owned)]
+    if partition_count() > 1:
+        # Order updates the worker could not route land here; whoever reads them forwards to the owner
+        streams.insert(0, settings.REDIS_STREAM_ORDERS)
+    return streams
+
+def control_group() -> str:
+    """Control messages must reach every instance, so partitioned engines each get their own group."""
+    if partition_count() == 1: return settings.REDIS_CONSUMER_GROUP
+    return f"{settings.REDIS_CONSUMER_GROUP}:{settings.REDIS_CONSUMER_NAME}"
+
+def snapshot_key() -> str:
+    """Per-instance key: partitioned engines each snapshot their own slice."""
+    return f"{settings.REDIS_ENGINE_SNAPSHOT_KEY}:{settings.REDIS_CONSUMER_NAME}"
+
+def setup_consumer_groups(streams, group=None):
+    """Ensures consumer groups exist for the given streams."""
+    group = group or settings.REDIS_CONSUMER_GROUP
     for stream in streams:
         try:
-            r.xgroup_create(stream, settings.REDIS_CONSUMER_GROUP, id='$', mkstream=True)
+            r.xgroup_create(stream, group, id='$', mkstream=True)
             print(f"Consumer Group Ready: {stream}")
         except redis.exceptions.ResponseError:
             pass
 
+def main_loop_broker():
+    """DHAN_CLIENT with a short queueing bound, for status queries made from the main loop."""
+    bounded = getattr(DHAN_CLIENT, 'bounded', None)
+    return bounded(settings.ENGINE_BROKER_QUERY_MAX_WAIT_SEC) if bounded else DHAN_CLIENT
+
 def get_dhan_client(token: str) -> Optional[object]:
+    """Broker client behind the shared rate limiter (exits > entries > info calls)."""
+    if settings.BROKER_MODE == 'SIM':
+        return LimitedBroker(get_simulated_broker(r), BROKER_LIMITER)
     try:
         if not token: return None
-        return dhanhq(DhanContext(settings.DHAN_CLIENT_ID, token))
+        return LimitedBroker(dhanhq(DhanContext(settings.DHAN_CLIENT_ID, token)), BROKER_LIMITER)
     except: return None
 
 # --- STRATEGY LOGIC ---
@@ -70,32 +219,144 @@ class CashBreakoutStrategy:
     1. Signal: Listens to Candle Stream -> Creates PENDING_ENTRY.
     2. Monitor: Listens to LTP -> Fires MARKET ORDER if PENDING breaks High.
     """
-    def __init__(self):
-        self.settings = StrategySettings.objects.first()
-        self.running = self.settings.is_enabled if self.settings else False
+    def __init__(self, owned_partitions=None, strategy_settings=None, adopt_orphans=False):
+        # DB row (FK target for new trades) and the immutable hot-path snapshot built from it
+        self.model = strategy_settings or StrategySettings.objects.first()
+        self.settings = EngineSettings.from_model(self.model)
+        self.running = self.settings.is_enabled
+        # Trades without a strategy FK (pre multi-strategy rows) belong to one designated strategy
+        self.adopt_orphans = adopt_orphans
         
         # In-Memory State
+        self.owned_partitions = set(owned_partitions) if owned_partitions is not None else {0}
         self.active_trades = {} 
+        self.trades_loaded_from_db = False
+
+        # Latency stamps: sec_id -> (worker receive, engine read) of the latest tick,
+        # order_id -> (trigger tick worker receive, broker ack) until the fill arrives
+        self.tick_times = {}
+        self.order_times = {}
+        self.pdh_cache = {} # symbol -> prev day high (static for the session; shared by the runtime)
+        self.pdh_missing = set() # Symbols already warned about (no level for the session)
+
+        # Rate Limiting Keys (per strategy)
+        today = now_ist().strftime('%Y-%m-%d')
+        self.trade_count_key = f"trade_count:{today}:{self.key}"
+        self.daily_pnl_key = f"daily_pnl:{today}:{self.key}"
+
+        # Live mark-to-market P&L; set to the exit reason once a daily P&L limit is hit
+        self.pnl = PnLTracker()
+        self.pnl_halted = None
+
+        # Concurrent flatten (End of Day / P&L halt); options are overridden by the backtest
+        self.squareoff = None
+        self.squareoff_opts = {}
+
+        # Bracket execution: stop/target legs held at the broker (the backtest keeps engine exits)
+        self.bracket = settings.EXECUTION_MODE == 'BRACKET'
         self.load_trades()
-        
-        # Rate Limiting Keys
-        today = datetime.now(IST).strftime('%Y-%m-%d')
-        self.trade_count_key = f"trade_count:{today}"
-        self.daily_pnl_key = f"daily_pnl:{today}"
+
+    @property
+    def key(self):
+        """Stable id for per-strategy Redis keys and snapshot entries."""
+        return self.settings.strategy_id or 0
 
     def load_trades(self):
         """Sync state from DB on startup."""
-        trades = CashBreakoutTrade.objects.filter(
-            status__in=['OPEN', 'PENDING_ENTRY', 'PENDING_EXIT']
-        )
-        self.active_trades = {t.symbol: t for t in trades}
-        print(f"Strategy: Loaded {len(self.active_trades)} active trades.")
+        try:
+            TRADE_STORE.flush() # Buffered changes first, so the reload does not read stale rows
+            trades = TRADE_STORE.active()
+            self.active_trades = {t.symbol: t for t in trades if self.owns(t.security_id) and self.owns_trade(t)}
+            self.trades_loaded_from_db = True
+            self.reset_pnl()
+            print(f"Strategy: Loaded {len(self.active_trades)} active trades.")
+        except Exception as e:
+            # Keep whatever we have; warm restart falls back to the Redis snapshot
+            self.trades_loaded_from_db = False
+            print(f"Strategy: DB load failed ({e}).")
+
+    def reload_settings(self, reload_trades=False):
+        """
+        UPDATE_CONFIG: re-reads the settings row and swaps in a new snapshot. Active trades
+        are only re-read from the DB if a trade-relevant field changed or the sender asked.
+        """
+        t = time.perf_counter()
+        try:
+            if self.model is not None and self.model.pk: self.model.refresh_from_db()
+            else: self.model = StrategySettings.objects.first()
+        except Exception as e:
+            print(f"Config Reload Failed ({e}). Keeping current settings.")
+            return
+
+        new = EngineSettings.from_model(self.model)
+        changed = new.diff(self.settings)
+        self.settings = new # Single reference swap
+        self.running = new.is_enabled
+
+        resync = bool(reload_trades or changed & TRADE_RELEVANT_FIELDS)
+        if resync: self.load_trades()
+        print(f"Config Reloaded in {(time.perf_counter() - t) * 1000:.1f} ms. "
+              f"Changed: {sorted(changed) or 'none'}. Trades Reloaded: {resync}. Strategy Running: {self.running}")
+
+    def reset_pnl(self):
+        """Rebuilds the P&L tracker from open trades and today's realized P&L."""
+        try:
+            realized = float(r.get(self.daily_pnl_key) or 0)
+        except Exception:
+            realized = 0.0
+        self.pnl.reset([t for t in self.active_trades.values() if t.status in ('OPEN', 'PENDING_EXIT')], realized)
+
+    def owns(self, security_id) -> bool:
+        """True if this instance's partitions include the security."""
+        return partition_for(security_id) in self.owned_partitions
+
+    def owns_trade(self, trade) -> bool:
+        """True if the trade row was created by this strategy."""
+        if trade.strategy_id is None: return self.adopt_orphans or self.settings.strategy_id is None
+        return trade.strategy_id == self.settings.strategy_id
+
+    # --- WARM RESTART SNAPSHOT ---
+    def snapshot_trades(self) -> Dict[str, Dict[str, Any]]:
+        """Compact JSON-ready rows of in-memory trades (written by StrategyRuntime.save_snapshot)."""
+        trades = {}
+        for symbol, t in self.active_trades.items():
+            row = {}
+            for f in SNAPSHOT_TRADE_FIELDS:
+                v = getattr(t, f)
+                row[f] = v.isoformat() if f in SNAPSHOT_TIME_FIELDS and v else v
+            trades[symbol] = row
+        return trades
+
+    def restore_trades(self, rows) -> int:
+        """Rebuilds active trades from snapshot rows; only used when the DB load failed."""
+        if self.trades_loaded_from_db: return 0
+        for symbol, row in (rows or {}).items():
+            if not self.owns(row['security_id']): continue
+            for f in SNAPSHOT_TIME_FIELDS:
+                if row.get(f): row[f] = datetime.fromisoformat(row[f])
+            self.active_trades[symbol] = TradeState(**row)
+        self.reset_pnl()
+        return len(self.active_trades)
 
     def get_prev_day_high(self, symbol):
+        pdh = self.pdh_cache.get(symbol)
+        if pdh: return pdh
+        # Levels cached after the runtime's bulk load; never an older session's
+        key = levels_key(expected_session(now_ist()))
         try:
-            raw = r.hget(settings.PREV_DAY_HASH, symbol)
-            if raw: return float(json.loads(raw).get('high', 0))
-        except: pass
+            levels = parse_levels(r.hget(key, symbol))
+        except redis.RedisError as e:
+            # Transient: not remembered as missing, the next candle looks again
+            print(f"Prev-Day Lookup Error ({symbol}): {e}")
+            return None
+        except (ValueError, TypeError):
+            levels = None # Unreadable value: same as missing
+        if levels:
+            pdh = self.pdh_cache[symbol] = levels[0]
+            return pdh
+        if symbol not in self.pdh_missing:
+            self.pdh_missing.add(symbol)
+            print(f"WARNING: No prev-day level for {symbol} ({key}). Its breakouts are skipped.")
         return None
 
     # --- SIGNAL GENERATION (Triggered by Candle Stream) ---
@@ -104,59 +365,55 @@ class CashBreakoutStrategy:
         Evaluates a completed 1-minute candle from the Data Worker.
         Creates a PENDING_ENTRY if conditions met.
         """
-        if not self.running or not DHAN_CLIENT: return
-        
-        symbol = candle_data.get('symbol')
-        if not symbol or symbol in self.active_trades: return
-        
-        # 1. Check Strategy Condition: Close > PDH > Open
-        pdh = self.get_prev_day_high(symbol)
-        if not pdh: return
-        
-        open_p = float(candle_data['open'])
-        close_p = float(candle_data['close'])
-        high_p = float(candle_data['high'])
-        low_p = float(candle_data['low'])
-        
-        # Breakout Logic
-        if not (open_p < pdh < close_p): return 
+        self.process_candle_batch([candle_data])
 
-        # 2. Calculate Parameters
-        entry_price = high_p * (1.0 + settings.ENTRY_OFFSET_PCT)
-        stop_loss = low_p * (1.0 - settings.STOP_OFFSET_PCT)
-        risk = entry_price - stop_loss
-        
-        if risk <= 0: return
-        qty = floor(self.settings.per_trade_sl_amount / risk)
-        if qty <= 0: return
+    def process_candle_batch(self, candles):
+        """
+        Evaluates every candle closed in the same minute in one vectorized pass
+        (batch_signals) and creates PENDING_ENTRY trades for the hits, strongest
+        breakout first, until the daily trade limit is reached.
+        """
+        if not self.running or not DHAN_CLIENT or self.pnl_halted: return
+        rows = [c for c in candles if c.get('symbol') and c['symbol'] not in self.active_trades]
+        if not rows: return
 
-        # 3. Check Global Limits
-        if r.incr(self.trade_count_key) > self.settings.max_total_trades:
-            r.decr(self.trade_count_key)
-            return
+        # 1. Strategy Condition: Close > PDH > Open (pre-filtered candles carry their PDH)
+        cfg = self.settings
+        pdh = np.array([c.get('pdh') or self.get_prev_day_high(c['symbol']) or np.nan for c in rows], dtype=float)
+        size_limit = cfg.max_candle_pct if settings.SIGNAL_FILTER_CANDLE_SIZE else None
 
-        # 4. Create PENDING Entry (Do not buy yet)
-        # We wait for the LIVE price to cross 'entry_price' in the next 6 mins
-        try:
-            with transaction.atomic():
-                t = CashBreakoutTrade.objects.create(
-                    strategy=self.settings,
+        # 2. Parameters for the hits (entry / stop / target / qty), ranked
+        for i, entry_price, stop_loss, target, qty in evaluate_breakouts(rows, pdh, cfg, size_limit):
+            candle_data = rows[i]
+            symbol = candle_data['symbol']
+            if symbol in self.active_trades: continue
+
+            # 3. Check Global Limits (best signals take the remaining slots)
+            if r.incr(self.trade_count_key) > cfg.max_total_trades:
+                r.decr(self.trade_count_key)
+                return
+
+            # 4. Create PENDING Entry (Do not buy yet)
+            # We wait for the LIVE price to cross 'entry_price' in the next 6 mins
+            try:
+                t = TRADE_STORE.create(
+                    strategy_id=self.settings.strategy_id,
                     symbol=symbol,
                     security_id=candle_data['security_id'],
                     quantity=qty,
                     status='PENDING_ENTRY',
                     entry_level=round(entry_price, 2),
                     stop_level=round(stop_loss, 2),
-                    target_level=round(entry_price + (settings.RISK_MULTIPLIER * risk), 2),
-                    prev_day_high=pdh,
+                    target_level=round(target, 2),
+                    prev_day_high=float(pdh[i]),
                     candle_ts=datetime.fromisoformat(candle_data['ts']),
-                    created_at=timezone.now()
+                    created_at=now_ist()
                 )
                 self.active_trades[symbol] = t
                 print(f"SIGNAL: {symbol} Pending Entry > {entry_price:.2f}. Monitoring...")
-        except Exception as e:
-            r.decr(self.trade_count_key)
-            print(f"DB Error creating trade for {symbol}: {e}")
+            except Exception as e:
+                r.decr(self.trade_count_key)
+                print(f"DB Error creating trade for {symbol}: {e}")
 
 
     # --- EXECUTION MONITORING (Triggered continuously by Market Data) ---
@@ -166,13 +423,32 @@ class CashBreakoutStrategy:
         Handles Entry Triggers, Time Expiry, SL, Target, TSL.
         """
         if not self.running: return
+        cfg = self.settings
         
         # Global Time Exit
-        if datetime.now(IST).time() >= self.settings.end_time:
+        if now_ist().time() >= cfg.end_time:
             self.close_all_positions("End of Day")
             return
 
+        # Daily P&L limits on realized + unrealized
+        breach = self.pnl.limit_breached(cfg)
+        if breach:
+            self.halt_on_pnl_limit(breach)
+            return
+
         for symbol, trade in list(self.active_trades.items()):
+
+            # Stop and target legs live at the broker: only the breakeven move is left here
+            if trade.order_state == 'BRACKET':
+                if trade.stop_level < trade.entry_level:
+                    ltp = ltp_map.get(trade.security_id, 0)
+                    if ltp and ltp >= self.breakeven_trigger(trade): self.move_bracket_stop(trade)
+                continue
+
+            # In-flight broker request: no new one for this leg until it resolves or times out
+            if trade.order_state:
+                self.check_in_flight(trade)
+                continue
             
             # Get latest price from the map passed by Main Loop
             ltp = ltp_map.get(trade.security_id, 0)
@@ -188,11 +464,11 @@ class CashBreakoutStrategy:
 
                 # 2. Check Expiry (6 Minutes)
                 # Using candle_ts as the reference point
-                expire_time = trade.candle_ts + timedelta(minutes=settings.MAX_MONITORING_MINUTES)
-                if datetime.now(IST) > expire_time:
+                expire_time = trade.candle_ts + timedelta(minutes=cfg.max_monitoring_minutes)
+                if now_ist() > expire_time:
                     trade.status = 'EXPIRED'
                     trade.exit_reason = '6 Min Timeout'
-                    trade.save()
+                    TRADE_STORE.save(trade)
                     del self.active_trades[symbol]
                     r.decr(self.trade_count_key) # Free up limit
                     print(f"EXPIRED: {symbol} (No breakout in 6 mins)")
@@ -201,7 +477,7 @@ class CashBreakoutStrategy:
                 elif ltp <= trade.stop_level:
                     trade.status = 'EXPIRED'
                     trade.exit_reason = 'Price fell below SL before trigger'
-                    trade.save()
+                    TRADE_STORE.save(trade)
                     del self.active_trades[symbol]
                     r.decr(self.trade_count_key)
 
@@ -218,208 +494,853 @@ class CashBreakoutStrategy:
                 
                 # 3. Trailing SL (Breakeven Logic)
                 elif trade.stop_level < trade.entry_level:
-                    risk = trade.entry_level - trade.stop_level
-                    trigger = trade.entry_level + (settings.BREAKEVEN_TRIGGER_R * risk)
-                    if ltp >= trigger:
+                    if ltp >= self.breakeven_trigger(trade):
                         trade.stop_level = trade.entry_level
-                        trade.save()
+                        TRADE_STORE.save(trade)
                         print(f"TSL: {symbol} SL moved to Breakeven.")
 
-    def execute_market_entry(self, trade):
-        """Fires the Market Order when monitoring detects price crossing entry level."""
+    def price_triggers(self, trade) -> Dict[str, tuple]:
+        """Levels monitor_active_trades acts on, registered with the data worker: kind -> (side, price)."""
+        if trade.status == 'PENDING_ENTRY' and not trade.order_state:
+            return {'entry': (SIDE_ABOVE, trade.entry_level), 'stop': (SIDE_BELOW, trade.stop_level)}
+        if trade.status != 'OPEN' or trade.order_state not in IDLE_ORDER_STATES: return {}
+        triggers = {}
+        if trade.stop_level < trade.entry_level:
+            triggers['breakeven'] = (SIDE_ABOVE, round(self.breakeven_trigger(trade), 2))
+        if trade.order_state != 'BRACKET':
+            triggers['target'] = (SIDE_ABOVE, trade.target_level)
+            triggers['stop'] = (SIDE_BELOW, trade.stop_level)
+        return triggers
+
+    def breakeven_trigger(self, trade) -> float:
+        risk = trade.entry_level - trade.stop_level
+        return trade.entry_level + (self.settings.breakeven_trigger_r * risk)
+
+    def move_bracket_stop(self, trade):
+        """Breakeven for a bracket position: modifies the broker-held stop leg."""
         if not DHAN_CLIENT: return
         try:
-            print(f"TRIGGER: {trade.symbol} Crossing {trade.entry_level}. Firing MARKET Buy.")
+            resp = DHAN_CLIENT.modify_order(
+                order_id=trade.entry_order_id,
+                order_type=DHAN_CLIENT.SLM,
+                leg_name='STOP_LOSS_LEG',
+                quantity=trade.quantity,
+                price=0,
+                trigger_price=to_tick(trade.entry_level),
+                disclosed_quantity=0,
+                validity='DAY'
+            )
+            if not isinstance(resp, dict) or resp.get('status') != 'success':
+                print(f"TSL Modify Rejected: {trade.symbol}: {resp}")
+                return
+            trade.stop_level = trade.entry_level
+            TRADE_STORE.save(trade)
+            print(f"TSL: {trade.symbol} bracket SL leg moved to Breakeven.")
+        except BrokerRateLimited as e:
+            print(f"TSL Deferred: {trade.symbol} ({e})")
+        except Exception as e:
+            print(f"TSL Modify Failed {trade.symbol}: {e}")
+
+    def execute_market_entry(self, trade):
+        """Fires the Market Order when monitoring detects price crossing entry level (once per trade)."""
+        if not DHAN_CLIENT or trade.order_state: return
+        signal_t = time.time()
+        tick_wr, tick_read = self.tick_times.get(trade.security_id, (None, None))
+        LATENCY.since(latency.HOP_ENGINE_TO_SIGNAL, tick_read, signal_t)
+        try:
+            print(f"TRIGGER: {trade.symbol} Crossing {trade.entry_level}. Firing MARKET Buy{' (Bracket)' if self.bracket else ''}.")
+            if not self.mark_sent(trade, 'ENTRY_SENT', correlation_id_for(trade, 'B' if self.bracket else 'E')):
+                # A restart could not tell this order was sent: no entry until the DB takes writes again
+                trade.order_state = ''
+                print(f"Entry Deferred: {trade.symbol} (trade state not persisted)")
+                return
+
+            # Bracket: stop and target legs as distances from the fill, held by the broker
+            bracket = {}
+            if self.bracket:
+                bracket = {
+                    'bo_profit_value': to_tick(trade.target_level - trade.entry_level),
+                    'bo_stop_loss_Value': to_tick(trade.entry_level - trade.stop_level),
+                }
             
             # MARKET ORDER
+            sent_t = time.time()
+            LATENCY.record(latency.HOP_SIGNAL_TO_SENT, sent_t - signal_t)
             resp = DHAN_CLIENT.place_order(
                 security_id=trade.security_id,
                 exchange_segment=DHAN_CLIENT.NSE,
                 transaction_type=DHAN_CLIENT.BUY,
                 quantity=trade.quantity,
                 order_type=DHAN_CLIENT.MARKET,
-                product_type=DHAN_CLIENT.INTRA,
+                product_type=DHAN_CLIENT.BO if self.bracket else DHAN_CLIENT.INTRA,
                 price=0,
-                trigger_price=0
+                trigger_price=0,
+                tag=trade.correlation_id,
+                **bracket
             )
+            ack_t = time.time()
             
-            if resp.get('status') == 'success' or resp.get('orderId'):
-                trade.entry_order_id = resp.get('orderId')
+            if order_id_from(resp):
+                LATENCY.record(latency.HOP_SENT_TO_ACK, ack_t - sent_t)
+                trade.entry_order_id = order_id_from(resp)
+                self.order_times[trade.entry_order_id] = (tick_wr, ack_t)
+                remember_order(r, trade.entry_order_id, trade.security_id)
                 # Status remains PENDING_ENTRY until Reconciliation sets it to OPEN
-                # But we flag it to prevent double firing (in memory logic handles this by loop)
-                trade.save() 
+                self.mark_sent(trade, 'ENTRY_ACK')
+                TRADE_STORE.save(trade) 
             else:
+                # Rejected at placement: this leg is done (no re-fire on every pass)
                 print(f"Market Order Failed: {resp}")
-                # Don't delete trade yet, let loop retry or manual intervene
+                self.fail_entry(trade, 'Entry Rejected')
+        except BrokerRateLimited as e:
+            trade.order_state = '' # Nothing was sent: fires again on the next monitor pass
+            TRADE_STORE.save(trade)
+            print(f"Entry Deferred: {trade.symbol} ({e})")
         except Exception as e:
+            # Outcome unknown (timeout / connection error): stays ENTRY_SENT until check_in_flight resolves it
             print(f"Entry Exception: {e}")
 
-    def exit_trade(self, trade, reason):
+    def mark_sent(self, trade, order_state, correlation_id=None) -> bool:
+        """Enters an in-flight order state (its timeout runs from now) and persists it before the broker call."""
+        trade.order_state = order_state
+        if correlation_id: trade.correlation_id = correlation_id
+        trade.order_sent_at = now_ist()
+        return TRADE_STORE.save(trade)
+
+    def mark_exit_sent(self, trade):
+        # Exits go out even if the write failed: an unexited position is the bigger risk
+        self.mark_sent(trade, 'EXIT_SENT', correlation_id_for(trade, 'X'))
+
+    def fail_entry(self, trade, reason):
+        trade.status = 'FAILED_ENTRY'
+        trade.order_state = ''
+        trade.exit_reason = reason
+        TRADE_STORE.save(trade)
+        if self.active_trades.get(trade.symbol) is trade: del self.active_trades[trade.symbol]
+        r.decr(self.trade_count_key)
+
+    def check_in_flight(self, trade):
+        """
+        Resolves an order leg whose ack (ORDER_ACK_TIMEOUT_SEC) or fill (ORDER_FILL_TIMEOUT_SEC)
+        is overdue, from the broker's view of the order (by order id, else by correlation id).
+        """
+        timeout = settings.ORDER_ACK_TIMEOUT_SEC if trade.order_state.endswith('_SENT') else settings.ORDER_FILL_TIMEOUT_SEC
+        if trade.order_sent_at and (now_ist() - trade.order_sent_at).total_seconds() < timeout: return
         if not DHAN_CLIENT: return
+
+        is_entry = trade.order_state.startswith('ENTRY')
+        order_id = trade.entry_order_id if is_entry else trade.exit_order_id
+        state, sent_at = trade.order_state, trade.order_sent_at
+        trade.order_sent_at = now_ist() # Next check after another timeout, whatever happens below
         try:
-            DHAN_CLIENT.place_order(
-                security_id=trade.security_id,
-                exchange_segment=DHAN_CLIENT.NSE,
-                transaction_type=DHAN_CLIENT.SELL,
-                quantity=trade.quantity,
-                order_type=DHAN_CLIENT.MARKET,
-                product_type=DHAN_CLIENT.INTRA,
-                price=0
-            )
-            trade.status = 'PENDING_EXIT'
-            trade.exit_reason = reason
-            trade.save()
-            print(f"EXIT SENT: {trade.symbol} ({reason})")
+            info = query_order(main_loop_broker(), order_id, trade.correlation_id)
+            status = info['status']
+            print(f"IN-FLIGHT TIMEOUT: {trade.symbol} {state} ({trade.correlation_id}) -> broker status {status}")
+            if status:
+                # Fill, rejection or a missed ack: apply it as an order update
+                handle_order_update({'orderId': info['order_id'] or order_id, 'orderStatus': status, 'LegNo': info['leg'],
+                                     'tradedPrice': info['price'] or 0, 'correlationId': trade.correlation_id}, [self])
+                # Only an entry still acked-but-unfilled after the update is stale (it may have filled / failed meanwhile)
+                if (state == 'ENTRY_ACK' and status in OPEN_ORDER_STATUSES and trade.order_state == 'ENTRY_ACK'
+                        and trade.status == 'PENDING_ENTRY' and self.active_trades.get(trade.symbol) is trade):
+                    main_loop_broker().cancel_order(trade.entry_order_id) # The CANCELLED update fails it
+            elif not order_id:
+                # The request never reached the broker: release the leg
+                trade.order_state = idle_state(trade)
+                TRADE_STORE.save(trade)
+        except BrokerRateLimited as e:
+            trade.order_sent_at = sent_at # Still overdue: checked again on the next pass
+            print(f"In-flight Check Deferred {trade.symbol}: {e}")
         except Exception as e:
+            print(f"In-flight Check Failed {trade.symbol}: {e}")
+
+    def exit_trade(self, trade, reason):
+        if not DHAN_CLIENT or trade.order_state not in IDLE_ORDER_STATES: return
+        self.mark_exit_sent(trade)
+        try:
+            resp, sent_t, ack_t = self.send_exit_order(trade, DHAN_CLIENT)
+            self.record_exit(trade, reason, resp, sent_t, ack_t)
+        except BrokerRateLimited as e:
+            trade.order_state = idle_state(trade) # Nothing was sent: exits again on the next monitor pass
+            TRADE_STORE.save(trade)
+            print(f"Exit Deferred: {trade.symbol} ({e})")
+        except Exception as e:
+            # Outcome unknown: stays EXIT_SENT until check_in_flight resolves it
             print(f"Exit Failed {trade.symbol}: {e}")
 
+    def send_exit_order(self, trade, broker):
+        """Broker call only (no state changes), so square-off can run it on a pool thread."""
+        sent_t = time.time()
+        if is_bracket(trade):
+            # Exiting a bracket order cancels its open legs and squares off at market
+            resp = broker.cancel_order(trade.entry_order_id)
+            return resp, sent_t, time.time()
+        resp = broker.place_order(
+            security_id=trade.security_id,
+            exchange_segment=broker.NSE,
+            transaction_type=broker.SELL,
+            quantity=trade.quantity,
+            order_type=broker.MARKET,
+            product_type=broker.INTRA,
+            price=0,
+            tag=trade.correlation_id
+        )
+        return resp, sent_t, time.time()
+
+    def record_exit(self, trade, reason, resp, sent_t, ack_t):
+        trade.exit_reason = reason
+        order_id = order_id_from(resp)
+        if not order_id:
+            # Rejected at placement: nothing in flight, the position stays OPEN for the next exit attempt
+            trade.order_state = idle_state(trade)
+            TRADE_STORE.save(trade)
+            print(f"Exit Rejected: {trade.symbol} ({reason}): {resp}")
+            return
+        # Keep the exit order id so the fill can be matched (and routed to this instance)
+        trade.exit_order_id = order_id
+        LATENCY.record(latency.HOP_SENT_TO_ACK, ack_t - sent_t)
+        self.order_times[order_id] = (None, ack_t)
+        remember_order(r, order_id, trade.security_id)
+        trade.status = 'PENDING_EXIT'
+        self.mark_sent(trade, 'EXIT_ACK')
+        TRADE_STORE.save(trade)
+        print(f"EXIT SENT: {trade.symbol} ({reason})")
+
+    def reconcile_order_update(self, order_data):
+        """Applies a broker-side order status as if it had arrived on the order stream."""
+        handle_order_update(order_data, [self])
+
+    def flag_exit_escalated(self, trade):
+        trade.exit_reason = f"{trade.exit_reason or ''} [UNCONFIRMED - MANUAL]".strip()
+        TRADE_STORE.save(trade)
+
+    def halt_on_pnl_limit(self, reason):
+        """Stops new entries for the day, drops pending entries and exits open positions."""
+        if not self.pnl_halted:
+            print(f"P&L LIMIT: {self.settings.name} {reason} (Total: {self.pnl.total:.2f}). Halting entries.")
+            self.pnl_halted = reason
+        for symbol, t in list(self.active_trades.items()):
+            if t.status == 'PENDING_ENTRY' and not t.order_state and not t.entry_order_id:
+                t.status = 'EXPIRED'
+                t.exit_reason = reason
+                TRADE_STORE.save(t)
+                del self.active_trades[symbol]
+                r.decr(self.trade_count_key)
+        self.close_all_positions(reason)
+
     def close_all_positions(self, reason):
-        for t in self.active_trades.values():
-            if t.status == 'OPEN': self.exit_trade(t, reason)
+        """Starts (or advances) a concurrent square-off of every open position."""
+        job = self.squareoff
+        if job is None or job.done:
+            escalated = job.escalated if job is not None else set()
+            if not DHAN_CLIENT or not any(t.status == 'OPEN' and t.symbol not in escalated for t in self.active_trades.values()): return
+            job = self.squareoff = SquareOffJob(self, DHAN_CLIENT, reason, escalated=escalated, **self.squareoff_opts)
+            job.start()
+        else:
+            job.poll()
+        if job.done: self.publish_squareoff_report()
+
+    def publish_squareoff_report(self):
+        try:
+            r.hset(settings.REDIS_SQUAREOFF_REPORT_KEY, f"{settings.REDIS_CONSUMER_NAME}:{self.settings.name}",
+                   json.dumps(self.squareoff.report(), separators=(',', ':')))
+        except Exception as e:
+            print(f"Square-off Report Error: {e}")
 
 
 # --- RECONCILIATION (Order Updates) ---
 
-def handle_order_update(order_data, strategy):
+def find_order_trade(oid, strategies, correlation_id=None):
+    """Returns (strategy, trade, is_entry) for a broker order id; strategy is None if not hosted here."""
+    # 1. Memory Search
+    for strategy in strategies:
+        for t in strategy.active_trades.values():
+            if t.entry_order_id == oid: return strategy, t, True
+            elif t.exit_order_id == oid: return strategy, t, False
+
+    # In-flight leg whose ack was never seen: matched by its order tag
+    if correlation_id:
+        for strategy in strategies:
+            for t in strategy.active_trades.values():
+                if t.order_state not in IDLE_ORDER_STATES and t.correlation_id == correlation_id:
+                    return strategy, t, t.order_state.startswith('ENTRY')
+
+    # 2. DB Search (Fallback)
+    try:
+        trade, is_entry = TRADE_STORE.find_by_order_id(oid)
+    except: return None, None, False
+    if not trade: return None, None, False
+    for strategy in strategies:
+        if strategy.owns_trade(trade): return strategy, trade, is_entry
+    return None, trade, is_entry
+
+def handle_order_update(order_data, strategies):
     oid = order_data.get('orderId') or order_data.get('OrderNo')
     status = order_data.get('orderStatus') or order_data.get('OrderStatus')
+    cid = order_data.get('correlationId') or order_data.get('CorrelationId')
     if not oid: return
 
-    # Find Trade
-    trade = None
-    is_entry = False
-    
-    # 1. Memory Search
-    for t in strategy.active_trades.values():
-        if t.entry_order_id == oid: trade, is_entry = t, True; break
-        elif t.exit_order_id == oid: trade, is_entry = t, False; break
-    
-    # 2. DB Search (Fallback)
-    if not trade:
-        try:
-            trade = CashBreakoutTrade.objects.filter(entry_order_id=oid).first()
-            if trade: is_entry = True
-            else:
-                trade = CashBreakoutTrade.objects.filter(exit_order_id=oid).first()
-                is_entry = False
-        except: pass
+    # Find Trade (and the strategy it belongs to)
+    strategy, trade, is_entry = find_order_trade(oid, strategies, cid)
+    if not trade or not strategy: return
+    leg = leg_number(order_data)
+    if leg > 1: is_entry = False # Bracket stop (2) / target (3) leg of the entry order
 
-    if not trade: return
+    # Partitioned mode: updates for another instance's symbols are handed to the owner
+    if not strategy.owns(trade.security_id):
+        r.xadd(route_stream(settings.REDIS_STREAM_ORDERS, trade.security_id), {'p': json.dumps(order_data)})
+        return
+
+    # Update raced (or replaced) a lost place_order response: adopt the order id as the ack
+    if trade.order_state in ('ENTRY_SENT', 'EXIT_SENT') and cid and cid == trade.correlation_id:
+        if is_entry:
+            trade.entry_order_id = str(oid)
+        else:
+            trade.exit_order_id = str(oid)
+            trade.status = 'PENDING_EXIT'
+        strategy.mark_sent(trade, 'ENTRY_ACK' if is_entry else 'EXIT_ACK')
+        remember_order(r, oid, trade.security_id)
+        TRADE_STORE.save(trade)
 
     if status == 'TRADED':
         price = float(order_data.get('tradedPrice') or order_data.get('TradedPrice') or 0)
+
+        fill_t = time.time()
+        tick_wr, ack_t = strategy.order_times.pop(oid, (None, None))
+        LATENCY.since(latency.HOP_ACK_TO_FILL, ack_t, fill_t)
+        LATENCY.since(latency.HOP_TICK_TO_FILL, tick_wr, fill_t)
         
         if is_entry and trade.status == 'PENDING_ENTRY':
             trade.status = 'OPEN'
+            trade.order_state = ''
+            if (trade.correlation_id or '').endswith('-B'):
+                # Bracket legs are placed around the fill: track the levels the broker holds
+                stop_dist, target_dist = trade.entry_level - trade.stop_level, trade.target_level - trade.entry_level
+                trade.stop_level = round(price - to_tick(stop_dist), 2)
+                trade.target_level = round(price + to_tick(target_dist), 2)
+                trade.exit_order_id = str(oid)
+                trade.order_state = 'BRACKET'
             trade.entry_price = price
-            trade.entry_time = timezone.now()
-            trade.save()
+            trade.entry_time = now_ist()
+            TRADE_STORE.save(trade)
             strategy.active_trades[trade.symbol] = trade
+            strategy.pnl.open(trade.security_id, trade.symbol, trade.quantity, price)
             print(f"CONFIRMED: {trade.symbol} Bought @ {price}")
             
         elif not is_entry and trade.status in ['OPEN', 'PENDING_EXIT']:
+            if trade.status == 'OPEN' and leg > 1: trade.exit_reason = 'Stop Loss Hit (Bracket)' if leg == 2 else 'Target Hit (Bracket)'
             trade.status = 'CLOSED'
+            trade.order_state = ''
             trade.exit_price = price
-            trade.exit_time = timezone.now()
+            trade.exit_time = now_ist()
             trade.pnl = (price - trade.entry_price) * trade.quantity
-            trade.save()
+            TRADE_STORE.save(trade)
             if trade.symbol in strategy.active_trades: del strategy.active_trades[trade.symbol]
             r.incrbyfloat(strategy.daily_pnl_key, trade.pnl)
+            strategy.pnl.close(trade.security_id, trade.pnl)
+            if strategy.squareoff is not None: strategy.squareoff.on_closed(trade)
             print(f"CONFIRMED: {trade.symbol} Sold. PnL: {trade.pnl}")
 
     elif status in ['CANCELLED', 'REJECTED', 'EXPIRED']:
-        if is_entry:
-            trade.status = 'FAILED_ENTRY'
-            trade.save()
-            if trade.symbol in strategy.active_trades: del strategy.active_trades[trade.symbol]
-            r.decr(strategy.trade_count_key)
+        if is_entry and trade.status == 'PENDING_ENTRY':
+            strategy.fail_entry(trade, f"Entry {status.title()}")
+        elif leg > 1:
+            # The sibling of a filled bracket leg (or a leg cancelled outside the engine)
+            if trade.status in ['OPEN', 'PENDING_EXIT']: print(f"BRACKET LEG {leg} {status}: {trade.symbol} (order {oid}).")
+        elif not is_entry and trade.status in ['OPEN', 'PENDING_EXIT'] and (not cid or cid == trade.correlation_id):
+            # Dead exit leg: the position is OPEN again and the next exit attempt sends a new order
+            trade.status = 'OPEN'
+            trade.order_state = idle_state(trade)
+            TRADE_STORE.save(trade)
+            print(f"EXIT {status}: {trade.symbol} (order {oid}). Position still open.")
+
+# --- STRATEGY RUNTIME ---
+
+# StrategySettings.strategy_type -> strategy class
+STRATEGY_REGISTRY = {
+    'CASH_ALGO_1': CashBreakoutStrategy,
+}
+
+class StrategyRuntime:
+    """
+    Hosts every configured strategy in one engine process over a single market-data fan-out.
+    - Each stream entry is read and JSON-decoded once, whatever the number of strategies.
+    - Candles go to every running strategy; ticks update the shared LTP cache and only wake the
+      strategies holding a trade on that security; order updates go to the owning strategy.
+    - CPU time spent inside each strategy is accounted and published with the heartbeat.
+    """
+    def __init__(self, owned_partitions=None):
+        self.owned_partitions = set(owned_partitions) if owned_partitions is not None else {0}
+        self.strategies: Dict[Any, CashBreakoutStrategy] = {}
+        self.tick_times = {} # Shared by all strategies (latency stamps per security)
+        self.pdh_cache = {}  # Shared prev-day highs: the session's levels in one HGETALL, HGET for late symbols
+        self.cpu: Dict[Any, list] = {} # strategy key -> [cpu seconds, calls]
+        self.minutes: Dict[Any, list] = {} # Candle ts -> [candles, acks, last queued]; evaluated by flush_candles
+        self.ticked = set() # Securities with a new price since the last monitor pass
+        self.last_sweep = 0.0
+        self.last_pnl_publish = 0.0
+        self.load_levels()
+        self.load()
+
+    # --- LIFECYCLE ---
+    def load(self):
+        """Instantiates enabled strategies, plus disabled ones that still hold active trades."""
+        try:
+            rows = list(StrategySettings.objects.order_by('pk'))
+            live_ids = TRADE_STORE.active_strategy_ids()
+        except Exception as e:
+            print(f"Runtime: Strategy load failed ({e}).")
+            return
+
+        orphan_owner = next((row.pk for row in rows if row.strategy_type in STRATEGY_REGISTRY), None)
+        for row in rows:
+            if row.pk in self.strategies: continue
+            if not row.is_enabled and row.pk not in live_ids and not (row.pk == orphan_owner and None in live_ids):
+                continue
+            cls = STRATEGY_REGISTRY.get(row.strategy_type)
+            if cls is None:
+                print(f"Runtime: No strategy class for '{row.strategy_type}' ({row.name}). Skipping.")
+                continue
+            strategy = cls(self.owned_partitions, strategy_settings=row, adopt_orphans=(row.pk == orphan_owner))
+            strategy.tick_times = self.tick_times
+            strategy.pdh_cache = self.pdh_cache
+            self.strategies[strategy.key] = strategy
+            self.cpu.setdefault(strategy.key, [0.0, 0])
+            print(f"Runtime: Loaded {row.name} [{row.strategy_type}] (running={strategy.running}).")
+
+    def load_levels(self):
+        """Prev-day highs of the expected session (prev_day_levels), shared by all strategies."""
+        try:
+            self.pdh_cache.update(load_highs(r, expected_session(now_ist())))
+            print(f"Runtime: Loaded prev-day levels for {len(self.pdh_cache)} symbols.")
+        except Exception as e:
+            print(f"Runtime: Prev-day levels unavailable ({e}).")
+
+    def reload(self, reload_trades=False):
+        """UPDATE_CONFIG: refreshes existing strategies and picks up newly enabled rows."""
+        for strategy in self.strategies.values():
+            strategy.reload_settings(reload_trades=reload_trades)
+        self.load()
+
+    def set_partitions(self, owned):
+        self.owned_partitions = set(owned)
+        for strategy in self.strategies.values():
+            strategy.owned_partitions = set(owned)
+            strategy.load_trades()
+
+    def owns(self, security_id) -> bool:
+        return partition_for(security_id) in self.owned_partitions
+
+    def active_count(self) -> int:
+        return sum(len(s.active_trades) for s in self.strategies.values())
+
+    # --- DISPATCH ---
+    def _timed(self, strategy, fn, *args):
+        t = time.thread_time()
+        try:
+            fn(*args)
+        finally:
+            acc = self.cpu[strategy.key]
+            acc[0] += time.thread_time() - t
+            acc[1] += 1
+
+    def on_candle(self, candle, ack=None):
+        """Queues a candle under its minute; flush_candles evaluates (and acks) the minute."""
+        minute = self.minutes.setdefault(candle.get('ts'), [[], [], 0.0])
+        minute[0].append(candle)
+        if ack: minute[1].append(ack)
+        minute[2] = time.monotonic()
+
+    def flush_candles(self, force=False):
+        """
+        Hands each strategy a closing minute's candles as one batch. A minute can span several
+        reads (XREADGROUP count, several partition streams), so it is held until a later minute's
+        candle arrives or none of its own arrived for ENGINE_CANDLE_SETTLE_SEC; force evaluates
+        everything queued (PEL replay). Candles on partitions owned by another engine instance
+        are ranked by that instance.
+        """
+        if not self.minutes: return
+        pending = list(self.minutes)
+        last = self.minutes[pending[-1]]
+        if not force and time.monotonic() - last[2] < settings.ENGINE_CANDLE_SETTLE_SEC:
+            pending.pop() # Latest minute may still be arriving
+        acks = []
+        try:
+            for ts in pending:
+                batch, minute_acks, _ = self.minutes.pop(ts)
+                acks.extend(minute_acks)
+                for strategy in self.strategies.values():
+                    if strategy.running: self._timed(strategy, strategy.process_candle_batch, batch)
+        finally:
+            if acks:
+                try:
+                    pipe = r.pipeline(transaction=False)
+                    for stream_name, group, message_id in acks: pipe.xack(stream_name, group, message_id)
+                    pipe.execute()
+                except Exception as e:
+                    print(f"Candle Ack Error: {e}")
+
+    def on_tick(self, sec_id, ltp):
+        if TRIGGERS is None: self.ticked.add(sec_id) # With price triggers, crossings wake the monitor instead
+        for strategy in self.strategies.values():
+            strategy.pnl.mark(sec_id, ltp)
+
+    def on_trigger(self, event):
+        TRIGGERS.fired(event.get('t'), event.get('k'))
+        self.ticked.add(str(event.get('securityId')))
+
+    def sync_triggers(self):
+        """Registers / cancels price triggers to match every hosted trade's current levels."""
+        TRIGGERS.sync({
+            t.id: (t.security_id, strategy.price_triggers(t))
+            for strategy in self.strategies.values() if strategy.running
+            for t in strategy.active_trades.values()
+        })
+
+    def on_order_update(self, order_data):
+        # Apply finished square-off sends first so their exit order ids are known to the fill
+        for strategy in self.strategies.values():
+            if strategy.squareoff is not None and not strategy.squareoff.done: strategy.squareoff.poll()
+        handle_order_update(order_data, list(self.strategies.values()))
+
+    def monitor(self, ltp_map):
+        """
+        Runs monitor passes for strategies whose trades saw a new price; every
+        ENGINE_MONITOR_SWEEP_SEC all strategies with trades are swept for time-based exits.
+        Strategies with a square-off in progress run every pass until it completes.
+        """
+        sweep = time.monotonic() - self.last_sweep >= settings.ENGINE_MONITOR_SWEEP_SEC
+        ticked = self.ticked
+        for strategy in self.strategies.values():
+            if strategy.squareoff is not None and not strategy.squareoff.done:
+                self._timed(strategy, strategy.monitor_active_trades, ltp_map)
+                continue
+            trades = strategy.active_trades
+            if not trades: continue
+            if sweep or any(t.security_id in ticked and needs_ticks(t) for t in trades.values()):
+                self._timed(strategy, strategy.monitor_active_trades, ltp_map)
+        ticked.clear()
+        if sweep: self.last_sweep = time.monotonic()
+
+    # --- STATE ---
+    def save_snapshot(self, ltp_map):
+        """Writes one compact JSON snapshot (all strategies' trades + LTP cache) to Redis."""
+        snapshot = {
+            'ts': now_ist().isoformat(),
+            'date': now_ist().strftime('%Y-%m-%d'),
+            'strategies': {str(k): s.snapshot_trades() for k, s in self.strategies.items()},
+            'ltp': ltp_map,
+        }
+        try:
+            r.set(snapshot_key(), json.dumps(snapshot, separators=(',', ':')))
+        except Exception as e:
+            print(f"Snapshot Error: {e}")
+
+    def restore_snapshot(self, ltp_map):
+        """
+        Restores today's snapshot. The LTP cache is always seeded from it so monitoring can act
+        on the first loop pass; trades come from the snapshot only if the DB load failed.
+        Returns the number of LTP entries restored.
+        """
+        try:
+            raw = r.get(snapshot_key())
+            if not raw: return 0
+            snapshot = json.loads(raw)
+        except Exception as e:
+            print(f"Snapshot Read Error: {e}")
+            return 0
+
+        if snapshot.get('date') != now_ist().strftime('%Y-%m-%d'):
+            print("Snapshot: Ignoring stale snapshot from a previous session.")
+            return 0
+
+        ltp_map.update({k: v for k, v in (snapshot.get('ltp') or {}).items() if self.owns(k)})
+
+        saved = snapshot.get('strategies') or {}
+        for key, strategy in self.strategies.items():
+            rows = saved.get(str(key))
+            if rows is None and strategy.adopt_orphans: rows = snapshot.get('trades') # Single-strategy format
+            restored = strategy.restore_trades(rows)
+            if restored: print(f"Snapshot: DB unavailable, restored {restored} trades for {strategy.settings.name} from {snapshot.get('ts')}.")
+        return len(ltp_map)
+
+    def maybe_publish_pnl(self):
+        """Publishes each strategy's P&L snapshot, at most every PNL_PUBLISH_INTERVAL_SEC and only on change."""
+        now = time.time()
+        if now - self.last_pnl_publish < settings.PNL_PUBLISH_INTERVAL_SEC: return
+        changed = {
+            f"{settings.REDIS_CONSUMER_NAME}:{s.settings.name}": json.dumps(dict(s.pnl.snapshot(), halted=s.pnl_halted), separators=(',', ':'))
+            for s in self.strategies.values() if s.pnl.updated_at > self.last_pnl_publish
+        }
+        self.last_pnl_publish = now
+        if not changed: return
+        try:
+            r.hset(settings.REDIS_PNL_KEY, mapping=changed)
+        except Exception as e:
+            print(f"P&L Publish Error: {e}")
+
+    def publish_stats(self):
+        """Per-strategy CPU time / calls / trades into a Redis hash (field per instance + strategy)."""
+        stats = {}
+        for key, strategy in self.strategies.items():
+            cpu_s, calls = self.cpu[key]
+            stats[f"{settings.REDIS_CONSUMER_NAME}:{strategy.settings.name}"] = json.dumps({
+                'cpu_ms': round(cpu_s * 1000, 1), 'calls': calls,
+                'active_trades': len(strategy.active_trades), 'running': strategy.running,
+            })
+        if not stats: return
+        try:
+            r.hset(settings.REDIS_STRATEGY_STATS_KEY, mapping=stats)
+        except Exception as e:
+            print(f"Strategy Stats Error: {e}")
+
+# --- MESSAGE DISPATCH ---
+
+def process_stream_message(stream_name, message_id, data, runtime, ltp_map, group=None):
+    """Routes one stream entry to the strategy runtime and acks it (shared by live and pending replay)."""
+    global DHAN_CLIENT
+    group = group or settings.REDIS_CONSUMER_GROUP
+    kind = base_stream(stream_name) # Partition streams dispatch like their base stream
+    try:
+        # Entries trimmed from the stream while pending come back with no body
+        if not data:
+            r.xack(stream_name, group, message_id)
+            return
+
+        payload = json.loads(data.get('p'))
+
+        # A. Candle (or pre-filtered signal) Arrived -> Check for New Signal
+        if kind == settings.REDIS_STREAM_CANDLES or kind == settings.REDIS_STREAM_SIGNALS:
+            LATENCY.since(latency.HOP_FINALIZE_TO_ENGINE, payload.get('fz'))
+            runtime.on_candle(payload, (stream_name, group, message_id))
+            return # Acked after the minute's batch is evaluated
+        
+        # B. Tick Arrived -> Update Local LTP Cache
+        elif kind == settings.REDIS_STREAM_MARKET:
+            # Basic LTP extraction
+            sec_id = str(payload.get('securityId', ''))
+            ltp = float(payload.get('LTP') or payload.get('last_price') or payload.get('lp') or 0)
+            if sec_id and ltp > 0:
+                ltp_map[sec_id] = ltp
+                read_t = time.time()
+                LATENCY.since(latency.HOP_WORKER_TO_ENGINE, payload.get('wr'), read_t)
+                runtime.tick_times[sec_id] = (payload.get('wr'), read_t)
+                runtime.on_tick(sec_id, ltp)
+                
+        # B2. Price Trigger Crossed (data worker) -> Monitor that security
+        elif kind == settings.REDIS_STREAM_TRIGGER_EVENTS:
+            sec_id = str(payload.get('securityId', ''))
+            ltp = float(payload.get('LTP') or 0)
+            if sec_id and ltp > 0 and TRIGGERS is not None:
+                ltp_map[sec_id] = ltp
+                read_t = time.time()
+                LATENCY.since(latency.HOP_WORKER_TO_ENGINE, payload.get('wr'), read_t)
+                runtime.tick_times[sec_id] = (payload.get('wr'), read_t)
+                runtime.on_trigger(payload)
+
+        # C. Order Update -> Reconcile
+        elif kind == settings.REDIS_STREAM_ORDERS:
+            runtime.on_order_update(payload)
+        
+        # D. Control
+        elif kind == settings.REDIS_STREAM_CONTROL:
+            if payload.get('action') == 'UPDATE_CONFIG':
+                runtime.reload(reload_trades=payload.get('reload_trades', False))
+            elif payload.get('action') == 'TOKEN_REFRESH':
+                DHAN_CLIENT = get_dhan_client(payload.get('token'))
+
+        r.xack(stream_name, group, message_id)
+
+    except Exception as e:
+        # Log but ack to prevent getting stuck
+        print(f"Msg Error: {e}")
+        r.xack(stream_name, group, message_id)
+
+def recover_pending_messages(streams, runtime, ltp_map, group=None):
+    """
+    Warm restart: processes entries that were delivered but never acked before new traffic.
+    1. XAUTOCLAIM entries idling on consumers that no longer exist (e.g. a renamed dyno
+       or the dead previous owner of a partition).
+    2. Re-read this consumer's own pending list from id 0.
+    Returns the number of entries replayed.
+    """
+    group = group or settings.REDIS_CONSUMER_GROUP
+    replayed = 0
+    for stream in streams:
+        # 1. Claim orphaned entries into our PEL
+        try:
+            start_id = '0-0'
+            while True:
+                resp = r.xautoclaim(
+                    stream, group, settings.REDIS_CONSUMER_NAME,
+                    min_idle_time=settings.PENDING_CLAIM_MIN_IDLE_MS, start_id=start_id,
+                    count=500
+                )
+                start_id = resp[0]
+                if start_id == '0-0': break
+        except redis.exceptions.ResponseError as e:
+            print(f"XAUTOCLAIM unavailable on {stream}: {e}")
+
+        # 2. Replay our PEL in id order
+        last_id = '0'
+        while True:
+            resp = r.xreadgroup(
+                group, settings.REDIS_CONSUMER_NAME,
+                {stream: last_id}, count=200
+            )
+            if not resp or not resp[0][1]: break
+            for message_id, data in resp[0][1]:
+                last_id = message_id
+                process_stream_message(stream, message_id, data, runtime, ltp_map, group)
+                replayed += 1
+        runtime.flush_candles(force=True)
+    return replayed
+
+def publish_startup_report(timings: Dict[str, float], counts: Dict[str, int]):
+    """Prints phase timings and stores them in Redis for the dashboard/ops."""
+    report = {k: round(v * 1000, 2) for k, v in timings.items()} # ms
+    report.update(counts)
+    report['ts'] = datetime.now(IST).isoformat()
+    print("Startup Report: " + ", ".join(f"{k}={v}" for k, v in report.items()))
+    try:
+        r.delete(settings.REDIS_ENGINE_STARTUP_REPORT_KEY)
+        r.hset(settings.REDIS_ENGINE_STARTUP_REPORT_KEY, mapping=report)
+    except Exception as e:
+        print(f"Startup Report Error: {e}")
+
+def apply_partitions(runtime, owned, ltp_map) -> list:
+    """Rebinds this instance after a rebalance: groups, owned trades/prices, orphaned entries."""
+    streams = owned_streams(owned)
+    setup_consumer_groups(streams)
+    runtime.set_partitions(owned)
+    for sec_id in [k for k in ltp_map if not runtime.owns(k)]:
+        del ltp_map[sec_id]
+    replayed = recover_pending_messages(streams, runtime, ltp_map)
+    print(f"Partitions: Owning {sorted(owned)} of {partition_count()} "
+          f"({runtime.active_count()} trades, {replayed} replayed).")
+    return streams
+
+def read_streams(data_streams):
+    """One XREADGROUP over owned data streams (+ control, separately when partitioned)."""
+    streams = {s: '>' for s in data_streams}
+    if control_group() == settings.REDIS_CONSUMER_GROUP:
+        streams[settings.REDIS_STREAM_CONTROL] = '>'
+
+    response = r.xreadgroup(
+        settings.REDIS_CONSUMER_GROUP, 
+        settings.REDIS_CONSUMER_NAME, 
+        streams, 
+        count=200, 
+        block=100
+    ) or []
+    batches = [(stream_name, messages, settings.REDIS_CONSUMER_GROUP) for stream_name, messages in response]
+
+    if control_group() != settings.REDIS_CONSUMER_GROUP:
+        control = r.xreadgroup(
+            control_group(), settings.REDIS_CONSUMER_NAME,
+            {settings.REDIS_STREAM_CONTROL: '>'}, count=50
+        ) or []
+        batches.extend((stream_name, messages, control_group()) for stream_name, messages in control)
+    return batches
 
 # --- MAIN LOOP ---
 
 def run_algo_engine():
     global DHAN_CLIENT
+    timings = {'boot_ms': time.perf_counter() - _BOOT_T0}
+    t0 = time.perf_counter()
+
     r.set(settings.REDIS_STATUS_ALGO_ENGINE, 'STARTING')
-    setup_consumer_groups()
+
+    # Partition assignment (single engine owns partition 0 = the base streams)
+    membership = PartitionMembership(r, settings.REDIS_CONSUMER_NAME)
+    membership.heartbeat()
+    data_streams = owned_streams(membership.owned)
+    setup_consumer_groups(data_streams)
+    setup_consumer_groups([settings.REDIS_STREAM_CONTROL], control_group())
+    timings['consumer_groups_ms'] = time.perf_counter() - t0
     
-    strategy = CashBreakoutStrategy()
+    t = time.perf_counter()
+    runtime = StrategyRuntime(membership.owned)
+    timings['load_trades_ms'] = time.perf_counter() - t
     
     # Local LTP Cache (Updated by Market Stream)
     # This ensures the Strategy Monitor loop has the latest prices
     local_ltp_map = {} 
 
+    t = time.perf_counter()
+    restored_ltp = runtime.restore_snapshot(local_ltp_map)
+    timings['snapshot_restore_ms'] = time.perf_counter() - t
+
     token = r.get(settings.REDIS_DHAN_TOKEN_KEY)
-    if token: DHAN_CLIENT = get_dhan_client(token)
+    if token or settings.BROKER_MODE == 'SIM': DHAN_CLIENT = get_dhan_client(token)
+
+    # Drain unacked fills/candles from before the restart ahead of new messages
+    t = time.perf_counter()
+    replayed = recover_pending_messages(data_streams, runtime, local_ltp_map)
+    replayed += recover_pending_messages([settings.REDIS_STREAM_CONTROL], runtime, local_ltp_map, control_group())
+    timings['pending_replay_ms'] = time.perf_counter() - t
+    timings['total_ms'] = time.perf_counter() - t0
+
+    publish_startup_report(timings, {
+        'strategies': len(runtime.strategies),
+        'active_trades': runtime.active_count(),
+        'restored_ltp': restored_ltp,
+        'replayed_messages': replayed,
+        'partitions': ','.join(str(p) for p in sorted(membership.owned)),
+    })
 
     r.set(settings.REDIS_STATUS_ALGO_ENGINE, 'RUNNING')
     print("Algo Engine Running (Consumer Mode).")
 
-    while True:
-        connections.close_old_connections()
-        try:
-            # Read from all relevant streams
-            streams = {
-                settings.REDIS_STREAM_CANDLES: '>', # New Candles
-                settings.REDIS_STREAM_MARKET: '>',  # Live Ticks (for monitoring)
-                settings.REDIS_STREAM_ORDERS: '>',  # Fills
-                settings.REDIS_STREAM_CONTROL: '>'
-            }
-            
-            response = r.xreadgroup(
-                settings.REDIS_CONSUMER_GROUP, 
-                settings.REDIS_CONSUMER_NAME, 
-                streams, 
-                count=200, 
-                block=100
-            )
+    last_snapshot = time.monotonic()
+    last_heartbeat = time.monotonic()
 
-            # Always run monitoring loop (even if no new messages)
-            if strategy.active_trades and local_ltp_map:
-                strategy.monitor_active_trades(local_ltp_map)
-
-            if not response: continue
-
-            for stream_name, messages in response:
-                for message_id, data in messages:
-                    try:
-                        payload = json.loads(data.get('p'))
-
-                        # A. Candle Arrived -> Check for New Signal
-                        if stream_name == settings.REDIS_STREAM_CANDLES:
-                            strategy.process_new_candle(payload)
-                        
-                        # B. Tick Arrived -> Update Local LTP Cache
-                        elif stream_name == settings.REDIS_STREAM_MARKET:
-                            # Basic LTP extraction
-                            sec_id = str(payload.get('securityId', ''))
-                            ltp = float(payload.get('LTP') or payload.get('last_price') or payload.get('lp') or 0)
-                            if sec_id and ltp > 0:
-                                local_ltp_map[sec_id] = ltp
-                                # Immediately check triggers for this specific symbol to reduce latency
-                                # (Optimized call inside monitor loop handles bulk, but this handles instant trigger)
-                                
-                        # C. Order Update -> Reconcile
-                        elif stream_name == settings.REDIS_STREAM_ORDERS:
-                            handle_order_update(payload, strategy)
-                        
-                        # D. Control
-                        elif stream_name == settings.REDIS_STREAM_CONTROL:
-                            if payload.get('action') == 'UPDATE_CONFIG':
-                                strategy.settings.refresh_from_db()
-                                strategy.running = strategy.settings.is_enabled
-                                strategy.load_trades()
-                                print(f"Config Updated. Strategy Running: {strategy.running}")
-                            elif payload.get('action') == 'TOKEN_REFRESH':
-                                DHAN_CLIENT = get_dhan_client(payload.get('token'))
-
-                        r.xack(stream_name, settings.REDIS_CONSUMER_GROUP, message_id)
-
-                    except Exception as e:
-                        # Log but ack to prevent getting stuck
-                        print(f"Msg Error: {e}")
-                        r.xack(stream_name, settings.REDIS_CONSUMER_GROUP, message_id)
+    try:
+        while True:
+            DB.ensure() # Time-budgeted health check / recycle, not a per-iteration close_old_connections
+            try:
+                # Membership heartbeat -> rebalance when an instance joins or dies
+                if time.monotonic() - last_heartbeat >= settings.ENGINE_HEARTBEAT_SEC:
+                    changed = membership.heartbeat()
+                    if changed is not None:
+                        data_streams = apply_partitions(runtime, changed, local_ltp_map)
+                    runtime.publish_stats()
+                    DB.publish()
+                    last_heartbeat = time.monotonic()
 
-        except Exception as e:
-            time.sleep(1)
+                LATENCY.maybe_flush()
+                TRADE_STORE.maybe_flush() # Batched trade events + changed columns
+                runtime.maybe_publish_pnl()
+
+                # Periodic warm-restart snapshot
+                if time.monotonic() - last_snapshot >= settings.ENGINE_SNAPSHOT_INTERVAL_SEC:
+                    runtime.save_snapshot(local_ltp_map)
+                    last_snapshot = time.monotonic()
+
+                # New / changed trade levels (last pass and dispatch) -> data worker trigger book
+                if TRIGGERS is not None: runtime.sync_triggers()
+
+                # Read from all relevant streams
+                response = read_streams(data_streams)
+
+                # Always run monitoring loop (even if no new messages)
+                if local_ltp_map:
+                    runtime.monitor(local_ltp_map)
+
+                if not response and not runtime.minutes: continue
+
+                DB.before_writes() # Fills / signals below may write trades
+                for stream_name, messages, group in response:
+                    for message_id, data in messages:
+                        process_stream_message(stream_name, message_id, data, runtime, local_ltp_map, group)
+                runtime.flush_candles() # Minutes whose candles have all arrived
+
+            except Exception as e:
+                time.sleep(1)
+    finally:
+        TRADE_STORE.flush()
+        membership.leave()
 
 if __name__ == '__main__':
     run_algo_engine()
\ No newline at end of file
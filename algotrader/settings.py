@@ -365,12 +365,19 @@ TEMPLATES = [
 # -------------------------------------------------------------------
 
 REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+# redis.from_url kwargs: Heroku Redis is TLS with a self-signed cert; plain redis:// (local/SIM) rejects ssl_* args
+REDIS_CONN_KWARGS = {'decode_responses': True}
+if REDIS_URL.startswith('rediss://'):
+    REDIS_CONN_KWARGS['ssl_cert_reqs'] = None
 
 # Streams (Primary Data Flow)
 REDIS_STREAM_MARKET = 'stream:dhan:market'      # Raw Ticks
 REDIS_STREAM_CANDLES = 'stream:dhan:candles'    # Completed 1m Candles
+REDIS_STREAM_SIGNALS = 'stream:dhan:signals'    # Breakout candidate candles (worker pre-filter)
 REDIS_STREAM_ORDERS = 'stream:dhan:orders'      # Order Updates
 REDIS_STREAM_CONTROL = 'stream:algo:control'    # Admin Signals
+REDIS_STREAM_TRIGGER_REGS = 'stream:algo:triggers'    # Price trigger registrations (engine -> worker)
+REDIS_STREAM_TRIGGER_EVENTS = 'stream:dhan:triggers'  # Crossed price triggers (worker -> engine)
 
 # Pub/Sub (Legacy/Backup)
 REDIS_DATA_CHANNEL = 'dhan_market_data'
@@ -387,10 +394,132 @@ REDIS_CONSUMER_NAME = f"algo_worker_{os.environ.get('DYNO', 'local')}"
 REDIS_STATUS_DATA_ENGINE = 'data_engine_status'
 REDIS_STATUS_ALGO_ENGINE = 'algo_engine_status'
 REDIS_DHAN_TOKEN_KEY = 'dhan_access_token'
-PREV_DAY_HASH = 'prev_day_ohlc'
+PREV_DAY_HASH = 'prev_day_ohlc' # Levels live in '<PREV_DAY_HASH>:<session date>' (see prev_day_levels.py)
 LIVE_OHLC_KEY = 'live_ohlc_data'
 SYMBOL_ID_MAP_KEY = 'dhan_instrument_map'
 HISTORY_KEY_PREFIX = 'history' # Prefix for candle history lists
+REDIS_ENGINE_SNAPSHOT_KEY = 'algo_engine_snapshot'          # Warm-restart state (JSON), suffixed with consumer name
+REDIS_ENGINE_STARTUP_REPORT_KEY = 'algo_engine_startup_report' # Hash of startup phase timings
+
+# Warm Restart
+ENGINE_SNAPSHOT_INTERVAL_SEC = 2      # How often the engine snapshots its state to Redis
+PENDING_CLAIM_MIN_IDLE_MS = 15000     # Unacked entries idle this long on another consumer are reclaimed
+
+# Horizontal Scaling (Symbol Partitions) - see partitions.py
+ENGINE_PARTITIONS = int(os.environ.get('ENGINE_PARTITIONS', '1')) # 1 = single engine on the base streams
+ENGINE_HEARTBEAT_SEC = 2              # Membership/lease refresh interval
+ENGINE_MEMBER_TTL_SEC = 10            # Instance considered dead after this long without a heartbeat
+REDIS_ENGINE_MEMBERS_KEY = 'algo_engine_members'       # ZSET consumer name -> last heartbeat
+REDIS_ENGINE_LEASE_PREFIX = 'algo_engine_partition'    # <prefix>:<n> -> owning consumer name
+REDIS_ORDER_PARTITION_HASH = 'algo_order_partition'    # orderId -> partition (routing fallback)
+MARKET_STREAM_MAXLEN = 20000          # Approximate cap per market stream
+
+# DB Connections - see db_health.py (engine / data worker / management commands)
+DB_HEALTH_CHECK_SEC = 30              # Idle loops re-check the connection at most this often
+DB_WRITE_CHECK_SEC = 1                # Before a batch of writes, unless checked this recently
+DB_RECONNECT_BACKOFF_SEC = 0.5        # First retry delay after a failed reconnect (doubles)
+DB_RECONNECT_BACKOFF_MAX_SEC = 30
+REDIS_DB_HEALTH_KEY = 'db_health'     # Hash '<process name>' -> JSON connection stats
+
+# Trade Event Log - see trade_events.py (engine trade writes are batched)
+TRADE_EVENT_FLUSH_SEC = 0.5           # Buffered trade events / row changes are written at least this often
+TRADE_EVENT_BATCH_SIZE = 500          # ...or as soon as this many events are buffered
+ARCHIVE_BATCH_SIZE = 1000             # archive_trades: trades moved per transaction
+DASHBOARD_SUMMARY_DAYS = 10           # Days of DailyTradeSummary shown on the dashboard
+
+# Strategy Runtime - see algo_engine.StrategyRuntime
+ENGINE_MONITOR_SWEEP_SEC = 1          # Full monitor pass (time exits / expiry) even without new ticks
+ENGINE_CANDLE_SETTLE_SEC = 0.05       # A minute's candles are ranked together once none arrived for this long
+REDIS_STRATEGY_STATS_KEY = 'algo_strategy_stats'       # Hash '<consumer>:<strategy>' -> JSON CPU/calls/trades
+
+# Live P&L - see pnl_tracker.py
+REDIS_PNL_KEY = 'algo_pnl'            # Hash '<consumer>:<strategy>' -> JSON mark-to-market snapshot
+PNL_PUBLISH_INTERVAL_SEC = 1          # Max publish rate per engine
+
+# In-flight Orders - CashBreakoutTrade.order_state (one broker request per trade leg)
+ORDER_ACK_TIMEOUT_SEC = 5             # *_SENT without an order id this long -> look up by correlation id
+ORDER_FILL_TIMEOUT_SEC = 30           # *_ACK without a fill this long -> check status with the broker
+
+# Execution Mode - 'ENGINE': stop/target/breakeven run in monitor_active_trades on every tick,
+# 'BRACKET': entries are Dhan bracket orders (stop and target legs held at the broker); the
+# engine only moves the stop leg to breakeven and reconciles leg fills from the order stream
+EXECUTION_MODE = os.environ.get('EXECUTION_MODE', 'ENGINE').upper()
+PRICE_TICK_SIZE = 0.05                # NSE equity tick; bracket leg distances are rounded to it
+
+# Candle Signal Pre-filter - see signal_filter.py (engine reads REDIS_STREAM_SIGNALS instead of candles)
+SIGNAL_FILTER_ENABLED = os.environ.get('SIGNAL_FILTER_ENABLED', 'False') == 'True'
+SIGNAL_FILTER_CANDLE_SIZE = os.environ.get('SIGNAL_FILTER_CANDLE_SIZE', 'False') == 'True' # Apply max_candle_pct too
+SIGNAL_FILTER_RELOAD_SEC = 300        # Prev-day highs / strategy candle limits refresh in the worker
+
+# Prev-day OHLC Fetch - see prev_day_fetcher.py (fetch_prev_day_ohlc management command)
+PREV_DAY_FETCH_WORKERS = 8            # Concurrent historical_daily_data calls (paced by the 'data' bucket)
+PREV_DAY_FETCH_ATTEMPTS = 4           # Tries per symbol before it is reported as failed
+PREV_DAY_RETRY_BACKOFF_SEC = 1        # First retry delay (exponential)
+PREV_DAY_RETRY_BACKOFF_MAX_SEC = 10
+PREV_DAY_LOOKBACK_DAYS = 7            # Calendar days requested; the last bar is the previous session
+PREV_DAY_WRITE_CHUNK = 100            # Symbols per pipelined HSET
+REDIS_PREV_DAY_REPORT_KEY = 'prev_day_fetch_report' # JSON report of the last run
+PREV_DAY_LEVELS_TTL_SEC = 10 * 86400  # Session level hashes expire after this
+
+# Exchange holidays (weekdays without a session) - see trading_calendar.py. Keep in sync with the
+# NSE holiday circular; NSE_EXTRA_HOLIDAYS (comma-separated YYYY-MM-DD) adds ad-hoc closures.
+NSE_HOLIDAYS = frozenset([
+    # 2025
+    '2025-02-26', '2025-03-14', '2025-03-31', '2025-04-10', '2025-04-14', '2025-04-18', '2025-05-01',
+    '2025-08-15', '2025-08-27', '2025-10-02', '2025-10-21', '2025-10-22', '2025-11-05', '2025-12-25',
+    # 2026
+    '2026-01-26', '2026-03-03', '2026-03-26', '2026-03-31', '2026-04-03', '2026-04-14', '2026-05-01',
+    '2026-05-28', '2026-06-26', '2026-09-14', '2026-10-02', '2026-10-20', '2026-11-10', '2026-11-24',
+    '2026-12-25',
+] + [d.strip() for d in os.environ.get('NSE_EXTRA_HOLIDAYS', '').split(',') if d.strip()])
+
+# Scrip Master - see scrip_master.py (cache_instruments CSV fallback; streamed, cached on disk by ETag)
+SCRIP_MASTER_URL = 'https://images.dhan.co/api-data/api-scrip-master-detailed.csv'
+SCRIP_MASTER_CACHE_PATH = os.environ.get('SCRIP_MASTER_CACHE_PATH', str(BASE_DIR / 'cache' / 'scrip_master.csv'))
+SCRIP_MASTER_TIMEOUT_SEC = 20         # Connect / between-chunks read timeout
+
+# Candle Store - see candle_store.py (every day's 1-minute candles on disk, NumPy per field per day)
+CANDLE_STORE_DIR = os.environ.get('CANDLE_STORE_DIR', str(BASE_DIR / 'candle_store'))
+CANDLE_STORE_ENABLED = os.environ.get('CANDLE_STORE_ENABLED', 'False') == 'True' # Data worker writes live candles
+CANDLE_STORE_FLUSH_SEC = 300          # Data worker rewrites the current day this often
+
+# Price Triggers - see price_triggers.py (the data worker watches trade levels, the engine acts on crossings)
+PRICE_TRIGGERS_ENABLED = os.environ.get('PRICE_TRIGGERS_ENABLED', 'False') == 'True'
+REDIS_TRIGGER_HASH = 'price_triggers' # '<trade id>:<kind>' -> JSON registration (reloaded on worker restart)
+REDIS_TRIGGER_GROUP = 'price_trigger_book'
+TRIGGER_STREAM_MAXLEN = 10000         # Approximate cap per registration / event stream
+
+# End of Day Square-off - see squareoff.py
+EOD_SQUAREOFF_WORKERS = 8             # Concurrent exit order calls per strategy (paced by the broker limiter)
+EOD_CONFIRM_DEADLINE_SEC = 20         # Exit fill must arrive within this, else check with the broker and resend
+EOD_MAX_RETRIES = 2                   # Broker checks/resends before the position is escalated
+REDIS_SQUAREOFF_REPORT_KEY = 'algo_squareoff_report' # Hash '<consumer>:<strategy>' -> JSON flatten report
+
+# Latency Instrumentation - see latency.py
+REDIS_LATENCY_PREFIX = 'latency'      # latency:<date>:<hop> -> {bucket_upper_us: count}
+LATENCY_FLUSH_SEC = 5                 # Per-process histogram flush interval
+LATENCY_RETENTION_SEC = 3 * 86400
+
+# Broker Rate Limiter - see broker_limiter.py (Dhan: order APIs 25/sec, data APIs 5/sec)
+BROKER_ORDER_RATE_PER_SEC = float(os.environ.get('BROKER_ORDER_RATE_PER_SEC', '20'))
+BROKER_DATA_RATE_PER_SEC = float(os.environ.get('BROKER_DATA_RATE_PER_SEC', '5'))
+BROKER_RATE_BUCKETS = {               # bucket -> tokens/sec, burst, tokens a lane must leave for higher lanes
+    'order': {'rate': BROKER_ORDER_RATE_PER_SEC, 'burst': 10, 'reserve': {'entry': 2, 'info': 4}},
+    'data': {'rate': BROKER_DATA_RATE_PER_SEC, 'burst': 5},
+}
+BROKER_LANE_MAX_WAIT_SEC = {'exit': 2.0, 'entry': 0.25, 'info': 30.0} # Longest queueing delay before BrokerRateLimited
+ENGINE_BROKER_QUERY_MAX_WAIT_SEC = 0.25 # Engine main-loop status queries (in-flight checks); retried next pass
+REDIS_BROKER_BUCKET_PREFIX = 'broker_rate' # <prefix>:<bucket> -> token bucket hash
+
+# Broker Mode - 'LIVE' = dhanhq, 'SIM' = sim_broker.SimulatedDhan (paper trading / local runs)
+BROKER_MODE = os.environ.get('BROKER_MODE', 'LIVE').upper()
+SIM_BROKER_ACK_LATENCY = os.environ.get('SIM_BROKER_ACK_LATENCY', 'uniform:5,20')      # ms, place_order -> orderId
+SIM_BROKER_FILL_LATENCY = os.environ.get('SIM_BROKER_FILL_LATENCY', 'lognormal:3.4,0.5') # ms, ack -> fill update
+SIM_BROKER_REJECT_RATE = float(os.environ.get('SIM_BROKER_REJECT_RATE', '0'))
+SIM_BROKER_PARTIAL_FILL_RATE = float(os.environ.get('SIM_BROKER_PARTIAL_FILL_RATE', '0'))
+SIM_BROKER_SLIPPAGE_PCT = float(os.environ.get('SIM_BROKER_SLIPPAGE_PCT', '0.0005'))
+SIM_BROKER_KEY_PREFIX = 'sim_broker'       # <prefix>:orders / :tags hashes, :events zset - one order book for engine + dashboard
+SIM_BROKER_ORDER_TTL_SEC = 3 * 24 * 3600   # Idle order book expires after this
 
 # --- DHAN API CONFIGURATION ---
 DHAN_CLIENT_ID = os.environ.get('DHAN_CLIENT_ID')
@@ -0,0 +1,344 @@
+# backtest.py - Event-replay backtest for CashBreakoutStrategy
+"""
+Replays recorded 1-minute candles (and optional raw ticks) through the unmodified
+CashBreakoutStrategy from algo_engine.py at full speed.
+
+The engine's module globals are swapped for replay stand-ins:
+- now_ist     -> ReplayClock (advances with event time)
+- r           -> ReplayRedis (in-memory counters / the replayed session's prev-day levels)
+- DHAN_CLIENT -> ReplayBroker (instant acks, fills at the current LTP)
+- TRADE_STORE -> MemoryTradeStore (no Postgres writes)
+
+Event order per minute t: ticks inside [t, t+60s) update the LTP cache and drive
+monitor_active_trades; the candle for t is delivered at t+60s (finalize time),
+exactly like the live Data Worker. Without a tick file, four ticks per candle are
+synthesized along O -> L -> H -> C (bullish) or O -> H -> L -> C (bearish).
+
+Usage:
+    python backtest.py --date 2025-01-10                       # candles from Redis history lists
+    python backtest.py --candles day.jsonl --pdh pdh.json      # exported files
+    python backtest.py --candles day.jsonl --ticks ticks.jsonl --json report.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date, datetime
+from itertools import count, groupby
+from typing import Any, Dict, List, Optional
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'algotrader.settings')
+
+import algo_engine as engine  # Performs django.setup()
+import redis
+from django.conf import settings
+from dashboard.models import StrategySettings
+from trade_state import TradeState
+from prev_day_levels import levels_key, load_levels
+from trading_calendar import expected_session, previous_trading_day
+
+IST = settings.IST
+
+# Event kinds, ordered so that at equal timestamps prices land before signals
+EV_TICK, EV_CANDLE = 0, 1
+
+
+# --- REPLAY STAND-INS ---
+
+class ReplayClock:
+    """Simulated time as epoch seconds; datetimes are only built when the strategy asks."""
+
+    def __init__(self, start: float):
+        self.epoch = start
+        self._cached = (None, None)
+
+    def now(self) -> datetime:
+        if self._cached[0] != self.epoch:
+            self._cached = (self.epoch, datetime.fromtimestamp(self.epoch, tz=IST))
+        return self._cached[1]
+
+
+class ReplayRedis:
+    """Dict-backed subset of the redis-py API the strategy touches."""
+
+    def __init__(self):
+        self.kv: Dict[str, Any] = {}
+        self.hashes: Dict[str, Dict[str, Any]] = {}
+
+    def get(self, key): return self.kv.get(key)
+    def set(self, key, value, **kwargs): self.kv[key] = value; return True
+    def delete(self, *keys): return sum(1 for k in keys if self.kv.pop(k, None) is not None or self.hashes.pop(k, None) is not None)
+
+    def incr(self, key, amount=1):
+        self.kv[key] = int(self.kv.get(key, 0)) + amount
+        return self.kv[key]
+
+    def decr(self, key, amount=1): return self.incr(key, -amount)
+
+    def incrbyfloat(self, key, amount):
+        self.kv[key] = float(self.kv.get(key, 0)) + amount
+        return self.kv[key]
+
+    def hget(self, key, field): return self.hashes.get(key, {}).get(field)
+    def hgetall(self, key): return dict(self.hashes.get(key, {}))
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        h = self.hashes.setdefault(key, {})
+        if field is not None: h[field] = value
+        if mapping: h.update(mapping)
+        return 1
+
+    def xadd(self, *args, **kwargs): return '0-0'
+
+
+class ReplayBroker:
+    """Instant-ack broker: fills are queued at the current simulated time and LTP."""
+    NSE, BUY, SELL, MARKET, INTRA = 'NSE_EQ', 'BUY', 'SELL', 'MARKET', 'INTRADAY'
+
+    def __init__(self, replay: 'ReplayEngine', slippage_pct: float = 0.0):
+        self.replay = replay
+        self.slippage_pct = slippage_pct
+        self.seq = count(1)
+        self.orders = 0
+
+    def place_order(self, security_id, exchange_segment, transaction_type, quantity,
+                    order_type, product_type, price, trigger_price=0, **kwargs):
+        ltp = self.replay.ltp_map.get(str(security_id))
+        if not ltp:
+            return {'status': 'failure', 'remarks': 'No market price'}
+        oid = f"BT{next(self.seq)}"
+        self.orders += 1
+        slip = self.slippage_pct if transaction_type == self.BUY else -self.slippage_pct
+        # Delivered right after the current event, before the next price
+        self.replay.fills.append({
+            'orderId': oid, 'orderStatus': 'TRADED', 'tradedPrice': round(ltp * (1 + slip), 2),
+        })
+        return {'status': 'success', 'orderId': oid}
+
+    def cancel_order(self, order_id):
+        return {'status': 'success', 'orderId': order_id}
+
+
+class MemoryTradeStore:
+    """In-memory replacement for DjangoTradeStore (TradeState objects, no DB)."""
+
+    def __init__(self):
+        self.trades: List[TradeState] = []
+        self.seq = count(1)
+
+    def active(self):
+        return [t for t in self.trades if t.status in ('OPEN', 'PENDING_ENTRY', 'PENDING_EXIT')]
+
+    def create(self, **fields):
+        t = TradeState(id=next(self.seq), **fields)
+        self.trades.append(t)
+        return t
+
+    def save(self, trade):
+        return True
+
+    def flush(self):
+        return True
+
+    def find_by_order_id(self, oid):
+        for t in self.trades:
+            if t.entry_order_id == oid: return t, True
+            if t.exit_order_id == oid: return t, False
+        return None, False
+
+
+# --- DATA LOADING ---
+
+def load_candles_from_redis(day: str) -> List[Dict[str, Any]]:
+    """Reads today's entries from the history:<id>:1m lists (one pipelined round-trip)."""
+    conn = redis.from_url(settings.REDIS_URL, **settings.REDIS_CONN_KWARGS)
+    ids = [str(v) for v in settings.SECURITY_ID_MAP.values()]
+    pipe = conn.pipeline(transaction=False)
+    for sec_id in ids: pipe.lrange(f"{settings.HISTORY_KEY_PREFIX}:{sec_id}:1m", 0, -1)
+    candles = []
+    for rows in pipe.execute():
+        for raw in rows:
+            c = json.loads(raw)
+            if c.get('ts', '').startswith(day): candles.append(c)
+    return candles
+
+
+def load_pdh_from_redis(day: Optional[str] = None) -> Dict[str, str]:
+    """Cached levels of the session before `day` (default: the expected session); old recordings: the legacy hash."""
+    conn = redis.from_url(settings.REDIS_URL, **settings.REDIS_CONN_KWARGS)
+    session = previous_trading_day(date.fromisoformat(day)) if day else None
+    return {symbol: json.dumps({'high': h, 'low': l, 'close': c, 'date': d})
+            for symbol, (h, l, c, d) in load_levels(conn, session, legacy=True).items()}
+
+
+def load_jsonl(path: str) -> List[Dict[str, Any]]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def synth_ticks(candle: Dict[str, Any], start: float):
+    """Four ticks per candle along a plausible intra-minute path."""
+    o, h, l, c = (float(candle[k]) for k in ('open', 'high', 'low', 'close'))
+    path = (o, l, h, c) if c >= o else (o, h, l, c)
+    for i, price in enumerate(path):
+        yield start + i * 15, price
+
+
+# --- REPLAY ENGINE ---
+
+class ReplayEngine:
+    def __init__(self, candles, pdh: Dict[str, str], ticks=None, strategy_settings=None,
+                 slippage_pct: float = 0.0):
+        self.queue = []
+        self.fills: List[Dict[str, Any]] = []
+        self.ltp_map: Dict[str, float] = {}
+        self.events = 0
+
+        self.clock = ReplayClock(time.time())
+        # Static events are known up front: one sort instead of a priority queue
+        seq = count()
+        queue = self.queue
+        for c in candles:
+            ts = datetime.fromisoformat(c['ts']).timestamp()
+            queue.append((ts + 60, EV_CANDLE, next(seq), c))
+            if ticks is None:
+                sec_id = str(c['security_id'])
+                for tick_ts, price in synth_ticks(c, ts):
+                    queue.append((tick_ts, EV_TICK, next(seq), {'securityId': sec_id, 'LTP': price}))
+        for tk in ticks or []:
+            ltt = int(tk['LTT'])
+            queue.append((ltt / 1000 if ltt > 10000000000 else ltt, EV_TICK, next(seq), tk))
+        queue.sort()
+        if queue: self.clock.epoch = queue[0][0]
+
+        self.redis = ReplayRedis()
+        # The levels are the replayed day's session levels, keyed the way the engine looks them up
+        self.redis.hset(levels_key(expected_session(self.clock.now())), mapping=pdh)
+        self.broker = ReplayBroker(self, slippage_pct)
+        self.store = MemoryTradeStore()
+
+        # Swap engine globals for replay stand-ins
+        engine.now_ist = self.clock.now
+        engine.r = self.redis
+        engine.DHAN_CLIENT = self.broker
+        engine.TRADE_STORE = self.store
+        engine.LATENCY = engine.LatencyRecorder(self.redis, flush_sec=float('inf'))
+
+        if strategy_settings is None:
+            strategy_settings = StrategySettings(name='Backtest', is_enabled=True)
+        self.strategy = engine.CashBreakoutStrategy(strategy_settings=strategy_settings)
+        self.strategy.running = True
+        self.strategy.squareoff_opts = {'workers': 0} # Inline exits (deterministic replay)
+        self.strategy.bracket = False # The replay broker fills single orders only: engine-side exits
+
+    def run(self) -> Dict[str, Any]:
+        strategy = self.strategy
+        clock = self.clock
+        started = time.perf_counter()
+        for (ts, kind), events in groupby(self.queue, key=lambda ev: ev[:2]):
+            clock.epoch = ts
+
+            if kind == EV_CANDLE:
+                # Every candle closing in this minute is evaluated (and ranked) together, as flush_candles does live
+                batch = [payload for _, _, _, payload in events]
+                self.events += len(batch)
+                strategy.process_candle_batch(batch)
+                if strategy.active_trades:
+                    strategy.monitor_active_trades(self.ltp_map)
+                self.apply_fills()
+                continue
+
+            for _, _, _, payload in events:
+                self.events += 1
+                sec_id = str(payload.get('securityId', ''))
+                ltp = float(payload.get('LTP') or 0)
+                if not sec_id or ltp <= 0: continue
+                self.ltp_map[sec_id] = ltp
+                strategy.pnl.mark(sec_id, ltp)
+                # Only trades on this symbol can change state on its tick (time exits run per candle)
+                if any(t.security_id == sec_id for t in strategy.active_trades.values()):
+                    strategy.monitor_active_trades(self.ltp_map)
+                self.apply_fills()
+
+        elapsed = time.perf_counter() - started
+        return self.report(elapsed)
+
+    def apply_fills(self):
+        while self.fills:
+            engine.handle_order_update(self.fills.pop(0), [self.strategy])
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        trades = self.store.trades
+        closed = [t for t in trades if t.status == 'CLOSED']
+        wins = [t for t in closed if t.pnl > 0]
+        return {
+            'events': self.events,
+            'elapsed_sec': round(elapsed, 3),
+            'events_per_sec': round(self.events / elapsed) if elapsed else None,
+            'orders': self.broker.orders,
+            'signals': len(trades),
+            'closed': len(closed),
+            'win_rate': round(len(wins) / len(closed), 3) if closed else None,
+            'pnl': round(sum(t.pnl for t in closed), 2),
+            'open_at_end': len(self.store.active()),
+            'trades': [{
+                'symbol': t.symbol, 'status': t.status, 'qty': t.quantity,
+                'entry_level': t.entry_level, 'entry_price': t.entry_price,
+                'exit_price': t.exit_price, 'pnl': round(t.pnl or 0, 2),
+                'exit_reason': t.exit_reason, 'signal_ts': t.candle_ts.isoformat(),
+            } for t in trades],
+        }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Replay recorded candles/ticks through CashBreakoutStrategy.')
+    parser.add_argument('--date', help='Session date (YYYY-MM-DD) to pull from Redis history lists.')
+    parser.add_argument('--candles', help='JSONL file of candle payloads (Data Worker format).')
+    parser.add_argument('--ticks', help='Optional JSONL file of raw ticks (securityId/LTP/LTT).')
+    parser.add_argument('--pdh', help='JSON file {symbol: {"high": ...}} (default: cached levels of the previous session).')
+    parser.add_argument('--sl-amount', type=float, help='Override per_trade_sl_amount.')
+    parser.add_argument('--max-trades', type=int, help='Override max_total_trades.')
+    parser.add_argument('--slippage-pct', type=float, default=0.0)
+    parser.add_argument('--json', help='Write the full report to this file.')
+    args = parser.parse_args(argv)
+
+    if args.candles:
+        candles = load_jsonl(args.candles)
+    elif args.date:
+        candles = load_candles_from_redis(args.date)
+    else:
+        parser.error('Provide --candles or --date.')
+
+    if args.pdh:
+        with open(args.pdh) as f:
+            pdh = {k: v if isinstance(v, str) else json.dumps(v) for k, v in json.load(f).items()}
+    else:
+        pdh = load_pdh_from_redis(args.date)
+
+    ticks = load_jsonl(args.ticks) if args.ticks else None
+
+    strategy_settings = StrategySettings(name='Backtest', is_enabled=True)
+    if args.sl_amount: strategy_settings.per_trade_sl_amount = args.sl_amount
+    if args.max_trades: strategy_settings.max_total_trades = args.max_trades
+
+    replay = ReplayEngine(candles, pdh, ticks, strategy_settings, args.slippage_pct)
+    report = replay.run()
+
+    print(f"Replayed {report['events']} events in {report['elapsed_sec']}s "
+          f"({report['events_per_sec']} events/sec)")
+    print(f"Signals: {report['signals']} | Orders: {report['orders']} | Closed: {report['closed']} | "
+          f"Win Rate: {report['win_rate']} | PnL: {report['pnl']}")
+    for t in report['trades']:
+        print(f"  {t['signal_ts']} {t['symbol']:<12} {t['status']:<13} qty={t['qty']:<5} "
+              f"in={t['entry_price']} out={t['exit_price']} pnl={t['pnl']} ({t['exit_reason']})")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# batch_signals.py - Vectorized breakout evaluation for candles closed in the same minute
+"""
+At each minute boundary every subscribed symbol closes a candle. Instead of running
+the breakout test candle by candle, the strategy hands the whole minute to
+evaluate_breakouts(), which does it in one NumPy pass:
+
+- breakout mask: open < prev-day high < close (optionally range <= max_candle_pct)
+- entry = high * (1 + entry_offset_pct), stop = low * (1 - stop_offset_pct)
+- qty = floor(per_trade_sl_amount / risk), target = entry + risk_multiplier * risk
+- hits are ranked by how far the close went through the prev-day high
+  ((close - pdh) / pdh), so when the daily trade limit is nearly used up the
+  strongest breakouts get the remaining slots rather than the earliest messages.
+- the engine holds a minute until its candles have settled (StrategyRuntime.flush_candles),
+  so candles split across reads or partition streams are still ranked together; with
+  several engine instances each ranks the partitions it owns. The backtest hands it
+  every candle sharing a ts.
+
+The arithmetic is the same float64 math as the scalar version, so a one-candle
+batch gives exactly the levels process_new_candle used to compute.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def evaluate_breakouts(candles: List[Dict[str, Any]], pdh: np.ndarray, cfg,
+                       max_candle_pct: Optional[float] = None) -> List[Tuple[int, float, float, float, int]]:
+    """(candle index, entry, stop, target, qty) for every breakout, best first. pdh is NaN where unknown."""
+    n = len(candles)
+    open_p = np.fromiter((float(c['open']) for c in candles), dtype=float, count=n)
+    high_p = np.fromiter((float(c['high']) for c in candles), dtype=float, count=n)
+    low_p = np.fromiter((float(c['low']) for c in candles), dtype=float, count=n)
+    close_p = np.fromiter((float(c['close']) for c in candles), dtype=float, count=n)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        hit = (open_p < pdh) & (pdh < close_p)
+        if max_candle_pct:
+            hit &= (open_p > 0) & ((high_p - low_p) / open_p <= max_candle_pct)
+
+        entry = high_p * (1.0 + cfg.entry_offset_pct)
+        stop = low_p * (1.0 - cfg.stop_offset_pct)
+        risk = entry - stop
+        hit &= risk > 0
+        qty = np.floor(cfg.per_trade_sl_amount / np.where(risk > 0, risk, np.inf))
+        hit &= qty > 0
+        target = entry + (cfg.risk_multiplier * risk)
+        strength = (close_p - pdh) / pdh
+
+    idx = np.flatnonzero(hit)
+    idx = idx[np.argsort(-strength[idx], kind='stable')]
+    return [(int(i), float(entry[i]), float(stop[i]), float(target[i]), int(qty[i])) for i in idx]
@@ -0,0 +1 @@
+# benchmarks - Throughput/latency benchmarks for the trading hot paths
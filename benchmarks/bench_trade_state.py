@@ -0,0 +1,133 @@
+# benchmarks/bench_trade_state.py - In-memory trade representation benchmark
+"""
+Compares CashBreakoutTrade model instances with trade_state.TradeState as the
+strategy's active_trades values:
+
+- memory per trade (tracemalloc, excluding shared field values)
+- CashBreakoutStrategy.monitor_active_trades pass time over N trades, with prices
+  chosen so no trade changes state (pure hot-path reads)
+
+    python -m benchmarks.bench_trade_state --trades 500 --passes 2000
+
+Runs without Redis/DB: the engine globals are swapped for the backtest stand-ins.
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'algotrader.settings')
+
+import algo_engine as engine # Performs django.setup()
+from backtest import MemoryTradeStore, ReplayClock, ReplayRedis
+from django.conf import settings
+from dashboard.models import CashBreakoutTrade, StrategySettings
+from trade_state import TradeState
+from benchmarks.common import RESULTS_DIR, git_revision, percentile, save_result
+
+REPRESENTATIONS = {'model': CashBreakoutTrade, 'trade_state': TradeState}
+
+
+def trade_fields(n: int, now: datetime) -> List[Dict[str, Any]]:
+    rows = []
+    for i in range(n):
+        open_pos = i % 2 == 1
+        rows.append({
+            'id': i + 1, 'symbol': f"SYM{i}", 'security_id': str(100000 + i), 'quantity': 100,
+            'status': 'OPEN' if open_pos else 'PENDING_ENTRY',
+            'prev_day_high': 99.5, 'entry_level': 100.0, 'stop_level': 98.0, 'target_level': 105.0,
+            'entry_price': 100.0 if open_pos else None,
+            'entry_order_id': f"E{i}" if open_pos else None,
+            'candle_ts': now - timedelta(minutes=1),
+            'entry_time': now if open_pos else None,
+            'created_at': now,
+        })
+    return rows
+
+
+def measure_memory(cls, rows) -> float:
+    """Bytes per object (field values are pre-built and shared, so only the object cost counts)."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objs = [cls(**row) for row in rows]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objs
+    return (after - before) / len(rows)
+
+
+def measure_monitor(cls, rows, passes: int) -> Dict[str, float]:
+    strategy = engine.CashBreakoutStrategy(strategy_settings=StrategySettings(name='Benchmark', is_enabled=True))
+    strategy.running = True
+    strategy.active_trades = {row['symbol']: cls(**row) for row in rows}
+    # Between stop and entry/target and below the breakeven trigger: no state changes
+    ltp_map = {row['security_id']: 99.0 for row in rows}
+
+    durations = []
+    clock = time.perf_counter
+    for _ in range(passes):
+        s = clock()
+        strategy.monitor_active_trades(ltp_map)
+        durations.append(clock() - s)
+    assert len(strategy.active_trades) == len(rows), "benchmark prices triggered a state change"
+
+    durations.sort()
+    mean = sum(durations) / len(durations)
+    return {
+        'pass_mean_us': round(mean * 1e6, 1),
+        'pass_p50_us': round(percentile(durations, 0.50) * 1e6, 1),
+        'pass_p99_us': round(percentile(durations, 0.99) * 1e6, 1),
+        'per_trade_ns': round(mean / len(rows) * 1e9, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='TradeState vs model instance benchmark')
+    parser.add_argument('--trades', type=int, default=500)
+    parser.add_argument('--passes', type=int, default=2000)
+    parser.add_argument('--label', default='')
+    parser.add_argument('--out', default=RESULTS_DIR, help='Directory for the JSON result')
+    args = parser.parse_args(argv)
+
+    now = datetime.now(settings.IST).replace(hour=10, minute=0, second=0, microsecond=0)
+    clock = ReplayClock(now.timestamp())
+    engine.now_ist = clock.now
+    engine.r = ReplayRedis()
+    engine.TRADE_STORE = MemoryTradeStore()
+    engine.DHAN_CLIENT = None
+    engine.LATENCY = engine.LatencyRecorder(engine.r, flush_sec=float('inf'))
+
+    rows = trade_fields(args.trades, now)
+    results = {}
+    for name, cls in REPRESENTATIONS.items():
+        res = {'bytes_per_trade': round(measure_memory(cls, rows), 1)}
+        res.update(measure_monitor(cls, rows, args.passes))
+        results[name] = res
+        print(f"  {name:<12} " + '  '.join(f"{k}={v}" for k, v in res.items()))
+
+    base, new = results['model'], results['trade_state']
+    results['memory_ratio'] = round(base['bytes_per_trade'] / new['bytes_per_trade'], 2)
+    results['monitor_speedup'] = round(base['pass_mean_us'] / new['pass_mean_us'], 2)
+    print(f"  TradeState: {results['memory_ratio']}x less memory per trade, "
+          f"{results['monitor_speedup']}x faster monitor pass")
+
+    report = {
+        'benchmark': 'trade_state',
+        'label': args.label,
+        'created_at': datetime.now(settings.IST).isoformat(),
+        'git': git_revision(),
+        'params': {'trades': args.trades, 'passes': args.passes, 'python': sys.version.split()[0]},
+        'results': results,
+    }
+    save_result(report, 'trade_state', args.out, args.label)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+# benchmarks/bench_worker.py - Data Worker tick-path throughput benchmark
+"""
+Drives dhan_workers.LiveCandleAggregator (candle aggregation + Redis tick/candle
+publish) with a synthetic feed against a local Redis and reports:
+
+- ticks/sec and per-tick process_tick latency percentiles (us)
+- in paced mode (--rate), how far the callback falls behind the feed schedule
+- memory: tracemalloc peak/retained over a separate pass, plus process max RSS
+
+Results are saved as JSON (tagged with the git commit) so runs can be compared:
+
+    python -m benchmarks.bench_worker --symbols 200 --ticks 100000
+    python -m benchmarks.bench_worker --rate 5000 --compare benchmarks/results/<old>.json
+
+Uses its own Redis DB by default (--redis-url) and only deletes the keys it writes.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Dict, List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'algotrader.settings')
+
+import redis
+import dhan_workers # Performs django.setup()
+from django.conf import settings
+from partitions import partition_count, partition_stream
+from benchmarks.common import RESULTS_DIR, git_revision, percentile, save_result
+from benchmarks.feed import SyntheticFeed
+
+DEFAULT_REDIS_URL = 'redis://localhost:6379/15'
+
+# Metrics shown by --compare: (key, higher_is_better)
+COMPARE_METRICS = [
+    ('ticks_per_sec', True), ('p50_us', False), ('p99_us', False), ('p999_us', False),
+    ('max_us', False), ('max_lag_ms', False), ('mem_peak_kb', False), ('mem_retained_kb', False),
+]
+
+
+def cleanup(conn, security_ids):
+    keys = [partition_stream(s, p) for s in (settings.REDIS_STREAM_MARKET, settings.REDIS_STREAM_CANDLES)
+            for p in range(partition_count())]
+    keys += [f"{settings.HISTORY_KEY_PREFIX}:{sid}:1m" for sid in security_ids]
+    conn.delete(*keys)
+
+
+def run_timed(conn, ticks, rate: float) -> Dict[str, Any]:
+    agg = dhan_workers.LiveCandleAggregator(conn)
+    durations = []
+    lags = []
+    interval = 1.0 / rate if rate else 0.0
+    clock = time.perf_counter
+
+    t0 = clock()
+    for i, tick in enumerate(ticks):
+        if interval:
+            due = t0 + i * interval
+            wait = due - clock()
+            if wait > 0.002: time.sleep(wait - 0.001) # Coarse sleep, then spin for precision
+            while clock() < due: pass
+            lags.append(clock() - due)
+        s = clock()
+        agg.process_tick(tick)
+        durations.append(clock() - s)
+    elapsed = clock() - t0
+    agg.latency.flush()
+
+    durations.sort()
+    us = lambda v: round(v * 1_000_000, 1)
+    result = {
+        'ticks': len(ticks),
+        'elapsed_sec': round(elapsed, 3),
+        'ticks_per_sec': round(len(ticks) / elapsed, 1) if elapsed else 0.0,
+        'p50_us': us(percentile(durations, 0.50)),
+        'p90_us': us(percentile(durations, 0.90)),
+        'p99_us': us(percentile(durations, 0.99)),
+        'p999_us': us(percentile(durations, 0.999)),
+        'max_us': us(durations[-1]) if durations else 0.0,
+        'candles_open': len(agg.aggregators),
+    }
+    if interval:
+        lags.sort()
+        result.update({
+            'target_rate': rate,
+            'p99_lag_ms': round(percentile(lags, 0.99) * 1000, 2),
+            'max_lag_ms': round(lags[-1] * 1000, 2) if lags else 0.0,
+            # Kept up if the feed never got more than ~10 inter-tick gaps behind schedule
+            'kept_up': bool(not lags or lags[-1] <= max(interval, 0.001) * 10),
+        })
+    return result
+
+
+def run_memory(conn, ticks) -> Dict[str, Any]:
+    tracemalloc.start()
+    agg = dhan_workers.LiveCandleAggregator(conn)
+    for tick in ticks: agg.process_tick(tick)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'mem_ticks': len(ticks),
+        'mem_peak_kb': round(peak / 1024, 1),
+        'mem_retained_kb': round(current / 1024, 1),
+    }
+
+
+def compare(current: Dict[str, Any], baseline_path: str):
+    with open(baseline_path) as f: base = json.load(f)
+    print(f"\nCompared to {base.get('git', {}).get('commit')} ({baseline_path}):")
+    print(f"{'metric':<18}{'baseline':>14}{'current':>14}{'change':>10}")
+    for key, higher_better in COMPARE_METRICS:
+        old, new = base['results'].get(key), current['results'].get(key)
+        if old is None or new is None: continue
+        change = ((new - old) / old * 100) if old else 0.0
+        worse = (change < 0) if higher_better else (change > 0)
+        flag = ' !' if worse and abs(change) >= 10 else ''
+        print(f"{key:<18}{old:>14}{new:>14}{change:>+9.1f}%{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Data Worker tick-path benchmark')
+    parser.add_argument('--symbols', type=int, default=200)
+    parser.add_argument('--ticks', type=int, default=100000)
+    parser.add_argument('--rate', type=float, default=0, help='Paced feed in ticks/sec (0 = as fast as possible)')
+    parser.add_argument('--sim-minutes', type=int, default=5, help='Exchange-clock span of the feed (candle rollovers)')
+    parser.add_argument('--mem-ticks', type=int, default=20000, help='Ticks for the tracemalloc pass (0 = skip)')
+    parser.add_argument('--redis-url', default=DEFAULT_REDIS_URL)
+    parser.add_argument('--label', default='')
+    parser.add_argument('--out', default=RESULTS_DIR, help='Directory for the JSON result')
+    parser.add_argument('--compare', help='Baseline result JSON to diff against')
+    parser.add_argument('--keep', action='store_true', help='Leave benchmark keys in Redis')
+    args = parser.parse_args(argv)
+
+    conn = redis.from_url(args.redis_url, decode_responses=True)
+    conn.ping()
+
+    feed = SyntheticFeed(symbols=args.symbols, total_ticks=args.ticks, sim_minutes=args.sim_minutes)
+    ticks = feed.generate()
+    print(f"[{datetime.now()}] Benchmark: {args.ticks} ticks, {len(feed.security_ids)} symbols, "
+          f"rate={'max' if not args.rate else args.rate}, redis={args.redis_url}")
+
+    cleanup(conn, feed.security_ids)
+    try:
+        results = run_timed(conn, ticks, args.rate)
+        if args.mem_ticks:
+            cleanup(conn, feed.security_ids)
+            results.update(run_memory(conn, ticks[:args.mem_ticks]))
+    finally:
+        if not args.keep: cleanup(conn, feed.security_ids)
+    results['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    report = {
+        'benchmark': 'worker_tick_path',
+        'label': args.label,
+        'created_at': datetime.now(settings.IST).isoformat(),
+        'git': git_revision(),
+        'params': {'symbols': args.symbols, 'ticks': args.ticks, 'rate': args.rate,
+                   'sim_minutes': args.sim_minutes, 'partitions': partition_count(),
+                   'python': sys.version.split()[0]},
+        'results': results,
+    }
+
+    for key, value in results.items(): print(f"  {key:<18} {value}")
+
+    save_result(report, 'worker', args.out, args.label)
+
+    if args.compare: compare(report, args.compare)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+# benchmarks/common.py - Shared helpers for benchmark result files
+import json
+import os
+import subprocess
+from datetime import datetime
+from typing import Any, Dict, List
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def percentile(sorted_vals: List[float], q: float) -> float:
+    if not sorted_vals: return 0.0
+    return sorted_vals[min(len(sorted_vals) - 1, int(q * len(sorted_vals)))]
+
+
+def git_revision() -> Dict[str, Any]:
+    try:
+        sha = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+        dirty = bool(subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], text=True, stderr=subprocess.DEVNULL).strip())
+        return {'commit': sha, 'dirty': dirty}
+    except Exception:
+        return {'commit': None, 'dirty': None}
+
+
+def save_result(report: Dict[str, Any], prefix: str, out_dir: str = RESULTS_DIR, label: str = '') -> str:
+    """Writes <out_dir>/<prefix>_<commit>_<timestamp>[_label].json and returns the path."""
+    os.makedirs(out_dir, exist_ok=True)
+    name = f"{prefix}_{report['git']['commit'] or 'nogit'}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    if label: name += f"_{label}"
+    path = os.path.join(out_dir, f"{name}.json")
+    with open(path, 'w') as f: json.dump(report, f, indent=2)
+    print(f"Saved: {path}")
+    return path
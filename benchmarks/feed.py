@@ -0,0 +1,62 @@
+# benchmarks/feed.py - Synthetic Dhan market feed
+"""
+Generates tick dicts shaped like the dhanhq MarketFeed 'Full Data' packets that
+dhan_workers.LiveCandleAggregator.process_tick parses (securityId / LTP / LTT).
+
+- Symbols are taken from settings.SECURITY_ID_MAP (so finalized candles resolve
+  to a symbol and exercise the history/stream writes); extra synthetic ids are
+  appended if more symbols are requested than are configured.
+- Prices follow a per-symbol random walk; LTT is epoch seconds on a synthetic
+  exchange clock that spans `sim_minutes` over the whole run, so candles roll over.
+- Ticks are pre-generated so generation cost is not part of the measurement.
+"""
+import random
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+
+
+def pick_symbols(n: int) -> List[str]:
+    ids = [str(v) for v in settings.SECURITY_ID_MAP.values()][:n]
+    synthetic = 900000
+    while len(ids) < n:
+        ids.append(str(synthetic))
+        synthetic += 1
+    return ids
+
+
+class SyntheticFeed:
+    def __init__(self, symbols: int = 200, total_ticks: int = 100000, sim_minutes: int = 5,
+                 start: Optional[datetime] = None, seed: int = 7):
+        self.security_ids = pick_symbols(symbols)
+        self.total_ticks = total_ticks
+        self.sim_minutes = sim_minutes
+        start = start or datetime.now(settings.IST).replace(hour=9, minute=15, second=0, microsecond=0)
+        self.start_epoch = int(start.timestamp())
+        self.rng = random.Random(seed)
+
+    def generate(self) -> List[Dict[str, Any]]:
+        rng = self.rng
+        prices = {sid: rng.uniform(50, 5000) for sid in self.security_ids}
+        volumes = dict.fromkeys(self.security_ids, 0)
+        span = self.sim_minutes * 60
+        ticks = []
+        for i in range(self.total_ticks):
+            sid = rng.choice(self.security_ids)
+            price = prices[sid] = max(1.0, prices[sid] * (1 + rng.gauss(0, 0.0004)))
+            qty = rng.randint(1, 500)
+            volumes[sid] += qty
+            ticks.append({
+                'type': 'Full Data',
+                'exchange_segment': 1,
+                'securityId': sid,
+                'LTP': f"{price:.2f}",
+                'LTQ': qty,
+                'LTT': self.start_epoch + (i * span) // self.total_ticks,
+                'avg_price': f"{price:.2f}",
+                'volume': volumes[sid],
+                'total_sell_quantity': rng.randint(1000, 100000),
+                'total_buy_quantity': rng.randint(1000, 100000),
+            })
+        return ticks
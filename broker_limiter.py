@@ -0,0 +1,174 @@
+# broker_limiter.py - Shared Dhan REST rate limiter with priority lanes
+"""
+Every REST call to the broker takes a token from a Redis token bucket, so the Algo
+Engine(s), square-off threads, dashboard actions and management commands share
+one budget per API class (BROKER_RATE_BUCKETS: 'order' and 'data').
+
+- The bucket lives in a Redis hash and is refilled/debited atomically by a Lua
+  script using Redis server time, so it is consistent across processes and dynos.
+- Priority lanes (LANES order): exits and stop-losses, then entries, then
+  informational calls. Lower lanes must leave `reserve` tokens in the bucket for
+  the lanes above them, and inside a process a call waits while a higher lane is
+  queued on the same bucket.
+- Each lane has a maximum queueing delay (BROKER_LANE_MAX_WAIT_SEC). A call that
+  cannot get a token in time raises BrokerRateLimited instead of blocking the
+  caller's loop; the engine retries on its next pass.
+- Queueing delay per lane is recorded as a latency hop (broker_queue_<lane>) and
+  shows up with the other hops on the dashboard.
+- If Redis is unreachable the limiter falls back to an in-process bucket.
+
+LimitedBroker wraps a dhanhq (or SimulatedDhan) client and routes each method to
+its lane and bucket. bounded(max_wait) gives a view with one queueing bound for
+every lane: the engine's main loop uses it for its status queries, so a drained
+bucket defers them to the next pass instead of stalling the loop for the info
+lane's wait (sized for batch commands).
+"""
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+
+import latency
+from latency import LatencyRecorder
+
+LANE_EXIT = 'exit'
+LANE_ENTRY = 'entry'
+LANE_INFO = 'info'
+LANES = (LANE_EXIT, LANE_ENTRY, LANE_INFO) # Priority order
+
+BUCKET_ORDER = 'order'
+BUCKET_DATA = 'data'
+
+# dhanhq methods served by the Data APIs (separate, lower broker limit)
+DATA_METHODS = frozenset({
+    'historical_daily_data', 'intraday_minute_data', 'ohlc_data', 'quote_data', 'ticker_data',
+    'option_chain', 'expiry_list',
+})
+
+# KEYS[1] bucket hash; ARGV rate/sec, burst, reserve. Returns seconds to wait (0 = token taken).
+_TOKEN_BUCKET_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local need = 1 + tonumber(ARGV[3])
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(b[1]) or burst
+local ts = tonumber(b[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= need then tokens = tokens - 1 else wait = (need - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], 60)
+return tostring(wait)
+"""
+
+
+class BrokerRateLimited(Exception):
+    """No token within the lane's maximum queueing delay."""
+
+
+class BrokerLimiter:
+    def __init__(self, redis_conn, latency_recorder: Optional[LatencyRecorder] = None):
+        self.r = redis_conn
+        self.script = redis_conn.register_script(_TOKEN_BUCKET_LUA) if redis_conn is not None else None
+        # Processes without a main loop (dashboard, commands) flush their own samples
+        self.own_recorder = latency_recorder is None
+        self.latency = latency_recorder or LatencyRecorder(redis_conn)
+        self.cond = threading.Condition()
+        self.waiting: Dict[Tuple[str, str], int] = {} # (bucket, lane) -> queued calls in this process
+        self.local: Dict[str, list] = {} # Fallback buckets: bucket -> [tokens, ts]
+        self.redis_ok = True
+
+    def acquire(self, lane: str, bucket: str = BUCKET_ORDER, max_wait: Optional[float] = None) -> float:
+        """Blocks until a token is taken; returns the queueing delay in seconds."""
+        cfg = settings.BROKER_RATE_BUCKETS[bucket]
+        reserve = cfg.get('reserve', {}).get(lane, 0)
+        if max_wait is None: max_wait = settings.BROKER_LANE_MAX_WAIT_SEC[lane]
+        higher = [(bucket, l) for l in LANES[:LANES.index(lane)]]
+
+        start = time.monotonic()
+        deadline = start + max_wait
+        with self.cond:
+            self.waiting[(bucket, lane)] = self.waiting.get((bucket, lane), 0) + 1
+        try:
+            while True:
+                with self.cond:
+                    while any(self.waiting.get(k) for k in higher):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0: self._limited(lane, bucket, start, max_wait)
+                        self.cond.wait(min(remaining, 0.05))
+                wait = self._take(bucket, cfg, reserve)
+                if wait <= 0: break
+                if time.monotonic() + wait > deadline: self._limited(lane, bucket, start, max_wait)
+                time.sleep(wait)
+        finally:
+            with self.cond:
+                self.waiting[(bucket, lane)] -= 1
+                self.cond.notify_all()
+
+        waited = time.monotonic() - start
+        self.latency.record(f"{latency.HOP_BROKER_QUEUE_PREFIX}{lane}", waited)
+        if self.own_recorder: self.latency.maybe_flush()
+        return waited
+
+    def _limited(self, lane, bucket, start, max_wait):
+        self.latency.record(f"{latency.HOP_BROKER_QUEUE_PREFIX}{lane}", time.monotonic() - start)
+        raise BrokerRateLimited(f"No '{bucket}' token for {lane} lane within {max_wait}s")
+
+    def _take(self, bucket: str, cfg, reserve: int) -> float:
+        if self.script is not None:
+            try:
+                wait = float(self.script(keys=[f"{settings.REDIS_BROKER_BUCKET_PREFIX}:{bucket}"],
+                                         args=[cfg['rate'], cfg['burst'], reserve]))
+                self.redis_ok = True
+                return wait
+            except Exception as e:
+                if self.redis_ok: print(f"Broker Limiter: Redis unavailable ({e}). Using local bucket.")
+                self.redis_ok = False
+        return self._take_local(bucket, cfg, reserve)
+
+    def _take_local(self, bucket: str, cfg, reserve: int) -> float:
+        with self.cond:
+            now = time.monotonic()
+            state = self.local.setdefault(bucket, [cfg['burst'], now])
+            tokens = min(cfg['burst'], state[0] + (now - state[1]) * cfg['rate'])
+            state[1] = now
+            need = 1 + reserve
+            if tokens >= need:
+                state[0] = tokens - 1
+                return 0.0
+            state[0] = tokens
+            return (need - tokens) / cfg['rate']
+
+
+def route(method: str, kwargs, sell='SELL') -> Tuple[str, str]:
+    """(lane, bucket) for a dhanhq method call. Strategies are long-only: SELL is an exit."""
+    if method in DATA_METHODS: return LANE_INFO, BUCKET_DATA
+    if method == 'place_order':
+        return (LANE_EXIT, BUCKET_ORDER) if kwargs.get('transaction_type') == sell else (LANE_ENTRY, BUCKET_ORDER)
+    if method in ('cancel_order', 'modify_order'): return LANE_EXIT, BUCKET_ORDER
+    return LANE_INFO, BUCKET_ORDER
+
+
+class LimitedBroker:
+    """Proxy over a broker client; every public method call waits for a token on its lane."""
+
+    def __init__(self, client, limiter: BrokerLimiter, max_wait: Optional[float] = None):
+        self._client = client
+        self._limiter = limiter
+        self._max_wait = max_wait # Overrides BROKER_LANE_MAX_WAIT_SEC for every lane
+
+    def bounded(self, max_wait: float) -> 'LimitedBroker':
+        return LimitedBroker(self._client, self._limiter, max_wait)
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name.startswith('_') or not callable(attr): return attr # Constants (NSE, SELL, ...)
+
+        def call(*args, **kwargs):
+            lane, bucket = route(name, kwargs, getattr(self._client, 'SELL', 'SELL'))
+            self._limiter.acquire(lane, bucket, self._max_wait)
+            return attr(*args, **kwargs)
+        return call
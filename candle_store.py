@@ -0,0 +1,217 @@
+# candle_store.py - Columnar on-disk store of 1-minute candles (one directory per trading day)
+"""
+Redis only keeps the last 400 candles per symbol (history:<id>:1m). The candle
+store keeps every day, in a layout NumPy can memory-map directly:
+
+    <CANDLE_STORE_DIR>/<YYYY-MM-DD>/ts.npy      int64 epoch seconds (candle open)
+                                    open.npy    float64   (high / low / close alike)
+                                    index.json  symbols, security ids, row offsets
+
+- Rows are grouped by symbol (sorted) and ordered by time inside each symbol;
+  index.json holds each symbol's [offset, next offset) slice, so one symbol of
+  one day is a zero-copy slice of the mapped arrays. The day directories are the
+  date index.
+- CandleStore.load(symbols, days) returns {field: array[symbol, day, minute]} on
+  the SESSION_MINUTES grid from 09:15, NaN where a minute has no candle.
+- CandleStoreWriter collects candles (data worker, CANDLE_STORE_ENABLED) and
+  rewrites the touched days every CANDLE_STORE_FLUSH_SEC from its own thread; the
+  export_candles command fills a day from the Redis history lists after the close.
+- Writes go to temporary files that replace the old ones, index.json last; a
+  reader that catches a day mid-rewrite sees a row count mismatch and retries.
+"""
+import json
+import os
+import re
+import threading
+import time
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+
+FIELDS = ('open', 'high', 'low', 'close')
+SESSION_OPEN = (9, 15)
+SESSION_MINUTES = 375 # 09:15 - 15:29 candles
+
+_DAY_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+def session_open_epoch(day: str) -> int:
+    d = date.fromisoformat(day)
+    return int(settings.IST.localize(datetime(d.year, d.month, d.day, *SESSION_OPEN)).timestamp())
+
+
+def candle_epoch(ts) -> int:
+    if isinstance(ts, str): ts = datetime.fromisoformat(ts)
+    return int(ts.timestamp())
+
+
+def epoch_day(epoch: int) -> str:
+    return datetime.fromtimestamp(epoch, tz=settings.IST).strftime('%Y-%m-%d')
+
+
+class CandleDay:
+    """One stored day: field arrays (memory-mapped by default) plus the symbol index."""
+
+    def __init__(self, day: str, arrays: Dict[str, np.ndarray], index: Dict[str, Any]):
+        self.day = day
+        self.arrays = arrays
+        self.symbols: List[str] = index['symbols']
+        self.security_ids: List[str] = index['security_ids']
+        self.offsets = np.asarray(index['offsets'], dtype=np.int64)
+        self.positions = {s: i for i, s in enumerate(self.symbols)}
+
+    def __len__(self):
+        return int(self.offsets[-1]) if len(self.offsets) else 0
+
+    def get(self, symbol: str) -> Optional[Dict[str, np.ndarray]]:
+        """Slices of one symbol (ts + FIELDS), or None."""
+        i = self.positions.get(symbol)
+        if i is None: return None
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return {f: a[start:end] for f, a in self.arrays.items()}
+
+    def rows(self, symbol: str) -> Dict[int, Tuple[float, float, float, float]]:
+        """epoch -> (open, high, low, close) of one symbol (writer merge)."""
+        s = self.get(symbol)
+        if s is None: return {}
+        return {int(t): (float(o), float(h), float(l), float(c)) for t, o, h, l, c in
+                zip(s['ts'], s['open'], s['high'], s['low'], s['close'])}
+
+
+class CandleStore:
+    """Reader."""
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = str(root or settings.CANDLE_STORE_DIR)
+
+    def day_dir(self, day: str) -> str:
+        return os.path.join(self.root, day)
+
+    def days(self, since: Optional[str] = None, until: Optional[str] = None) -> List[str]:
+        """Stored days (YYYY-MM-DD, ascending), optionally within [since, until]."""
+        if not os.path.isdir(self.root): return []
+        days = sorted(d for d in os.listdir(self.root)
+                      if _DAY_RE.match(d) and os.path.exists(os.path.join(self.root, d, 'index.json')))
+        return [d for d in days if (since is None or d >= since) and (until is None or d <= until)]
+
+    def day(self, day: str, mmap: bool = True) -> Optional[CandleDay]:
+        path = self.day_dir(day)
+        for _ in range(3):
+            try:
+                with open(os.path.join(path, 'index.json')) as fh:
+                    index = json.load(fh)
+            except FileNotFoundError:
+                return None
+            arrays = {f: np.load(os.path.join(path, f'{f}.npy'), mmap_mode='r' if mmap else None) for f in ('ts',) + FIELDS}
+            if all(len(a) == index['rows'] for a in arrays.values()):
+                return CandleDay(day, arrays, index)
+            time.sleep(0.05) # Caught a rewrite in progress
+        raise IOError(f"Candle store day {day} is inconsistent (rows != index).")
+
+    def load(self, symbols: Sequence[str], days: Sequence[str], fields: Sequence[str] = FIELDS) -> Dict[str, np.ndarray]:
+        """{field: float64 array of shape (len(symbols), len(days), SESSION_MINUTES)}, NaN where missing."""
+        out = {f: np.full((len(symbols), len(days), SESSION_MINUTES), np.nan) for f in fields}
+        wanted = {s: i for i, s in enumerate(symbols)}
+        for j, day in enumerate(days):
+            cd = self.day(day)
+            if cd is None or not len(cd): continue
+            # Row -> requested symbol position (-1 = not requested), row -> session minute
+            sym_pos = np.array([wanted.get(s, -1) for s in cd.symbols], dtype=np.int64)
+            row_sym = np.repeat(sym_pos, np.diff(cd.offsets))
+            minute = (np.asarray(cd.arrays['ts']) - session_open_epoch(day)) // 60
+            keep = (row_sym >= 0) & (minute >= 0) & (minute < SESSION_MINUTES)
+            for f in fields:
+                out[f][row_sym[keep], j, minute[keep]] = np.asarray(cd.arrays[f])[keep]
+        return out
+
+
+def write_day(root: str, day: str, rows: Dict[str, Dict[int, Tuple[float, float, float, float]]],
+              security_ids: Dict[str, str]) -> int:
+    """Writes one day from symbol -> {epoch: (o, h, l, c)}. Returns the number of rows."""
+    path = os.path.join(root, day)
+    os.makedirs(path, exist_ok=True)
+    symbols = sorted(s for s, candles in rows.items() if candles)
+    offsets, ts, ohlc = [0], [], []
+    for symbol in symbols:
+        candles = rows[symbol]
+        for t in sorted(candles):
+            ts.append(t)
+            ohlc.append(candles[t])
+        offsets.append(len(ts))
+    data = {'ts': np.asarray(ts, dtype=np.int64)}
+    values = np.asarray(ohlc, dtype=np.float64).reshape(-1, len(FIELDS))
+    data.update({f: np.ascontiguousarray(values[:, k]) for k, f in enumerate(FIELDS)})
+
+    tmp = f".tmp{os.getpid()}"
+    for f, a in data.items():
+        with open(os.path.join(path, f'{f}.npy{tmp}'), 'wb') as fh:
+            np.save(fh, a)
+        os.replace(os.path.join(path, f'{f}.npy{tmp}'), os.path.join(path, f'{f}.npy'))
+    index = {'day': day, 'rows': len(ts), 'symbols': symbols,
+             'security_ids': [str(security_ids.get(s, '')) for s in symbols], 'offsets': offsets}
+    with open(os.path.join(path, f'index.json{tmp}'), 'w') as fh:
+        json.dump(index, fh, separators=(',', ':'))
+    os.replace(os.path.join(path, f'index.json{tmp}'), os.path.join(path, 'index.json'))
+    return len(ts)
+
+
+class CandleStoreWriter:
+    """Collects finalized candles per day and rewrites the touched days on flush()."""
+
+    def __init__(self, root: Optional[str] = None):
+        self.store = CandleStore(root)
+        self.lock = threading.Lock()
+        self.days: Dict[str, Dict[str, Dict[int, Tuple[float, float, float, float]]]] = {} # day -> symbol -> epoch -> ohlc
+        self.security_ids: Dict[str, str] = {}
+        self.dirty = set()
+        self.written = 0
+
+    def _day_rows(self, day: str):
+        rows = self.days.get(day)
+        if rows is None:
+            # Seed from disk so a restarted writer keeps the candles stored earlier in the day
+            stored = self.store.day(day, mmap=False)
+            rows = self.days[day] = {s: stored.rows(s) for s in stored.symbols} if stored else {}
+            if stored: self.security_ids.update(zip(stored.symbols, stored.security_ids))
+        return rows
+
+    def add(self, candle: Dict[str, Any]):
+        epoch = candle_epoch(candle['ts'])
+        day = epoch_day(epoch)
+        with self.lock:
+            rows = self._day_rows(day)
+            rows.setdefault(candle['symbol'], {})[epoch] = (
+                float(candle['open']), float(candle['high']), float(candle['low']), float(candle['close']))
+            if candle.get('security_id'): self.security_ids[candle['symbol']] = str(candle['security_id'])
+            self.dirty.add(day)
+
+    def flush(self, keep_today: bool = True) -> int:
+        """Writes every touched day; days before today are then dropped from memory."""
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+            snapshot = {day: {s: dict(c) for s, c in self.days[day].items()} for day in dirty}
+            sids = dict(self.security_ids)
+        n = 0
+        for day, rows in sorted(snapshot.items()):
+            try:
+                n += write_day(self.store.root, day, rows, sids)
+            except Exception as e:
+                with self.lock: self.dirty.add(day)
+                print(f"Candle Store Write Error ({day}): {e}")
+        self.written += n
+        today = datetime.now(settings.IST).strftime('%Y-%m-%d')
+        with self.lock:
+            for day in [d for d in self.days if d not in self.dirty and (d < today or not keep_today)]:
+                del self.days[day]
+        return n
+
+    def run_flusher(self):
+        """Blocking loop for a daemon thread."""
+        while True:
+            time.sleep(settings.CANDLE_STORE_FLUSH_SEC)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Candle Store Flush Error: {e}")
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import DhanCredentials, StrategySettings, CashBreakoutTrade
+from .models import DhanCredentials, StrategySettings, CashBreakoutTrade, TradeEvent, ArchivedTrade, DailyTradeSummary
 
 @admin.register(DhanCredentials)
 class DhanCredentialsAdmin(admin.ModelAdmin):
@@ -62,4 +62,29 @@ class CashBreakoutTradeAdmin(admin.ModelAdmin):
         }),
     )
     
-    ordering = ('-created_at',)
\ No newline at end of file
+    ordering = ('-created_at',)
+
+@admin.register(TradeEvent)
+class TradeEventAdmin(admin.ModelAdmin):
+    list_display = ('trade_id', 'event_type', 'price', 'ts')
+    list_filter = ('event_type',)
+    search_fields = ('trade_id',)
+    readonly_fields = ('trade_id', 'event_type', 'price', 'ts', 'payload')
+    ordering = ('-id',)
+
+@admin.register(ArchivedTrade)
+class ArchivedTradeAdmin(admin.ModelAdmin):
+    list_display = ('trade_date', 'symbol', 'status', 'quantity', 'entry_price', 'exit_price', 'pnl')
+    list_filter = ('status', 'strategy')
+    search_fields = ('symbol', 'entry_order_id', 'exit_order_id')
+    date_hierarchy = 'trade_date'
+    show_full_result_count = False # No COUNT(*) over the whole archive on every changelist
+    ordering = ('-trade_date', '-id')
+
+@admin.register(DailyTradeSummary)
+class DailyTradeSummaryAdmin(admin.ModelAdmin):
+    list_display = ('trade_date', 'strategy', 'symbol', 'trades', 'wins', 'losses', 'unfilled', 'win_rate', 'pnl')
+    list_filter = ('strategy',)
+    search_fields = ('symbol',)
+    date_hierarchy = 'trade_date'
+    ordering = ('-trade_date', 'symbol')
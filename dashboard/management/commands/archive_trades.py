@@ -0,0 +1,150 @@
+# dashboard/management/commands/archive_trades.py
+"""
+End-of-day archival (run after the close, e.g. from the scheduler):
+
+- Terminal trades (CLOSED, EXPIRED, FAILED_ENTRY) are moved from CashBreakoutTrade
+  to ArchivedTrade in batches of ARCHIVE_BATCH_SIZE, keeping their ids (TradeEvent
+  rows still point at them). Each batch is copied and deleted in one transaction.
+- DailyTradeSummary rows (trades, wins, losses, win rate, P&L per strategy and
+  symbol) are rebuilt for every day that received archived trades.
+
+The live table is left with the current day's active trades, so the engine's
+load_trades and the dashboard's live query stay small; reports read the summaries.
+
+While an engine is running (partitions.live_engines, or Redis unreachable) only
+trades signalled before the current session are archived: the engine may still
+hold buffered writes for today's trades, and its bulk_update would silently miss
+a row that was moved to the archive.
+"""
+from datetime import datetime, time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+import redis
+
+from dashboard.models import ArchivedTrade, CashBreakoutTrade, DailyTradeSummary
+from db_health import DBConnectionManager
+from partitions import live_engines
+from trade_state import TRADE_FIELDS, TERMINAL_STATUSES
+
+
+def trade_date(row):
+    """IST date of the trade's signal candle."""
+    return timezone.localtime(row['candle_ts'], settings.IST).date()
+
+
+def rebuild_summaries(dates) -> int:
+    """Recomputes DailyTradeSummary for `dates` from ArchivedTrade. Returns the number of rows."""
+    closed = Q(status='CLOSED')
+    rows = ArchivedTrade.objects.filter(trade_date__in=dates).values('trade_date', 'strategy_id', 'symbol').annotate(
+        n_trades=Count('id', filter=closed),
+        n_wins=Count('id', filter=closed & Q(pnl__gt=0)),
+        n_losses=Count('id', filter=closed & Q(pnl__lt=0)),
+        n_unfilled=Count('id', filter=Q(status__in=['EXPIRED', 'FAILED_ENTRY'])),
+        total_pnl=Sum('pnl', filter=closed),
+    )
+    summaries = [
+        DailyTradeSummary(
+            trade_date=row['trade_date'], strategy_id=row['strategy_id'], symbol=row['symbol'],
+            trades=row['n_trades'], wins=row['n_wins'], losses=row['n_losses'], unfilled=row['n_unfilled'],
+            win_rate=round(row['n_wins'] / row['n_trades'], 4) if row['n_trades'] else 0.0,
+            pnl=round(row['total_pnl'] or 0.0, 2),
+        )
+        for row in rows
+    ]
+    with transaction.atomic():
+        DailyTradeSummary.objects.filter(trade_date__in=dates).delete()
+        DailyTradeSummary.objects.bulk_create(summaries)
+    return len(summaries)
+
+
+class Command(BaseCommand):
+    help = 'Moves terminal trades (CLOSED, EXPIRED, FAILED_ENTRY) to the archive table and rebuilds the daily summaries.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--before',
+            type=str,
+            help='Only archive trades signalled before this date (YYYY-MM-DD). Default: all terminal trades.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.ARCHIVE_BATCH_SIZE,
+            help='Trades moved per transaction.',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report what would be archived.',
+        )
+
+    def handle(self, *args, **options):
+        trades = CashBreakoutTrade.objects.filter(status__in=TERMINAL_STATUSES)
+        before = None
+        if options['before']:
+            try:
+                before = datetime.strptime(options['before'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError(f"Invalid --before date: {options['before']}")
+
+        engines = self.running_engines()
+        today = datetime.now(settings.IST).date()
+        if engines != [] and (before is None or before > today):
+            # Today's trades may still have buffered engine writes: archived only once the engine is stopped
+            before = today
+            self.stdout.write(self.style.WARNING(
+                f"Engine running ({', '.join(engines) if engines else 'status unknown'}): "
+                f"only trades signalled before {today} are archived."))
+        if before is not None:
+            trades = trades.filter(candle_ts__lt=settings.IST.localize(datetime.combine(before, time.min)))
+
+        db = DBConnectionManager('archive_trades')
+        if not db.before_writes():
+            self.stdout.write(self.style.ERROR(f"Database unavailable: {db.last_error}"))
+            return
+
+        if options['dry_run']:
+            per_day = {}
+            for row in trades.values('candle_ts'):
+                day = trade_date(row)
+                per_day[day] = per_day.get(day, 0) + 1
+            for day, n in sorted(per_day.items()):
+                self.stdout.write(f"{day}: {n} trades")
+            self.stdout.write(self.style.NOTICE(f"Dry run: {sum(per_day.values())} trades would be archived."))
+            return
+
+        moved, dates = 0, set()
+        batch_size = max(1, options['batch_size'])
+        try:
+            while True:
+                rows = list(trades.order_by('pk').values(*TRADE_FIELDS)[:batch_size])
+                if not rows: break
+                archived = [ArchivedTrade(trade_date=trade_date(row), **row) for row in rows]
+                with transaction.atomic():
+                    ArchivedTrade.objects.bulk_create(archived)
+                    CashBreakoutTrade.objects.filter(pk__in=[row['id'] for row in rows]).delete()
+                moved += len(rows)
+                dates.update(a.trade_date for a in archived)
+                self.stdout.write(f"Archived {moved} trades...")
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f"Archival failed after {moved} trades: {e}"))
+        if not dates:
+            self.stdout.write(self.style.SUCCESS("No terminal trades to archive."))
+            return
+
+        summaries = rebuild_summaries(sorted(dates))
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {moved} trades over {len(dates)} day(s); {summaries} daily summary rows rebuilt."))
+
+    def running_engines(self):
+        """Live engine instances, or None if Redis can't be reached."""
+        try:
+            return live_engines(redis.from_url(settings.REDIS_URL, **settings.REDIS_CONN_KWARGS))
+        except Exception as e:
+            self.stdout.write(self.style.WARNING(f"Engine status unknown (Redis: {e})."))
+            return None
@@ -4,8 +4,14 @@ Robust management command to cache Dhan symbol -> securityId mapping into Redis.
 
 Features:
 - Tries to use installed `dhanhq` SDK (with tolerant import attempts).
-- If SDK unavailable or fails, downloads Dhan's detailed CSV and parses it robustly.
-- Flexible column detection, symbol normalization, fuzzy fallback.
+- If SDK unavailable or fails, streams Dhan's detailed CSV and parses it robustly
+  (conditional download, cached on disk by ETag / Last-Modified; see scrip_master.py).
+- --file parses a local copy of the CSV instead (no network, no SDK).
+- Flexible column detection, symbol normalization.
+- CSV rows are filtered to NSE equity and indexed once (exact dict, sorted keys
+  for prefix matches, trigram index for contains / fuzzy candidates), so each
+  target is matched without rescanning the CSV. The method used per symbol is
+  stored with the entry ('match') and reported.
 - Prints CSV header/sample rows to stdout for quick Heroku debugging.
 - Writes JSON map to Redis key defined in settings.SYMBOL_ID_MAP_KEY.
 
@@ -13,23 +19,26 @@ Requirements: add `requests` to your requirements.txt if not present.
 
 Usage:
     python manage.py cache_instruments
+    python manage.py cache_instruments --file api-scrip-master-detailed.csv
 
 """
 
 import json
 import csv
-import io
 import re
-from typing import Dict, Optional, Set
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
 from datetime import datetime
 
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 
 import redis
-import requests
 from difflib import get_close_matches
 
+from scrip_master import open_scrip_master
+
 
 # --- FULL NIFTY 500 SYMBOL LIST ---
 NIFTY_500_SYMBOLS = [
@@ -87,11 +96,14 @@ NIFTY_500_SYMBOLS = [
     'YESBANK', 'ZEEL', 'ZENSARTECH', 'ZENTEC', 'ZFCVINDIA', 'ZYDUSLIFE'
 ]
 
-CSV_SCRIP_MASTER_URL = "https://images.dhan.co/api-data/api-scrip-master-detailed.csv"
-
-
 _clean_re = re.compile(r'[^A-Z0-9]')
 
+# Symbol matching (see SymbolMatcher)
+NGRAM = 3
+MIN_PREFIX_LEN = 3 # Shortest CSV symbol accepted as a prefix of a target
+FUZZY_CANDIDATES = 50 # Symbols (by shared trigrams) scored with difflib per target
+FUZZY_CUTOFF = 0.82
+
 
 def clean_symbol(raw: str) -> str:
     """Normalize trading symbol: uppercase, strip common suffixes/punctuation, keep letters+digits only."""
@@ -163,31 +175,94 @@ def get_dhan_client(client_id: str, token: str) -> Optional[object]:
         return None
 
 
-def fetch_instrument_map_from_dhan_csv(symbols_set: Set[str]) -> Dict[str, Dict[str, str]]:
+def _ngrams(s: str, n: int = NGRAM):
+    return {s[i:i + n] for i in range(len(s) - n + 1)}
+
+
+class SymbolMatcher:
     """
-    Download Dhan's scrip master CSV and robustly parse symbol -> securityId mapping.
-    Returns: {your_symbol: {'security_id', 'exchange_segment', 'csv_symbol'}}
+    Indexes over the cleaned CSV symbols, built once per run:
+    - exact: cleaned symbol -> entry (first row wins)
+    - keys: sorted cleaned symbols; CSV symbols starting with a target are one bisect away
+    - grams: trigram (of ' SYMBOL ', padded) -> cleaned symbols, for contains / fuzzy candidates
     """
-    try:
-        resp = requests.get(CSV_SCRIP_MASTER_URL, timeout=20)
-        resp.raise_for_status()
-        text = resp.text
-    except Exception as e:
-        raise Exception(f"Failed to fetch instrument CSV from Dhan: {e}")
-
-    lines = text.splitlines()
-    if len(lines) >= 1:
-        print("CSV HEADER:", lines[0])
-    if len(lines) >= 2:
-        print("CSV SAMPLE ROW 1:", lines[1])
-    if len(lines) >= 3:
-        print("CSV SAMPLE ROW 2:", lines[2])
-
-    f = io.StringIO(text)
-    reader = csv.DictReader(f)
-    fieldnames = reader.fieldnames or []
-    print("Detected CSV columns:", fieldnames[:60])
 
+    def __init__(self):
+        self.exact: Dict[str, Dict[str, str]] = {}
+        self.keys: List[str] = []
+        self.grams: Dict[str, Set[str]] = defaultdict(set)
+
+    def add(self, cleaned: str, entry: Dict[str, str]):
+        if cleaned and cleaned not in self.exact:
+            self.exact[cleaned] = entry
+
+    def build(self):
+        self.keys = sorted(self.exact)
+        for key in self.keys:
+            for g in _ngrams(f" {key} "):
+                self.grams[g].add(key)
+
+    def match(self, target: str) -> Tuple[Optional[str], Optional[str]]:
+        """(cleaned CSV symbol, method) for a target symbol; method is exact/prefix/contains/fuzzy."""
+        ct = clean_symbol(target)
+        if not ct:
+            return None, None
+        if ct in self.exact:
+            return ct, 'exact'
+
+        # CSV symbol starts with the target (shortest wins)
+        best = None
+        i = bisect_left(self.keys, ct)
+        while i < len(self.keys) and self.keys[i].startswith(ct):
+            if best is None or len(self.keys[i]) < len(best):
+                best = self.keys[i]
+            i += 1
+        if best:
+            return best, 'prefix'
+
+        # Target starts with a CSV symbol (longest wins)
+        for n in range(len(ct) - 1, MIN_PREFIX_LEN - 1, -1):
+            if ct[:n] in self.exact:
+                return ct[:n], 'prefix'
+
+        # Target contained in a CSV symbol: every trigram of the target must be posted
+        grams = _ngrams(ct)
+        if grams:
+            candidates = set.intersection(*(self.grams.get(g, set()) for g in grams))
+            contained = [k for k in candidates if ct in k]
+            if contained:
+                return min(contained, key=lambda k: (len(k), k)), 'contains'
+
+        # Fuzzy: only the symbols sharing the most trigrams are scored
+        shared: Dict[str, int] = defaultdict(int)
+        for g in _ngrams(f" {ct} "):
+            for key in self.grams.get(g, ()):
+                shared[key] += 1
+        if shared:
+            candidates = sorted(shared, key=lambda k: -shared[k])[:FUZZY_CANDIDATES]
+            close = get_close_matches(ct, candidates, n=1, cutoff=FUZZY_CUTOFF)
+            if close:
+                return close[0], 'fuzzy'
+        return None, None
+
+
+def is_equity_row(exch: Optional[str], segment: Optional[str], instrument: Optional[str]) -> bool:
+    """NSE cash-equity rows only (None = column not in the CSV, check skipped)."""
+    if exch is not None and exch.strip().upper() not in ('NSE', 'NSE_EQ'):
+        return False
+    if segment is not None and segment.strip().upper() not in ('E', 'EQ', 'NSE_EQ'):
+        return False
+    if instrument is not None and instrument.strip().upper() not in ('EQUITY', 'EQ'):
+        return False
+    return True
+
+
+def fetch_instrument_map_from_dhan_csv(symbols_set: Set[str], file_path: Optional[str] = None) -> Dict[str, Dict[str, str]]:
+    """
+    Stream Dhan's scrip master CSV (download / disk cache / local file, see
+    scrip_master.py) and robustly parse symbol -> securityId mapping.
+    Returns: {your_symbol: {'security_id', 'exchange_segment', 'csv_symbol', 'match'}}
+    """
     # Candidate names based on Dhan docs
     symbol_candidates = [
         'tradingSymbol', 'SEM_TRADING_SYMBOL', 'DISPLAY_NAME', 'SEM_CUSTOM_SYMBOL',
@@ -196,95 +271,111 @@ def fetch_instrument_map_from_dhan_csv(symbols_set: Set[str]) -> Dict[str, Dict[
     secid_candidates = ['securityId', 'SECURITYID', 'security_id', 'SecurityID', 'secid']
     exch_candidates = ['exchangeSegment', 'EXCH_ID', 'SEGMENT', 'exchange', 'ExchangeSegment']
 
-    def pick(cands):
-        for k in cands:
-            for f in fieldnames:
-                if f and f.lower() == k.lower():
-                    return f
-        for k in cands:
-            for f in fieldnames:
-                if f and k.lower() in f.lower():
-                    return f
-        return None
-
-    symbol_col = pick(symbol_candidates)
-    secid_col = pick(secid_candidates)
-    exch_col = pick(exch_candidates)
-
-    print("Using columns -> symbol:", symbol_col, " secid:", secid_col, " exchange:", exch_col)
-
-    cleaned_target = {clean_symbol(s): s for s in symbols_set}
-    csv_seen = []
-    rows = list(reader)
-
-    instrument_map: Dict[str, Dict[str, str]] = {}
-
-    # 1) Exact cleaned matches
-    for row in rows:
-        raw_sym = row.get(symbol_col) if symbol_col else None
-        raw_secid = row.get(secid_col) if secid_col else None
-        raw_exch = row.get(exch_col) if exch_col else None
-        if not raw_sym or not raw_secid:
-            continue
-        cs = clean_symbol(raw_sym)
-        csv_seen.append(cs)
-        if cs in cleaned_target:
-            instrument_map[cleaned_target[cs]] = {
+    with open_scrip_master(file_path) as (stream, report):
+        reader = csv.reader(stream)
+        fieldnames = next(reader, None) or []
+        print("CSV HEADER:", ",".join(fieldnames))
+        print("Detected CSV columns:", fieldnames[:60])
+
+        def pick(cands, substring=True):
+            for k in cands:
+                for f in fieldnames:
+                    if f and f.lower() == k.lower():
+                        return f
+            if not substring:
+                return None
+            for k in cands:
+                for f in fieldnames:
+                    if f and k.lower() in f.lower():
+                        return f
+            return None
+
+        symbol_col = pick(symbol_candidates)
+        secid_col = pick(secid_candidates)
+        exch_col = pick(exch_candidates)
+        segment_col = pick(['SEM_SEGMENT', 'SEGMENT'], substring=False)
+        instrument_col = pick(['SEM_INSTRUMENT_NAME', 'INSTRUMENT'], substring=False)
+        if segment_col == exch_col:
+            segment_col = None
+
+        print("Using columns -> symbol:", symbol_col, " secid:", secid_col, " exchange:", exch_col,
+              " segment:", segment_col, " instrument:", instrument_col)
+        if not symbol_col or not secid_col:
+            raise Exception(f"Symbol / security id columns not found in CSV header: {fieldnames[:20]}")
+
+        # Only the needed columns are read from each row (by position)
+        sym_i, secid_i = fieldnames.index(symbol_col), fieldnames.index(secid_col)
+        exch_i, seg_i, inst_i = (fieldnames.index(c) if c else None for c in (exch_col, segment_col, instrument_col))
+        width = max(i for i in (sym_i, secid_i, exch_i, seg_i, inst_i) if i is not None) + 1
+
+        def col(row, i):
+            return row[i] if i is not None else None
+
+        # One pass over the rows: equity rows go into the matcher's indexes
+        equity, fallback = SymbolMatcher(), SymbolMatcher()
+        for row in reader:
+            report.rows += 1
+            if report.rows <= 2:
+                print(f"CSV SAMPLE ROW {report.rows}:", ",".join(row))
+            if len(row) < width:
+                continue
+            raw_sym, raw_secid = row[sym_i], row[secid_i]
+            if not raw_sym or not raw_secid:
+                continue
+            raw_exch = col(row, exch_i)
+            entry = {
                 'security_id': str(raw_secid),
                 'exchange_segment': raw_exch or '',
                 'csv_symbol': raw_sym,
             }
+            if is_equity_row(raw_exch, col(row, seg_i), col(row, inst_i)):
+                equity.add(clean_symbol(raw_sym), entry)
+            elif not equity.exact:
+                fallback.add(clean_symbol(raw_sym), entry) # Only kept until an equity row shows up
+
+    print(f"Scrip master: {report}")
+    matcher = equity if equity.exact else fallback
+    if not equity.exact:
+        print("WARNING: no NSE equity rows recognised; matching against all rows.")
+    matcher.build()
+    print(f"Indexed {len(matcher.exact)} symbols from {report.rows} CSV rows.")
 
-    # 2) startswith/contains
-    if len(instrument_map) < len(symbols_set):
-        remaining = {s for s in symbols_set if s not in instrument_map}
-        for row in rows:
-            raw_sym = row.get(symbol_col) if symbol_col else None
-            raw_secid = row.get(secid_col) if secid_col else None
-            raw_exch = row.get(exch_col) if exch_col else None
-            if not raw_sym or not raw_secid:
-                continue
-            cs = clean_symbol(raw_sym)
-            for target in list(remaining):
-                if cs.startswith(clean_symbol(target)) or clean_symbol(target).startswith(cs) or clean_symbol(target) in cs:
-                    instrument_map[target] = {
-                        'security_id': str(raw_secid),
-                        'exchange_segment': raw_exch or '',
-                        'csv_symbol': raw_sym,
-                    }
-                    remaining.discard(target)
-
-    # 3) fuzzy match
-    if len(instrument_map) < len(symbols_set):
-        csv_seen = list(set(csv_seen))
-        remaining = [s for s in symbols_set if s not in instrument_map]
-        for target in remaining:
-            ct = clean_symbol(target)
-            close = get_close_matches(ct, csv_seen, n=3, cutoff=0.82)
-            if close:
-                match_cs = close[0]
-                for row in rows:
-                    raw_sym = row.get(symbol_col) if symbol_col else None
-                    raw_secid = row.get(secid_col) if secid_col else None
-                    raw_exch = row.get(exch_col) if exch_col else None
-                    if raw_sym and clean_symbol(raw_sym) == match_cs and raw_secid:
-                        instrument_map[target] = {
-                            'security_id': str(raw_secid),
-                            'exchange_segment': raw_exch or '',
-                            'csv_symbol': raw_sym,
-                        }
-                        break
-
+    instrument_map: Dict[str, Dict[str, str]] = {}
+    for target in sorted(symbols_set):
+        key, method = matcher.match(target)
+        if key:
+            instrument_map[target] = dict(matcher.exact[key], match=method)
     return instrument_map
 
 
+def match_report(instrument_map: Dict[str, Dict[str, str]], symbols) -> Tuple[Dict[str, int], List[str]]:
+    """Count per match method (+ 'missing') and 'SYMBOL -> CSV_SYMBOL (method)' lines for non-exact matches."""
+    counts: Dict[str, int] = defaultdict(int)
+    lines = []
+    for symbol in symbols:
+        entry = instrument_map.get(symbol)
+        method = entry.get('match', 'exact') if entry else 'missing'
+        counts[method] += 1
+        if entry and method != 'exact':
+            lines.append(f"{symbol} -> {entry.get('csv_symbol') or entry.get('symbol')} ({method})")
+    return dict(counts), lines
+
+
 class Command(BaseCommand):
     help = 'Fetches Dhan instrument mapping and caches Symbol <-> Security ID in Redis for the Nifty 500 list.'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file',
+            type=str,
+            default=None,
+            help='Local scrip master CSV to parse instead of the SDK / download (runs offline).',
+        )
+
     def handle(self, *args, **options):
         # 1) Redis init
         try:
-            r = redis.from_url(settings.REDIS_URL, decode_responses=True, ssl_cert_reqs=None)
+            r = redis.from_url(settings.REDIS_URL, **settings.REDIS_CONN_KWARGS)
         except Exception as e:
             raise CommandError(f"Failed to connect to Redis (check REDIS_URL): {e}")
 
@@ -296,7 +387,7 @@ class Command(BaseCommand):
 
         # Try SDK client if token present
         dhan = None
-        if token:
+        if token and not options['file']:
             dhan = get_dhan_client(settings.DHAN_CLIENT_ID, token)
 
         instrument_map: Dict[str, Dict[str, str]] = {}
@@ -328,6 +419,7 @@ class Command(BaseCommand):
                             'security_id': str(security_id),
                             'exchange_segment': exchange_segment,
                             'symbol': symbol,
+                            'match': 'exact',
                         }
                         target_symbols.discard(symbol)
 
@@ -339,9 +431,12 @@ class Command(BaseCommand):
 
         # If no SDK result or no token, use CSV fallback
         if not instrument_map:
-            self.stdout.write(self.style.NOTICE("Fetching instrument master via Dhan's public CSV (fallback)..."))
+            if options['file']:
+                self.stdout.write(self.style.NOTICE(f"Reading instrument master from {options['file']}..."))
+            else:
+                self.stdout.write(self.style.NOTICE("Fetching instrument master via Dhan's public CSV (fallback)..."))
             try:
-                csv_map = fetch_instrument_map_from_dhan_csv(set(NIFTY_500_SYMBOLS))
+                csv_map = fetch_instrument_map_from_dhan_csv(set(NIFTY_500_SYMBOLS), options['file'])
                 instrument_map.update(csv_map)
                 total_instruments = len(instrument_map)
                 self.stdout.write(self.style.SUCCESS(f"CSV: mapped {total_instruments} instruments from CSV endpoint."))
@@ -353,6 +448,10 @@ class Command(BaseCommand):
             try:
                 r.set(settings.SYMBOL_ID_MAP_KEY, json.dumps(instrument_map))
                 self.stdout.write(self.style.SUCCESS(f"Successfully cached {total_instruments} instruments to Redis key: {settings.SYMBOL_ID_MAP_KEY}"))
+                counts, non_exact = match_report(instrument_map, NIFTY_500_SYMBOLS)
+                self.stdout.write("Match methods: " + ", ".join(f"{k}={v}" for k, v in sorted(counts.items())))
+                for line in non_exact:
+                    self.stdout.write(f"  {line}")
                 missing = [s for s in NIFTY_500_SYMBOLS if s not in instrument_map]
                 if missing:
                     self.stdout.write(self.style.WARNING(f"{len(missing)} symbols were not found (examples): {missing[:12]}"))
@@ -0,0 +1,71 @@
+# dashboard/management/commands/export_candles.py
+"""
+End-of-day export of the Redis candle history (history:<id>:1m lists) into the
+on-disk candle store (see candle_store.py). Candles already stored for the day
+(e.g. written live by the data worker) are kept; exported ones are merged in.
+"""
+import json
+from datetime import datetime
+
+import redis
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from candle_store import CandleStoreWriter, candle_epoch, epoch_day
+
+LRANGE_CHUNK = 100 # Lists fetched per pipeline round trip
+
+
+class Command(BaseCommand):
+    help = "Exports a day's 1-minute candles from the Redis history lists into the columnar candle store."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--date',
+            type=str,
+            help='Trading day to export (YYYY-MM-DD). Default: today.',
+        )
+        parser.add_argument(
+            '--dir',
+            type=str,
+            default=None,
+            help='Candle store directory (default: CANDLE_STORE_DIR).',
+        )
+
+    def handle(self, *args, **options):
+        day = options['date'] or datetime.now(settings.IST).strftime('%Y-%m-%d')
+        try:
+            datetime.strptime(day, '%Y-%m-%d')
+        except ValueError:
+            raise CommandError(f"Invalid --date: {day}")
+
+        try:
+            r = redis.from_url(settings.REDIS_URL, **settings.REDIS_CONN_KWARGS)
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f"Failed to connect to Redis: {e}"))
+            return
+
+        writer = CandleStoreWriter(options['dir'])
+        security_ids = [str(sid) for sid in settings.SECURITY_ID_MAP.values()]
+        exported, symbols, bad = 0, set(), 0
+        for i in range(0, len(security_ids), LRANGE_CHUNK):
+            chunk = security_ids[i:i + LRANGE_CHUNK]
+            pipe = r.pipeline(transaction=False)
+            for sid in chunk:
+                pipe.lrange(f"{settings.HISTORY_KEY_PREFIX}:{sid}:1m", 0, -1)
+            for entries in pipe.execute():
+                for raw in entries or []:
+                    try:
+                        candle = json.loads(raw)
+                        if epoch_day(candle_epoch(candle['ts'])) != day: continue
+                        writer.add(candle)
+                    except Exception:
+                        bad += 1
+                        continue
+                    exported += 1
+                    symbols.add(candle['symbol'])
+
+        rows = writer.flush(keep_today=False)
+        msg = f"{day}: exported {exported} candles for {len(symbols)} symbols; day now holds {rows} candles in {writer.store.day_dir(day)}."
+        if bad: msg += f" Skipped {bad} unreadable entries."
+        self.stdout.write(self.style.SUCCESS(msg))
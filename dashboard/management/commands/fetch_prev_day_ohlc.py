@@ -1,14 +1,17 @@
 # dashboard/management/commands/fetch_prev_day_ohlc.py
-import json
-import time
-import logging
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from datetime import date
+from typing import Optional
 
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 import redis
 
+from broker_limiter import BrokerLimiter, LimitedBroker
+from candle_store import CandleStore
+from prev_day_fetcher import PrevDayFetcher
+from prev_day_levels import levels_from_candle_store, levels_key, stale_symbols, write_levels
+from trading_calendar import expected_session
+
 # --- Global Helper for Dhan Client Initialization (Robust) ---
 def get_dhan_client(client_id: str, access_token: str) -> Optional[object]:
     """
@@ -36,113 +39,93 @@ def get_dhan_client(client_id: str, access_token: str) -> Optional[object]:
         return None
 
 class Command(BaseCommand):
-    help = 'Fetches OHLC data for Nifty 500 stocks and caches the Last Traded Day (PDH/PDL) in Redis.'
+    help = 'Caches previous-session OHLC levels (PDH/PDL) in Redis, keyed by session date; fetches only missing/stale symbols.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.PREV_DAY_FETCH_WORKERS,
+            help='Concurrent historical data calls (still paced by the shared data-API rate limit).',
+        )
+        parser.add_argument(
+            '--session',
+            type=str,
+            help='Session date (YYYY-MM-DD) whose levels to cache. Default: the previous trading day per the holiday calendar.',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Refetch every symbol, not only those missing or stale in the cache.',
+        )
+        parser.add_argument(
+            '--since',
+            type=str,
+            help='No API calls: compute levels for every candle-store day from this date (YYYY-MM-DD) on.',
+        )
 
     def handle(self, *args, **options):
         # 1. Initialize Redis
         try:
-            r = redis.from_url(settings.REDIS_URL, decode_responses=True, ssl_cert_reqs=None)
-            token = r.get(settings.REDIS_DHAN_TOKEN_KEY)
-            
-            if not token:
-                raise CommandError("Dhan Access Token not found in Redis. Activate via dashboard.")
+            r = redis.from_url(settings.REDIS_URL, **settings.REDIS_CONN_KWARGS)
+            r.ping()
         except Exception as e:
             raise CommandError(f"Redis Error: {e}")
 
+        if options['since']:
+            return self.from_candle_store(r, self.parse_date(options['since'], '--since'))
+
+        session = self.parse_date(options['session'], '--session') if options['session'] else expected_session()
+        instrument_map = settings.SECURITY_ID_MAP
+        todo = list(instrument_map) if options['force'] else stale_symbols(r, instrument_map, session)
+        if not todo:
+            self.stdout.write(self.style.SUCCESS(
+                f"Levels for session {session} already cached for all {len(instrument_map)} instruments ({levels_key(session)})."))
+            return
+
         # 2. Initialize Dhan Client
+        token = r.get(settings.REDIS_DHAN_TOKEN_KEY)
+        if not token:
+            raise CommandError("Dhan Access Token not found in Redis. Activate via dashboard.")
         dhan = get_dhan_client(settings.DHAN_CLIENT_ID, token)
         if not dhan:
             raise CommandError("Failed to initialize Dhan Client. Check Client ID/Token.")
+        # Paced on the info lane of the shared data-API budget (engines' order traffic is unaffected)
+        limiter = BrokerLimiter(r)
+        dhan = LimitedBroker(dhan, limiter)
 
-        # 3. Prepare Date Range (Last 15 days to catch the last valid trading session)
-        today = datetime.now()
-        from_date_obj = today - timedelta(days=15) 
-        to_date_obj = today 
-        
-        from_date = from_date_obj.strftime('%Y-%m-%d')
-        to_date = to_date_obj.strftime('%Y-%m-%d')
-
-        instrument_map = settings.SECURITY_ID_MAP
-        total_symbols = len(instrument_map)
-        
-        self.stdout.write(self.style.NOTICE(f"Fetching Historical Data for {total_symbols} instruments ({from_date} to {to_date})..."))
+        # 3. Concurrent fetch of missing / stale symbols (bounded pool, paced by the limiter's data bucket, retried with backoff)
+        fetcher = PrevDayFetcher(dhan, r, session, workers=options['workers'])
+        self.stdout.write(self.style.NOTICE(
+            f"Fetching session {session} OHLC for {len(todo)}/{len(instrument_map)} instruments ({fetcher.workers} workers)..."))
+        report = fetcher.run({symbol: instrument_map[symbol] for symbol in todo})
 
-        ohlc_data_to_cache = {}
-        processed_count = 0
-        error_count = 0
+        limiter.latency.flush() # Queueing delay samples for the dashboard
 
-        # 4. Iterate and Fetch Data
-        for i, (symbol, security_id) in enumerate(instrument_map.items()):
-            try:
-                # API Call: Historical Daily Data
-                # FIX: Changed instrument_type to 'EQUITY' based on standard usage
-                response = dhan.historical_daily_data(
-                    security_id=str(security_id),
-                    exchange_segment=dhan.NSE, 
-                    instrument_type='EQUITY', 
-                    from_date=from_date,
-                    to_date=to_date
-                )
-                
-                # DEBUG: Print the first response to diagnose API format issues
-                if i == 0:
-                    print(f"DEBUG RESP ({symbol}): {response}")
+        # 4. Report
+        summary = (f"Cached levels for {report['written']}/{report['symbols']} instruments to Redis key "
+                   f"{levels_key(session)} in {report['wall_sec']}s ({report['retries']} retries).")
+        if not report['written']:
+            raise CommandError(f"No data fetched. {report['failed']} failed, {report['empty']} empty.")
+        self.stdout.write(self.style.SUCCESS(summary))
+        if report['failed'] or report['empty'] or report['stale']:
+            self.stdout.write(self.style.WARNING(
+                f"Skipped {report['failed']} failed / {report['empty']} empty instruments, {report['stale']} stale "
+                f"(rerun to retry only these). Failed: {', '.join(report['failed_symbols']) or '-'}"))
 
-                if response.get('status') == 'success' and response.get('data'):
-                    data_list = response['data']
-                    # Dhan v2 historical data is often a dict with keys like 'start_Time', 'open', etc. lists
-                    # OR a list of dicts. We handle the list of dicts format here.
-                    
-                    if isinstance(data_list, list) and len(data_list) > 0:
-                        # Get the LAST candle (Most recent completed session)
-                        # This automatically handles weekends/holidays
-                        prev_day_candle = data_list[-1]
-                        
-                        ohlc_data_to_cache[symbol] = json.dumps({
-                            'high': float(prev_day_candle.get('high', 0)),
-                            'low': float(prev_day_candle.get('low', 0)),
-                            'close': float(prev_day_candle.get('close', 0)),
-                            'date': prev_day_candle.get('tradingDate') or prev_day_candle.get('start_Time')
-                        })
-                        processed_count += 1
-                    # Handle v2 format where data might be a dict of lists (rare but possible in some versions)
-                    elif isinstance(data_list, dict) and 'high' in data_list:
-                         # Assume list structure inside dict
-                         highs = data_list.get('high', [])
-                         lows = data_list.get('low', [])
-                         closes = data_list.get('close', [])
-                         if highs:
-                             ohlc_data_to_cache[symbol] = json.dumps({
-                                 'high': float(highs[-1]),
-                                 'low': float(lows[-1]),
-                                 'close': float(closes[-1]),
-                                 'date': 'latest'
-                             })
-                             processed_count += 1
-                else:
-                    error_count += 1
-            
-            except Exception as e:
-                # Simple backoff to respect rate limits
-                time.sleep(0.05) 
-                error_count += 1
-                if i == 0: print(f"DEBUG ERROR ({symbol}): {e}")
-                continue
-            
-            # Gentle rate limiting
-            if processed_count % 10 == 0:
-                time.sleep(0.1)
+    def parse_date(self, value: str, option: str) -> date:
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            raise CommandError(f"Invalid {option} date: {value}")
 
-        # 5. Atomic Save to Redis
-        if ohlc_data_to_cache:
-            try:
-                r.hmset(settings.PREV_DAY_HASH, ohlc_data_to_cache)
-                self.stdout.write(self.style.SUCCESS(f"Successfully cached PDH/PDL for {processed_count} instruments to Redis key: {settings.PREV_DAY_HASH}"))
-                
-                if error_count > 0:
-                    self.stdout.write(self.style.WARNING(f"Skipped {error_count} instruments (No data/API Error). Check Debug logs."))
-            
-            except Exception as e:
-                raise CommandError(f"Failed to write data to Redis: {e}")
-        else:
-            self.stdout.write(self.style.ERROR("No data fetched. Review the DEBUG RESP output above."))
\ No newline at end of file
+    def from_candle_store(self, r, since: date):
+        store = CandleStore()
+        days = store.days(since=since.isoformat())
+        if not days:
+            raise CommandError(f"No candle-store days since {since} in {store.root}.")
+        for day in days:
+            levels = levels_from_candle_store(store, day)
+            write_levels(r, date.fromisoformat(day), levels)
+            self.stdout.write(f"{day}: levels for {len(levels)} symbols -> {levels_key(date.fromisoformat(day))}")
+        self.stdout.write(self.style.SUCCESS(f"Computed levels for {len(days)} session(s) from the candle store (no API calls)."))
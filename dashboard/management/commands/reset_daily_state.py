@@ -6,6 +6,8 @@ from django.conf import settings
 from django.db import transaction
 from django.utils import timezone
 from dashboard.models import CashBreakoutTrade  # Import the specific model
+from db_health import DBConnectionManager
+from trade_events import append_events
 import redis
 
 
@@ -31,7 +33,7 @@ class Command(BaseCommand):
         today_str = datetime.now(settings.IST).date().isoformat()
 
         try:
-            r = redis.from_url(settings.REDIS_URL, decode_responses=True)
+            r = redis.from_url(settings.REDIS_URL, **settings.REDIS_CONN_KWARGS)
         except Exception as e:
             self.stdout.write(self.style.ERROR(f"Failed to connect to Redis: {e}"))
             return
@@ -56,17 +58,24 @@ class Command(BaseCommand):
 
         if force_db_close:
             self.stdout.write(self.style.WARNING("Attempting to close all OPEN/PENDING trades in DB..."))
+            db = DBConnectionManager('reset_daily_state')
+            if not db.before_writes():
+                self.stdout.write(self.style.ERROR(f"Database unavailable: {db.last_error}"))
+                return
 
             try:
                 with transaction.atomic():
                     # Close OPEN and PENDING trades for safety/simulation
-                    updated_trades = CashBreakoutTrade.objects.filter(
+                    trade_ids = list(CashBreakoutTrade.objects.filter(
                         status__in=['OPEN', 'PENDING_EXIT', 'PENDING_ENTRY']
-                    ).update(
-                        status='CLOSED',
-                        exit_reason='MANUAL_RESET_COMMAND (FORCE SQUARE OFF)',
-                        exit_time=timezone.now()
-                    )
+                    ).values_list('pk', flat=True))
+                    changes = {
+                        'status': 'CLOSED',
+                        'exit_reason': 'MANUAL_RESET_COMMAND (FORCE SQUARE OFF)',
+                        'exit_time': timezone.now(),
+                    }
+                    updated_trades = CashBreakoutTrade.objects.filter(pk__in=trade_ids).update(**changes)
+                    append_events((trade_id, changes) for trade_id in trade_ids)
                     self.stdout.write(self.style.SUCCESS(f"Force-closed {updated_trades} trades in the database."))
             except Exception as e:
                 self.stdout.write(self.style.ERROR(f"Database update failed: {e}"))
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.14 on 2026-10-19 15:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cashbreakouttrade',
+            name='correlation_id',
+            field=models.CharField(blank=True, max_length=30, null=True),
+        ),
+        migrations.AddField(
+            model_name='cashbreakouttrade',
+            name='order_sent_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='cashbreakouttrade',
+            name='order_state',
+            field=models.CharField(blank=True, choices=[('', 'Idle'), ('ENTRY_SENT', 'Entry Sent (awaiting ack)'), ('ENTRY_ACK', 'Entry Acknowledged (awaiting fill)'), ('EXIT_SENT', 'Exit Sent (awaiting ack)'), ('EXIT_ACK', 'Exit Acknowledged (awaiting fill)')], default='', max_length=12),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-19 15:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0002_trade_order_state'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cashbreakouttrade',
+            name='order_state',
+            field=models.CharField(blank=True, choices=[('', 'Idle'), ('ENTRY_SENT', 'Entry Sent (awaiting ack)'), ('ENTRY_ACK', 'Entry Acknowledged (awaiting fill)'), ('EXIT_SENT', 'Exit Sent (awaiting ack)'), ('EXIT_ACK', 'Exit Acknowledged (awaiting fill)'), ('BRACKET', 'Bracket Legs at Broker')], default='', max_length=12),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.14 on 2026-10-19 16:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0003_trade_order_state_bracket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TradeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trade_id', models.BigIntegerField(db_index=True)),
+                ('event_type', models.CharField(max_length=20)),
+                ('price', models.FloatField(blank=True, null=True)),
+                ('ts', models.DateTimeField()),
+                ('payload', models.JSONField(default=dict)),
+            ],
+            options={
+                'verbose_name_plural': 'Trade Events',
+            },
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.0.14 on 2026-10-19 16:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0004_trade_event'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cashbreakouttrade',
+            name='status',
+            field=models.CharField(choices=[('PENDING_ENTRY', 'Pending Entry Order'), ('OPEN', 'Open Position'), ('PENDING_EXIT', 'Pending Exit Order'), ('CLOSED', 'Closed/Squared Off'), ('EXPIRED', 'Pending Entry Expired (6 min/SL)'), ('FAILED_ENTRY', 'Entry Order Failed/Rejected')], db_index=True, default='PENDING_ENTRY', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='ArchivedTrade',
+            fields=[
+                ('symbol', models.CharField(max_length=20)),
+                ('security_id', models.CharField(max_length=20)),
+                ('quantity', models.IntegerField(default=0)),
+                ('status', models.CharField(choices=[('PENDING_ENTRY', 'Pending Entry Order'), ('OPEN', 'Open Position'), ('PENDING_EXIT', 'Pending Exit Order'), ('CLOSED', 'Closed/Squared Off'), ('EXPIRED', 'Pending Entry Expired (6 min/SL)'), ('FAILED_ENTRY', 'Entry Order Failed/Rejected')], db_index=True, default='PENDING_ENTRY', max_length=20)),
+                ('exit_reason', models.CharField(blank=True, max_length=255, null=True)),
+                ('prev_day_high', models.FloatField(blank=True, null=True)),
+                ('entry_level', models.FloatField(verbose_name='Target Entry Price (Trigger)')),
+                ('stop_level', models.FloatField(verbose_name='Stop Loss Price')),
+                ('target_level', models.FloatField(verbose_name='Target Price (2.5R)')),
+                ('entry_price', models.FloatField(blank=True, null=True)),
+                ('exit_price', models.FloatField(blank=True, null=True)),
+                ('entry_order_id', models.CharField(blank=True, max_length=50, null=True)),
+                ('exit_order_id', models.CharField(blank=True, max_length=50, null=True)),
+                ('order_state', models.CharField(blank=True, choices=[('', 'Idle'), ('ENTRY_SENT', 'Entry Sent (awaiting ack)'), ('ENTRY_ACK', 'Entry Acknowledged (awaiting fill)'), ('EXIT_SENT', 'Exit Sent (awaiting ack)'), ('EXIT_ACK', 'Exit Acknowledged (awaiting fill)'), ('BRACKET', 'Bracket Legs at Broker')], default='', max_length=12)),
+                ('correlation_id', models.CharField(blank=True, max_length=30, null=True)),
+                ('order_sent_at', models.DateTimeField(blank=True, null=True)),
+                ('candle_ts', models.DateTimeField(verbose_name='Candle Signal Time')),
+                ('entry_time', models.DateTimeField(blank=True, null=True)),
+                ('exit_time', models.DateTimeField(blank=True, null=True)),
+                ('pnl', models.FloatField(default=0.0, verbose_name='Realized PnL')),
+                ('candle_high', models.FloatField(blank=True, null=True)),
+                ('candle_low', models.FloatField(blank=True, null=True)),
+                ('volume_price', models.FloatField(blank=True, null=True)),
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField()),
+                ('trade_date', models.DateField(db_index=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('strategy', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='dashboard.strategysettings')),
+            ],
+            options={
+                'verbose_name_plural': 'Archived Trades',
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyTradeSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trade_date', models.DateField(db_index=True)),
+                ('symbol', models.CharField(max_length=20)),
+                ('trades', models.IntegerField(default=0)),
+                ('wins', models.IntegerField(default=0)),
+                ('losses', models.IntegerField(default=0)),
+                ('unfilled', models.IntegerField(default=0)),
+                ('win_rate', models.FloatField(default=0.0)),
+                ('pnl', models.FloatField(default=0.0)),
+                ('strategy', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='dashboard.strategysettings')),
+            ],
+            options={
+                'verbose_name_plural': 'Daily Trade Summaries',
+                'unique_together': {('trade_date', 'strategy', 'symbol')},
+            },
+        ),
+    ]
@@ -63,8 +63,8 @@ class StrategySettings(models.Model):
     def __str__(self):
         return self.name
 
-class CashBreakoutTrade(models.Model):
-    """Tracks the detailed state of every trade executed by the breakout engine."""
+class TradeRecord(models.Model):
+    """Columns shared by live trades (CashBreakoutTrade) and their archive (ArchivedTrade)."""
     
     STATUS_CHOICES = [
         ('PENDING_ENTRY', 'Pending Entry Order'),
@@ -75,12 +75,22 @@ class CashBreakoutTrade(models.Model):
         ('FAILED_ENTRY', 'Entry Order Failed/Rejected'),
     ]
 
+    # In-flight broker request for the current leg ('' = nothing outstanding)
+    ORDER_STATE_CHOICES = [
+        ('', 'Idle'),
+        ('ENTRY_SENT', 'Entry Sent (awaiting ack)'),
+        ('ENTRY_ACK', 'Entry Acknowledged (awaiting fill)'),
+        ('EXIT_SENT', 'Exit Sent (awaiting ack)'),
+        ('EXIT_ACK', 'Exit Acknowledged (awaiting fill)'),
+        ('BRACKET', 'Bracket Legs at Broker'),
+    ]
+
     strategy = models.ForeignKey(StrategySettings, on_delete=models.SET_NULL, null=True)
     symbol = models.CharField(max_length=20)
     security_id = models.CharField(max_length=20) # Dhan Security ID for fast reference
     quantity = models.IntegerField(default=0)
     
-    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING_ENTRY')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING_ENTRY', db_index=True)
     exit_reason = models.CharField(max_length=255, blank=True, null=True)
 
     # Price Levels (Set upon entry signal generation)
@@ -96,6 +106,9 @@ class CashBreakoutTrade(models.Model):
     # Broker Order IDs
     entry_order_id = models.CharField(max_length=50, blank=True, null=True)
     exit_order_id = models.CharField(max_length=50, blank=True, null=True)
+    order_state = models.CharField(max_length=12, choices=ORDER_STATE_CHOICES, blank=True, default='')
+    correlation_id = models.CharField(max_length=30, blank=True, null=True) # Dhan 'tag' of the latest leg
+    order_sent_at = models.DateTimeField(blank=True, null=True) # When the in-flight state was entered
     
     # Time Stamps
     candle_ts = models.DateTimeField(verbose_name="Candle Signal Time")
@@ -111,8 +124,60 @@ class CashBreakoutTrade(models.Model):
     candle_low = models.FloatField(blank=True, null=True)
     volume_price = models.FloatField(blank=True, null=True)
 
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return f"{self.symbol} ({self.status}) @ {self.entry_price or 'N/A'}"
+
+class CashBreakoutTrade(TradeRecord):
+    """Tracks the detailed state of every trade executed by the breakout engine (current day; see archive_trades)."""
+
     class Meta:
         verbose_name_plural = "Cash Breakout Trades"
 
+class ArchivedTrade(TradeRecord):
+    """Terminal trades moved out of CashBreakoutTrade by the archive_trades command (same id)."""
+
+    id = models.BigIntegerField(primary_key=True) # Original CashBreakoutTrade id (TradeEvent.trade_id)
+    created_at = models.DateTimeField() # Copied, not auto_now_add
+    trade_date = models.DateField(db_index=True) # IST date of the signal candle
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = "Archived Trades"
+
+class DailyTradeSummary(models.Model):
+    """Per-day, per-strategy, per-symbol results, rebuilt from ArchivedTrade when a day is archived."""
+
+    trade_date = models.DateField(db_index=True)
+    strategy = models.ForeignKey(StrategySettings, on_delete=models.SET_NULL, null=True)
+    symbol = models.CharField(max_length=20)
+    trades = models.IntegerField(default=0) # Closed positions
+    wins = models.IntegerField(default=0)
+    losses = models.IntegerField(default=0)
+    unfilled = models.IntegerField(default=0) # EXPIRED / FAILED_ENTRY
+    win_rate = models.FloatField(default=0.0) # wins / trades
+    pnl = models.FloatField(default=0.0)
+
+    class Meta:
+        verbose_name_plural = "Daily Trade Summaries"
+        unique_together = ('trade_date', 'strategy', 'symbol')
+
+    def __str__(self):
+        return f"{self.trade_date} {self.symbol}: {self.trades} trades, PnL {self.pnl:.2f}"
+
+class TradeEvent(models.Model):
+    """Append-only history of CashBreakoutTrade transitions (batched inserts, see trade_events.py)."""
+
+    trade_id = models.BigIntegerField(db_index=True) # Plain id, no FK: history outlives the trade row
+    event_type = models.CharField(max_length=20) # New status / order_state, STOP_MOVED, CREATED, UPDATE
+    price = models.FloatField(blank=True, null=True)
+    ts = models.DateTimeField()
+    payload = models.JSONField(default=dict) # Changed columns (full row for CREATED)
+
+    class Meta:
+        verbose_name_plural = "Trade Events"
+
     def __str__(self):
-        return f"{self.symbol} ({self.status}) @ {self.entry_price or 'N/A'}"
\ No newline at end of file
+        return f"Trade {self.trade_id} {self.event_type} @ {self.price if self.price is not None else 'N/A'}"
@@ -1,3 +1,1526 @@
-from django.test import TestCase
+# dashboard/tests.py - Engine state-machine tests (fakeredis + SimulatedDhan, no network)
+"""
+    pip install -r requirements-dev.txt
+    python manage.py test dashboard
 
-# Create your tests here.
+The Algo Engine's module globals (r, DHAN_CLIENT, TRADE_STORE, now_ist, ...) are
+swapped per test for a fakeredis connection, a SimulatedDhan with an explicit
+price map, and a fresh DjangoTradeStore on the test database.
+"""
+import csv
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from collections import defaultdict
+from datetime import datetime, timedelta
+from unittest import mock
+
+import numpy as np
+import requests
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from dashboard.models import CashBreakoutTrade, StrategySettings, TradeEvent
+
+
+def wait_until(cond, timeout=2.0, step=0.01):
+    """Polls `cond` (SimulatedDhan delivers updates from its own thread)."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if cond(): return True
+        time.sleep(step)
+    return cond()
+
+
+@unittest.skipUnless(fakeredis is not None, 'fakeredis not installed')
+class EngineTestCase(TestCase):
+    """Engine globals on fakeredis + SimulatedDhan; trades persist to the test DB."""
+
+    ack_latency = 'const:0'
+    fill_latency = 'const:5'
+
+    def setUp(self):
+        import algo_engine as engine
+        from broker_limiter import BrokerLimiter, LimitedBroker
+        from latency import LatencyRecorder
+        from sim_broker import SimulatedDhan
+
+        self.engine = engine
+        self.r = fakeredis.FakeRedis(decode_responses=True)
+        self.ltp = {}
+        self.sim = SimulatedDhan(self.r, price_fn=lambda sid: self.ltp.get(sid), ack_latency=self.ack_latency,
+                                 fill_latency=self.fill_latency, reject_rate=0, partial_fill_rate=0, slippage_pct=0)
+        self.addCleanup(self.sim.close)
+        recorder = LatencyRecorder(self.r, flush_sec=float('inf'))
+        self.limiter = BrokerLimiter(None, recorder) # In-process bucket
+        self.now = datetime.now(settings.IST).replace(hour=10, minute=0, second=0, microsecond=0)
+        for name, value in (('r', self.r), ('DHAN_CLIENT', LimitedBroker(self.sim, self.limiter)),
+                            ('TRADE_STORE', engine.DjangoTradeStore()), ('LATENCY', recorder),
+                            ('TRIGGERS', None), ('now_ist', lambda: self.now)):
+            patcher = mock.patch.object(engine, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.model = StrategySettings.objects.create(name='T', is_enabled=True, per_trade_sl_amount=1000,
+                                                     max_total_trades=50)
+        self.stream_pos = '0-0'
+
+    def make_trade(self, i=0, **fields):
+        values = dict(strategy=self.model, symbol=f'S{i}', security_id=str(1000 + i), quantity=10,
+                      status='PENDING_ENTRY', entry_level=100, stop_level=90, target_level=120,
+                      candle_ts=self.now, created_at=self.now)
+        values.update(fields)
+        row = CashBreakoutTrade.objects.create(**values)
+        self.ltp[row.security_id] = 101.0
+        return row
+
+    def strategy(self):
+        strategy = self.engine.CashBreakoutStrategy(strategy_settings=self.model)
+        strategy.bracket = False
+        return strategy
+
+    def drain_orders(self, strategy):
+        """Applies the order updates SimulatedDhan published so far."""
+        for message_id, data in self.r.xrange(settings.REDIS_STREAM_ORDERS, min=f'({self.stream_pos}'):
+            self.stream_pos = message_id
+            self.engine.handle_order_update(json.loads(data['p']), [strategy])
+
+    def row(self, symbol='S0'):
+        return CashBreakoutTrade.objects.get(symbol=symbol)
+
+
+class DurableTradeWritesTests(EngineTestCase):
+    """Order legs are on disk before / right after each broker call."""
+
+    fill_latency = 'const:10000' # No fill during the test
+
+    def test_entry_ack_written_without_flush(self):
+        self.make_trade()
+        strategy = self.strategy()
+        strategy.execute_market_entry(strategy.active_trades['S0'])
+        row = self.row()
+        self.assertEqual(row.order_state, 'ENTRY_ACK')
+        self.assertTrue(row.entry_order_id)
+        self.assertEqual(row.correlation_id, f'T{row.id}-E')
+        self.assertEqual(
+            list(TradeEvent.objects.filter(trade_id=row.id).values_list('event_type', flat=True)),
+            ['ENTRY_SENT', 'ENTRY_ACK'])
+
+    def test_stop_move_is_batched(self):
+        self.make_trade(status='OPEN', entry_price=100)
+        strategy = self.strategy()
+        trade = strategy.active_trades['S0']
+        trade.stop_level = trade.entry_level
+        self.engine.TRADE_STORE.save(trade)
+        self.assertEqual(self.row().stop_level, 90)
+        self.engine.TRADE_STORE.flush()
+        self.assertEqual(self.row().stop_level, 100)
+
+    def test_flush_writes_only_each_rows_own_changes(self):
+        self.make_trade(0, status='OPEN', entry_price=100)
+        self.make_trade(1, status='OPEN', entry_price=100)
+        strategy = self.strategy()
+        moved, exiting = strategy.active_trades['S0'], strategy.active_trades['S1']
+        moved.stop_level = 100.0
+        self.engine.TRADE_STORE.save(moved) # Buffered
+        CashBreakoutTrade.objects.filter(symbol='S0').update(status='CLOSED', exit_reason='Manual') # Dashboard
+        exiting.status, exiting.order_state, exiting.exit_reason = 'PENDING_EXIT', 'EXIT_SENT', 'EOD'
+        self.assertTrue(self.engine.TRADE_STORE.save(exiting)) # Durable: flushes both
+        row = self.row('S0')
+        self.assertEqual((row.status, row.exit_reason, row.stop_level), ('CLOSED', 'Manual', 100.0))
+        self.assertEqual(self.row('S1').order_state, 'EXIT_SENT')
+
+    def test_entry_deferred_when_state_not_persisted(self):
+        self.make_trade()
+        strategy = self.strategy()
+        trade = strategy.active_trades['S0']
+        with mock.patch.object(TradeEvent.objects, 'bulk_create', side_effect=Exception('db down')):
+            strategy.execute_market_entry(trade)
+        self.assertEqual(self.sim.order_book(), {})
+        self.assertEqual(trade.order_state, '')
+        self.assertTrue(self.engine.TRADE_STORE.flush())
+        self.assertEqual(self.row().order_state, '')
+
+
+class PrevDayLevelTests(EngineTestCase):
+    """Live lookups read the expected session only, never the legacy hash."""
+
+    def test_legacy_hash_is_not_a_live_fallback(self):
+        from prev_day_levels import encode_levels, levels_key, load_highs
+        from trading_calendar import expected_session
+
+        self.r.hset(settings.PREV_DAY_HASH, 'S0', json.dumps({'high': 50.0}))
+        strategy = self.strategy()
+        self.assertIsNone(strategy.get_prev_day_high('S0'))
+        self.assertEqual(load_highs(self.r, expected_session(self.now)), {})
+
+        session = expected_session(self.now)
+        self.r.hset(levels_key(session), 'S0', encode_levels(99.5, 95.0, 98.0, session.isoformat()))
+        self.assertEqual(strategy.get_prev_day_high('S0'), 99.5)
+        self.assertEqual(load_highs(self.r, session), {'S0': 99.5})
+
+    def test_redis_error_is_not_reported_as_a_missing_level(self):
+        import redis
+        from prev_day_levels import encode_levels, levels_key
+        from trading_calendar import expected_session
+
+        strategy = self.strategy()
+        session = expected_session(self.now)
+        self.r.hset(levels_key(session), 'S0', encode_levels(99.5, 95.0, 98.0, session.isoformat()))
+        with mock.patch.object(self.r, 'hget', side_effect=redis.ConnectionError('reset')), \
+             mock.patch('builtins.print') as printed:
+            self.assertIsNone(strategy.get_prev_day_high('S0'))
+        self.assertIn('Prev-Day Lookup Error (S0): reset', printed.call_args.args[0])
+        self.assertNotIn('S0', strategy.pdh_missing)
+        self.assertEqual(strategy.get_prev_day_high('S0'), 99.5) # Next lookup, Redis back
+
+        self.r.hset(levels_key(session), 'S1', 'garbage')
+        with mock.patch('builtins.print') as printed:
+            self.assertIsNone(strategy.get_prev_day_high('S1'))
+        self.assertIn(f"No prev-day level for S1 ({levels_key(session)})", printed.call_args.args[0])
+        self.assertIn('S1', strategy.pdh_missing)
+
+
+class MainLoopBrokerQueryTests(EngineTestCase):
+    """An in-flight status query never queues on the main loop for the info lane's wait."""
+
+    fill_latency = 'const:10000'
+
+    def test_rate_limited_query_is_deferred_to_next_pass(self):
+        self.make_trade()
+        strategy = self.strategy()
+        trade = strategy.active_trades['S0']
+        strategy.execute_market_entry(trade)
+        sent_at = trade.order_sent_at
+        self.now += timedelta(seconds=settings.ORDER_FILL_TIMEOUT_SEC + 1)
+
+        slow = dict(settings.BROKER_RATE_BUCKETS, order=dict(settings.BROKER_RATE_BUCKETS['order'], rate=0.1))
+        with override_settings(BROKER_RATE_BUCKETS=slow):
+            self.limiter.local['order'] = [0.0, time.monotonic()] # Drained
+            started = time.monotonic()
+            strategy.check_in_flight(trade)
+            self.assertLess(time.monotonic() - started, settings.ENGINE_BROKER_QUERY_MAX_WAIT_SEC + 0.5)
+        self.assertEqual(trade.order_state, 'ENTRY_ACK')
+        self.assertEqual(trade.order_sent_at, sent_at) # Still overdue: retried on the next pass
+
+        with mock.patch('algo_engine.query_order', wraps=self.engine.query_order) as query:
+            strategy.check_in_flight(trade)
+        query.assert_called_once()
+
+
+class InFlightOrderTests(EngineTestCase):
+    """Overdue order legs are resolved from the broker's view, exactly once."""
+
+    fill_latency = 'const:10000' # Fills only when a test asks for one
+
+    def overdue(self, trade):
+        self.now = trade.order_sent_at + timedelta(seconds=max(settings.ORDER_ACK_TIMEOUT_SEC, settings.ORDER_FILL_TIMEOUT_SEC) + 1)
+
+    def entry_with_broken_place_order(self, reached_broker):
+        self.make_trade()
+        strategy = self.strategy()
+        trade = strategy.active_trades['S0']
+        place_order = self.sim.place_order
+
+        def lost(**kwargs):
+            if reached_broker: place_order(**kwargs)
+            raise TimeoutError('read timeout')
+
+        with mock.patch.object(self.sim, 'place_order', side_effect=lost):
+            strategy.execute_market_entry(trade)
+        self.assertEqual(trade.order_state, 'ENTRY_SENT')
+        self.assertEqual(self.row().order_state, 'ENTRY_SENT') # Durable before the outcome is known
+        return strategy, trade
+
+    def test_lost_ack_is_adopted_by_correlation_id(self):
+        strategy, trade = self.entry_with_broken_place_order(reached_broker=True)
+        self.assertIsNone(trade.entry_order_id)
+        self.overdue(trade)
+        strategy.check_in_flight(trade)
+        self.assertEqual(trade.order_state, 'ENTRY_ACK')
+        self.assertEqual(trade.entry_order_id, next(iter(self.sim.order_book())))
+        self.assertEqual(self.row().entry_order_id, trade.entry_order_id)
+        strategy.monitor_active_trades({trade.security_id: 101.0})
+        self.assertEqual(len(self.sim.order_book()), 1) # No second entry
+
+    def test_never_reached_broker_releases_the_leg(self):
+        strategy, trade = self.entry_with_broken_place_order(reached_broker=False)
+        self.overdue(trade)
+        strategy.check_in_flight(trade)
+        self.assertEqual(trade.order_state, '')
+        self.assertEqual(self.row().order_state, '')
+        strategy.monitor_active_trades({trade.security_id: 101.0}) # Fires again
+        self.assertEqual(trade.order_state, 'ENTRY_ACK')
+        self.assertEqual(len(self.sim.order_book()), 1)
+
+    def test_fill_timeout_cancels_the_stale_entry(self):
+        self.make_trade()
+        strategy = self.strategy()
+        trade = strategy.active_trades['S0']
+        strategy.execute_market_entry(trade)
+        self.overdue(trade)
+        strategy.check_in_flight(trade)
+        self.drain_orders(strategy)
+        self.assertEqual(self.row().status, 'FAILED_ENTRY')
+        self.assertEqual(self.row().exit_reason, 'Entry Cancelled')
+        self.assertNotIn('S0', strategy.active_trades)
+
+    def test_missed_fill_is_reconciled_without_cancel(self):
+        self.make_trade()
+        strategy = self.strategy()
+        trade = strategy.active_trades['S0']
+        strategy.execute_market_entry(trade)
+        self.sim._schedule(0, trade.entry_order_id, 'FILL') # Fills; its update is never read
+        self.assertTrue(wait_until(lambda: self.sim.order_book()[trade.entry_order_id]['status'] == 'TRADED'))
+        self.overdue(trade)
+        with mock.patch.object(self.sim, 'cancel_order') as cancel:
+            strategy.check_in_flight(trade)
+        cancel.assert_not_called()
+        self.assertEqual(trade.status, 'OPEN')
+        self.assertEqual(self.row().entry_price, 101.0)
+
+    def test_entry_resolved_by_the_update_is_not_cancelled(self):
+        self.make_trade()
+        strategy = self.strategy()
+        trade = strategy.active_trades['S0']
+        strategy.execute_market_entry(trade)
+        self.overdue(trade)
+        stale = {'order_id': trade.entry_order_id, 'status': 'PENDING', 'price': None, 'leg': 1}
+
+        def query_then_fill(*args):
+            # The fill lands between the status query and the cancel decision
+            self.engine.handle_order_update({'orderId': trade.entry_order_id, 'orderStatus': 'TRADED',
+                                             'tradedPrice': 101.0}, [strategy])
+            return stale
+
+        with mock.patch('algo_engine.query_order', side_effect=query_then_fill), \
+                mock.patch.object(self.sim, 'cancel_order') as cancel:
+            strategy.check_in_flight(trade)
+        cancel.assert_not_called()
+        self.assertEqual(trade.status, 'OPEN')
+
+
+class SharedSimOrderBookTests(EngineTestCase):
+    """The dashboard's simulator sees (and can act on) orders the engine placed."""
+
+    fill_latency = 'const:10000'
+
+    def other_process(self, background=False):
+        """A dashboard worker's client (background=False), or a restarted engine's."""
+        from sim_broker import SimulatedDhan
+        sim = SimulatedDhan(self.r, price_fn=lambda sid: self.ltp.get(sid), ack_latency='const:0',
+                            fill_latency='const:0', reject_rate=0, partial_fill_rate=0, slippage_pct=0,
+                            background=background)
+        self.addCleanup(sim.close)
+        return sim
+
+    def test_dashboard_client_runs_no_threads(self):
+        before = set(threading.enumerate())
+        dashboard = self.other_process()
+        self.assertEqual(set(threading.enumerate()) - before, set())
+        self.assertIsNone(dashboard.feed)
+
+        self.ltp['1000'] = 101.0
+        resp = dashboard.place_order(security_id='1000', exchange_segment='NSE_EQ', transaction_type='BUY', quantity=5,
+                                     order_type='MARKET', product_type='INTRADAY', price=0, tag='T1-E')
+        order_id = resp['data']['orderId']
+        # Its ack / fill events are processed by the engine's loop
+        self.assertTrue(wait_until(lambda: self.sim.order_book()[order_id]['status'] == 'TRADED'))
+
+    def test_manual_cancel_of_engine_order(self):
+        self.make_trade()
+        strategy = self.strategy()
+        trade = strategy.active_trades['S0']
+        strategy.execute_market_entry(trade)
+
+        dashboard = self.other_process()
+        self.assertEqual(dashboard.get_order_by_correlationID(trade.correlation_id)['data']['OrderNo'], trade.entry_order_id)
+        self.assertEqual(dashboard.cancel_order(trade.entry_order_id)['status'], 'success')
+        self.assertEqual(self.sim.get_order_by_id(trade.entry_order_id)['data'][0]['OrderStatus'], 'CANCELLED')
+        self.drain_orders(strategy)
+        self.assertEqual(self.row().status, 'FAILED_ENTRY')
+
+    def test_bracket_square_off_from_another_process(self):
+        self.ltp['1000'] = 101.0
+        resp = self.sim.place_order(security_id='1000', exchange_segment='NSE_EQ', transaction_type='BUY', quantity=5,
+                                    order_type='MARKET', product_type='BO', price=0, bo_profit_value=20,
+                                    bo_stop_loss_Value=10, tag='T1-E')
+        order_id = resp['data']['orderId']
+        self.sim._schedule(0, order_id, 'FILL')
+        self.assertTrue(wait_until(lambda: self.sim.order_book()[order_id]['legs']))
+
+        self.sim.close() # Engine stopped; its scheduled leg polls stay in Redis
+        dashboard = self.other_process()
+        self.assertEqual(dashboard.cancel_order(order_id)['status'], 'success')
+        time.sleep(0.1)
+        self.assertNotIn('exit_price', self.sim.order_book()[order_id]) # No loop to run the exit yet
+        self.other_process(background=True) # Engine restarted
+        self.assertTrue(wait_until(lambda: self.sim.order_book()[order_id].get('exit_price') == 101.0))
+        self.assertEqual(dashboard.get_order_by_id(order_id)['data'][0]['OrderStatus'], 'TRADED')
+
+
+class BreakoutBatchTests(unittest.TestCase):
+    """evaluate_breakouts matches the per-candle breakout math, ranked by strength."""
+
+    @staticmethod
+    def scalar(candle, pdh, cfg, max_candle_pct):
+        """The pre-batch process_new_candle arithmetic for one candle (None = no signal)."""
+        from math import floor
+        from signal_filter import candle_range_pct
+        open_p, close_p = float(candle['open']), float(candle['close'])
+        if not pdh or not (open_p < pdh < close_p): return None
+        if max_candle_pct and candle_range_pct(candle) > max_candle_pct: return None
+        entry = float(candle['high']) * (1.0 + cfg.entry_offset_pct)
+        stop = float(candle['low']) * (1.0 - cfg.stop_offset_pct)
+        risk = entry - stop
+        if risk <= 0: return None
+        qty = floor(cfg.per_trade_sl_amount / risk)
+        if qty <= 0: return None
+        return entry, stop, entry + cfg.risk_multiplier * risk, qty
+
+    def test_parity_with_scalar_math(self):
+        import random
+        from types import SimpleNamespace
+        import numpy as np
+        from batch_signals import evaluate_breakouts
+
+        rng = random.Random(42)
+        cfg = SimpleNamespace(entry_offset_pct=0.0005, stop_offset_pct=0.0005, risk_multiplier=2.0, per_trade_sl_amount=2000)
+        candles, pdh = [], []
+        for _ in range(500):
+            o = rng.uniform(50, 3000)
+            c = o * rng.uniform(0.97, 1.03)
+            candles.append({'open': o, 'close': c, 'high': max(o, c) * rng.uniform(1, 1.01),
+                            'low': min(o, c) * rng.uniform(0.99, 1)})
+            pdh.append(rng.choice([None, o * rng.uniform(0.98, 1.02)]))
+        candles.append({'open': 100, 'close': 101, 'high': 2000, 'low': 0.01}) # qty 0
+        pdh.append(100.5)
+
+        for max_pct in (None, 0.02):
+            batch = evaluate_breakouts(candles, np.array([p or np.nan for p in pdh], dtype=float), cfg, max_pct)
+            expected = [(i,) + hit for i, hit in
+                        ((i, self.scalar(c, pdh[i], cfg, max_pct)) for i, c in enumerate(candles)) if hit]
+            strength = {i: (float(candles[i]['close']) - pdh[i]) / pdh[i] for i, *_ in expected}
+            expected.sort(key=lambda hit: -strength[hit[0]]) # Stable: ties keep message order
+            self.assertTrue(expected)
+            self.assertEqual(batch, expected)
+
+
+class CandleMinuteBatchTests(EngineTestCase):
+    """A minute split across reads is still ranked as one batch."""
+
+    def candle(self, i, close, minute=0):
+        self.ltp[str(1000 + i)] = close
+        return {'symbol': f'S{i}', 'security_id': str(1000 + i), 'open': 99.0, 'high': close, 'low': 98.0,
+                'close': close, 'pdh': 100.0, 'ts': (self.now + timedelta(minutes=minute)).isoformat()}
+
+    def test_minute_is_held_until_it_settles(self):
+        self.model.max_total_trades = 1
+        self.model.save()
+        runtime = self.engine.StrategyRuntime()
+        with override_settings(ENGINE_CANDLE_SETTLE_SEC=60):
+            runtime.on_candle(self.candle(0, 100.5))
+            runtime.flush_candles() # First read: the minute may still be arriving
+            self.assertFalse(CashBreakoutTrade.objects.exists())
+            runtime.on_candle(self.candle(1, 103.0)) # Stronger breakout in a later read
+            runtime.on_candle(self.candle(2, 99.5, minute=1))
+            runtime.flush_candles()
+        self.assertEqual(list(CashBreakoutTrade.objects.values_list('symbol', flat=True)), ['S1'])
+        self.assertEqual(list(runtime.minutes), [self.candle(2, 99.5, minute=1)['ts']])
+        runtime.flush_candles(force=True)
+        self.assertEqual(runtime.minutes, {})
+
+
+class MultiStrategyRuntimeTests(EngineTestCase):
+    """Every enabled StrategySettings row runs as its own strategy; each candle is parsed once for all of them."""
+
+    def candle(self, i, close):
+        self.ltp[str(1000 + i)] = close
+        return {'symbol': f'S{i}', 'security_id': str(1000 + i), 'open': 99.0, 'high': close, 'low': 98.0,
+                'close': close, 'pdh': 100.0, 'ts': self.now.isoformat()}
+
+    def test_candle_is_dispatched_to_every_strategy(self):
+        second = StrategySettings.objects.create(name='T2', is_enabled=True, per_trade_sl_amount=500,
+                                                 max_total_trades=50)
+        runtime = self.engine.StrategyRuntime()
+        self.assertEqual(sorted(s.model.pk for s in runtime.strategies.values()), [self.model.pk, second.pk])
+
+        spies = []
+        for strategy in runtime.strategies.values():
+            patcher = mock.patch.object(strategy, 'process_candle_batch', wraps=strategy.process_candle_batch)
+            spies.append(patcher.start())
+            self.addCleanup(patcher.stop)
+        data = {'p': json.dumps(self.candle(0, 101.0))}
+        self.engine.process_stream_message(settings.REDIS_STREAM_CANDLES, '1-0', data, runtime, {})
+        runtime.flush_candles(force=True)
+
+        (first,), (second_batch,) = (spy.call_args.args for spy in spies)
+        self.assertIs(first[0], second_batch[0]) # One parsed dict, shared
+        trades = CashBreakoutTrade.objects.order_by('strategy_id')
+        self.assertEqual([(t.strategy_id, t.symbol) for t in trades], [(self.model.pk, 'S0'), (second.pk, 'S0')])
+        self.assertNotEqual(trades[0].quantity, trades[1].quantity) # Sized by each row's own risk
+
+        self.assertEqual({key: calls for key, (_, calls) in runtime.cpu.items()},
+                         {key: 1 for key in runtime.strategies})
+        runtime.on_tick('1000', 100.8)
+        runtime.monitor({'1000': 100.8})
+        self.assertEqual({calls for _, calls in runtime.cpu.values()}, {2})
+        self.assertTrue(all(cpu_s >= 0 for cpu_s, _ in runtime.cpu.values()))
+
+        runtime.publish_stats()
+        stats = {k.split(':', 1)[1]: json.loads(v) for k, v in self.r.hgetall(settings.REDIS_STRATEGY_STATS_KEY).items()}
+        self.assertEqual({name: (s['calls'], s['active_trades']) for name, s in stats.items()},
+                         {'T': (2, 1), 'T2': (2, 1)})
+
+
+@override_settings(EOD_CONFIRM_DEADLINE_SEC=0, EOD_MAX_RETRIES=2) # Every poll is past the deadline
+class SquareOffRetryTests(EngineTestCase):
+    """Unconfirmed exits are checked, resent and finally escalated; brackets are not exited twice."""
+
+    fill_latency = 'const:10000' # Exits fill only when a test asks for one
+
+    def job(self, strategy):
+        from squareoff import SquareOffJob
+        job = SquareOffJob(strategy, self.engine.DHAN_CLIENT, 'EOD', workers=0)
+        job.start()
+        return job
+
+    def run_job(self, job, passes=20):
+        """Polls until the job finishes (workers=0: a broker call's result is applied on the next pass)."""
+        for _ in range(passes):
+            if job.done: break
+            job.poll()
+        return job.report()
+
+    def test_stuck_exit_is_cancelled_resent_then_escalated(self):
+        self.make_trade(status='OPEN', entry_price=100.0)
+        strategy = self.strategy()
+        job = self.job(strategy)
+        first = strategy.active_trades['S0'].exit_order_id
+        self.assertTrue(first)
+
+        report = self.run_job(job) # Two checks (cancel + resend each), then out of retries
+        self.assertTrue(job.done)
+        self.assertEqual(report['escalated'], ['S0'])
+        self.assertEqual(report['retries'], 2)
+        self.assertEqual(report['symbols']['S0'][2], 3) # Exit orders sent
+        statuses = sorted(o['status'] for o in self.sim.order_book().values())
+        self.assertEqual(statuses, ['CANCELLED', 'CANCELLED', 'PENDING'])
+        self.engine.TRADE_STORE.flush()
+        self.assertIn('MANUAL', self.row().exit_reason)
+
+    def test_missed_exit_fill_is_reconciled(self):
+        self.make_trade(status='OPEN', entry_price=100.0)
+        strategy = self.strategy()
+        job = self.job(strategy)
+        exit_id = strategy.active_trades['S0'].exit_order_id
+        self.sim._schedule(0, exit_id, 'FILL') # Its update is never read
+        self.assertTrue(wait_until(lambda: self.sim.order_book()[exit_id]['status'] == 'TRADED'))
+
+        with mock.patch.object(self.sim, 'cancel_order') as cancel:
+            report = self.run_job(job)
+        cancel.assert_not_called()
+        self.assertTrue(job.done)
+        self.assertEqual((report['confirmed'], report['retries'], report['escalated']), (1, 1, []))
+        self.assertEqual(self.row().status, 'CLOSED')
+
+    def test_open_bracket_legs_are_not_cancelled_again(self):
+        resp = self.sim.place_order(security_id='1000', exchange_segment='NSE_EQ', transaction_type='BUY', quantity=10,
+                                    order_type='MARKET', product_type='BO', price=0, bo_profit_value=20,
+                                    bo_stop_loss_Value=10, tag='T1-E')
+        entry_id = resp['data']['orderId']
+        self.ltp['1000'] = 101.0
+        self.sim._schedule(0, entry_id, 'FILL')
+        self.assertTrue(wait_until(lambda: self.sim.order_book()[entry_id]['legs']))
+        self.make_trade(status='OPEN', entry_price=101.0, entry_order_id=entry_id, exit_order_id=entry_id,
+                        order_state='BRACKET')
+        strategy = self.strategy()
+
+        with mock.patch.object(self.sim, 'cancel_order', wraps=self.sim.cancel_order) as cancel:
+            job = self.job(strategy) # Square-off = cancel the bracket (its exit is slow to fill here)
+            self.assertEqual(strategy.active_trades['S0'].exit_order_id, entry_id)
+            report = self.run_job(job)
+        cancel.assert_called_once_with(entry_id)
+        self.assertEqual((report['retries'], report['escalated']), (2, ['S0']))
+
+
+class BracketTests(EngineTestCase):
+    """Bracket mode: broker-held stop/target legs close the trade; a dashboard square-off cancels the bracket."""
+
+    fill_latency = 'const:10000' # Entries fill only when a test asks for one
+
+    def open_bracket(self):
+        self.make_trade()
+        strategy = self.strategy()
+        strategy.bracket = True
+        trade = strategy.active_trades['S0']
+        strategy.execute_market_entry(trade)
+        self.sim._schedule(0, trade.entry_order_id, 'FILL')
+        self.assertTrue(wait_until(lambda: self.sim.order_book()[trade.entry_order_id]['legs']))
+        self.drain_orders(strategy)
+        self.assertEqual((trade.status, trade.order_state), ('OPEN', 'BRACKET'))
+        self.assertEqual((trade.stop_level, trade.target_level), (91.0, 121.0)) # Re-based on the 101 fill
+        return strategy, trade
+
+    def close_by_leg(self, strategy, trade, ltp):
+        self.ltp[trade.security_id] = ltp
+        self.assertTrue(wait_until(lambda: self.sim.order_book()[trade.entry_order_id].get('exit_price')))
+        self.drain_orders(strategy)
+        self.engine.TRADE_STORE.flush()
+        return self.row()
+
+    def test_stop_leg_fill_closes_the_trade(self):
+        strategy, trade = self.open_bracket()
+        row = self.close_by_leg(strategy, trade, 90.0)
+        self.assertEqual((row.status, row.exit_reason), ('CLOSED', 'Stop Loss Hit (Bracket)'))
+        self.assertEqual((row.exit_price, row.pnl), (90.0, -110.0))
+        self.assertNotIn('S0', strategy.active_trades)
+
+    def test_target_leg_fill_closes_the_trade(self):
+        strategy, trade = self.open_bracket()
+        row = self.close_by_leg(strategy, trade, 125.0)
+        self.assertEqual((row.status, row.exit_reason), ('CLOSED', 'Target Hit (Bracket)'))
+        self.assertEqual((row.exit_price, row.pnl), (121.0, 200.0))
+        self.assertEqual(float(self.r.get(strategy.daily_pnl_key)), 200.0)
+
+    def test_dashboard_square_off_cancels_the_bracket(self):
+        from dashboard import views
+        strategy, trade = self.open_bracket()
+        self.engine.TRADE_STORE.flush()
+
+        with mock.patch.object(views, 'r', self.r), \
+             mock.patch.object(views, 'get_dhan_rest_client', return_value=self.sim), \
+             mock.patch.object(self.sim, 'cancel_order', wraps=self.sim.cancel_order) as cancel:
+            self.client.post('/', {'manual_square_off': '1', 'trade_id': trade.id})
+        cancel.assert_called_once_with(trade.entry_order_id) # No separate SELL next to the legs
+        row = self.row()
+        self.assertEqual((row.status, row.exit_reason), ('PENDING_EXIT', 'MANUAL SQUARE OFF'))
+
+        strategy.reload_settings(reload_trades=True) # The control message the view sent
+        self.sim._schedule(0, trade.entry_order_id, 'EXIT') # The exit's fill latency, cut short
+        self.assertTrue(wait_until(lambda: self.sim.order_book()[trade.entry_order_id].get('exit_price')))
+        self.drain_orders(strategy)
+        self.engine.TRADE_STORE.flush()
+        row = self.row()
+        self.assertEqual((row.status, row.exit_reason, row.exit_price), ('CLOSED', 'MANUAL SQUARE OFF', 101.0))
+        sides = [o['side'] for o in self.sim.order_book().values()]
+        self.assertEqual(sides, ['BUY'])
+
+
+class SymbolTriggerTests(unittest.TestCase):
+    """One-shot crossing detection in both directions."""
+
+    def test_crossings_both_directions(self):
+        from price_triggers import SIDE_ABOVE, SIDE_BELOW, _SymbolTriggers
+        book = _SymbolTriggers()
+        book.add(SIDE_ABOVE, 110.0, 'a110')
+        book.add(SIDE_ABOVE, 105.0, 'a105')
+        book.add(SIDE_BELOW, 90.0, 'b90')
+        book.add(SIDE_BELOW, 95.0, 'b95')
+        self.assertEqual(book.crossed(100.0), [])
+        self.assertEqual(book.crossed(104.99), [])
+        self.assertEqual(book.crossed(105.0), ['a105'])   # ABOVE fires at the price
+        self.assertEqual(book.crossed(120.0), ['a110'])   # Gap through the rest
+        self.assertEqual(book.crossed(95.0), ['b95'])     # BELOW fires at the price
+        self.assertEqual(book.crossed(80.0), ['b90'])
+        self.assertEqual((len(book), book.crossed(200.0), book.crossed(1.0)), (0, [], []))
+
+    def test_remove_disarms(self):
+        from price_triggers import SIDE_ABOVE, _SymbolTriggers
+        book = _SymbolTriggers()
+        book.add(SIDE_ABOVE, 105.0, 'k1')
+        book.add(SIDE_ABOVE, 105.0, 'k2')
+        book.remove(SIDE_ABOVE, 'k1')
+        self.assertEqual(book.crossed(106.0), ['k2'])
+
+
+@unittest.skipUnless(fakeredis is not None, 'fakeredis not installed')
+class TriggerBookTests(unittest.TestCase):
+    """Worker-side registrations, crossing events and reload."""
+
+    def setUp(self):
+        from price_triggers import TriggerBook
+        self.r = fakeredis.FakeRedis(decode_responses=True)
+        self.book = TriggerBook(self.r)
+        self.today = datetime.now(settings.IST).strftime('%Y-%m-%d')
+
+    def apply(self, *msgs):
+        pipe = self.r.pipeline(transaction=False)
+        for msg in msgs: self.book.apply(msg, pipe)
+        pipe.execute()
+
+    def events(self, security_id='1000'):
+        from partitions import route_stream
+        stream = route_stream(settings.REDIS_STREAM_TRIGGER_EVENTS, security_id)
+        return [json.loads(data['p']) for _, data in self.r.xrange(stream)]
+
+    def test_crossing_fires_once_and_clears_the_hash(self):
+        self.apply({'a': 'SET', 't': 1, 'k': 'entry', 'sid': '1000', 'side': 'ABOVE', 'price': 105, 'd': self.today},
+                   {'a': 'SET', 't': 1, 'k': 'stop', 'sid': '1000', 'side': 'BELOW', 'price': 95, 'd': self.today})
+        self.assertEqual(self.r.hlen(settings.REDIS_TRIGGER_HASH), 2)
+        self.book.on_tick('1000', 100.0, 0)
+        self.book.on_tick('2000', 200.0, 0) # No triggers on this security
+        self.assertEqual(self.events(), [])
+
+        self.book.on_tick('1000', 105.5, 0)
+        self.book.on_tick('1000', 106.0, 0) # One-shot
+        self.assertEqual([(e['t'], e['k'], e['px'], e['LTP']) for e in self.events()], [(1, 'entry', 105.0, 105.5)])
+        self.assertEqual(list(self.r.hkeys(settings.REDIS_TRIGGER_HASH)), ['1:stop'])
+
+        self.book.on_tick('1000', 94.0, 0)
+        self.assertEqual([e['k'] for e in self.events()], ['entry', 'stop'])
+        self.assertEqual((self.book.books, self.r.hlen(settings.REDIS_TRIGGER_HASH)), ({}, 0))
+
+    def test_reset_and_cancel(self):
+        self.apply({'a': 'SET', 't': 1, 'k': 'stop', 'sid': '1000', 'side': 'BELOW', 'price': 95, 'd': self.today},
+                   {'a': 'SET', 't': 1, 'k': 'stop', 'sid': '1000', 'side': 'BELOW', 'price': 100, 'd': self.today})
+        self.book.on_tick('1000', 97.0, 0) # Moved stop (breakeven) replaced the old level
+        self.assertEqual([e['px'] for e in self.events()], [100.0])
+
+        self.apply({'a': 'SET', 't': 2, 'k': 'target', 'sid': '1000', 'side': 'ABOVE', 'price': 120, 'd': self.today},
+                   {'a': 'CANCEL', 't': 2, 'k': 'target'})
+        self.book.on_tick('1000', 130.0, 0)
+        self.assertEqual(len(self.events()), 1)
+        self.assertEqual(self.r.hlen(settings.REDIS_TRIGGER_HASH), 0)
+
+    def test_failed_publish_puts_triggers_back(self):
+        self.apply({'a': 'SET', 't': 1, 'k': 'entry', 'sid': '1000', 'side': 'ABOVE', 'price': 105, 'd': self.today})
+        with mock.patch.object(self.r, 'pipeline', side_effect=ConnectionError('redis down')):
+            self.book.on_tick('1000', 106.0, 0)
+        self.assertEqual(self.events(), [])
+        self.book.on_tick('1000', 106.5, 0) # Next crossing tick delivers it
+        self.assertEqual([(e['k'], e['LTP']) for e in self.events()], [('entry', 106.5)])
+
+    def test_load_keeps_only_todays_registrations(self):
+        from price_triggers import TriggerBook
+        self.apply({'a': 'SET', 't': 1, 'k': 'entry', 'sid': '1000', 'side': 'ABOVE', 'price': 105, 'd': self.today},
+                   {'a': 'SET', 't': 2, 'k': 'entry', 'sid': '1000', 'side': 'ABOVE', 'price': 101, 'd': '2000-01-03'})
+        restarted = TriggerBook(self.r)
+        self.assertEqual(restarted.load(), 1)
+        self.assertEqual(list(self.r.hkeys(settings.REDIS_TRIGGER_HASH)), ['1:entry'])
+        restarted.on_tick('1000', 110.0, 0)
+        self.assertEqual([e['t'] for e in self.events()], [1])
+
+
+@unittest.skipUnless(fakeredis is not None, 'fakeredis not installed')
+class TriggerRegistrarTests(unittest.TestCase):
+    """The engine sends only the differences."""
+
+    def setUp(self):
+        from price_triggers import TriggerRegistrar
+        self.r = fakeredis.FakeRedis(decode_responses=True)
+        self.registrar = TriggerRegistrar(self.r)
+        self.pos = '0-0'
+
+    def sent(self):
+        msgs = []
+        for message_id, data in self.r.xrange(settings.REDIS_STREAM_TRIGGER_REGS, min=f'({self.pos}'):
+            self.pos = message_id
+            msg = json.loads(data['p'])
+            msgs.append((msg['a'], msg['t'], msg['k'], msg.get('price')))
+        return msgs
+
+    def test_sync_diffs(self):
+        wanted = {1: ('1000', {'entry': ('ABOVE', 105.0), 'stop': ('BELOW', 95.0)})}
+        self.registrar.sync(wanted)
+        self.assertEqual(sorted(self.sent()), [('SET', 1, 'entry', 105.0), ('SET', 1, 'stop', 95.0)])
+        self.registrar.sync(wanted)
+        self.assertEqual(self.sent(), [])
+
+        self.registrar.sync({1: ('1000', {'stop': ('BELOW', 100.0), 'target': ('ABOVE', 120.0)})})
+        self.assertEqual(sorted(self.sent()), [('CANCEL', 1, 'entry', None), ('SET', 1, 'stop', 100.0),
+                                               ('SET', 1, 'target', 120.0)])
+        self.registrar.sync({})
+        self.assertEqual(sorted(self.sent()), [('CANCEL', 1, 'stop', None), ('CANCEL', 1, 'target', None)])
+
+    def worker_applies(self):
+        """Applies the registrations sent so far to a worker book (persisted in the hash)."""
+        from price_triggers import TriggerBook
+        book = TriggerBook(self.r)
+        pipe = self.r.pipeline(transaction=False)
+        for _, data in self.r.xrange(settings.REDIS_STREAM_TRIGGER_REGS, min=f'({self.pos}'):
+            book.apply(json.loads(data['p']), pipe)
+        pipe.execute()
+        self.sent()
+
+    def test_restart_cancels_triggers_of_trades_closed_meanwhile(self):
+        from price_triggers import TriggerRegistrar
+        self.registrar.sync({1: ('1000', {'stop': ('BELOW', 95.0)}), 2: ('1001', {'entry': ('ABOVE', 50.0)})})
+        self.worker_applies()
+        restarted = TriggerRegistrar(self.r) # Trade 1 closed while the engine was down
+        restarted.sync({2: ('1001', {'entry': ('ABOVE', 50.0)})})
+        self.assertEqual(self.sent(), [('CANCEL', 1, 'stop', None)])
+
+    def test_failed_send_reseeds_from_the_worker_book(self):
+        self.registrar.sync({1: ('1000', {'stop': ('BELOW', 95.0)})})
+        self.worker_applies()
+        with mock.patch.object(self.r, 'pipeline', side_effect=ConnectionError('redis down')):
+            self.registrar.sync({1: ('1000', {'stop': ('BELOW', 95.0)}), 2: ('1001', {'entry': ('ABOVE', 50.0)})})
+        self.registrar.sync({2: ('1001', {'entry': ('ABOVE', 50.0)})}) # Trade 1 closed in between
+        self.assertEqual(sorted(self.sent()), [('CANCEL', 1, 'stop', None), ('SET', 2, 'entry', 50.0)])
+
+    def test_fired_trigger_is_registered_again_if_still_wanted(self):
+        wanted = {1: ('1000', {'entry': ('ABOVE', 105.0)})}
+        self.registrar.sync(wanted)
+        self.sent()
+        self.registrar.fired(1, 'entry')
+        self.registrar.sync(wanted) # e.g. the entry was deferred
+        self.assertEqual(self.sent(), [('SET', 1, 'entry', 105.0)])
+
+
+class EngineTriggerTests(EngineTestCase):
+    """A trade's triggers are armed and disarmed as its state changes."""
+
+    def test_triggers_follow_trade_state(self):
+        from price_triggers import TriggerRegistrar
+        registrar = TriggerRegistrar(self.r)
+        patcher = mock.patch.object(self.engine, 'TRIGGERS', registrar)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.make_trade()
+        runtime = self.engine.StrategyRuntime()
+        strategy = next(iter(runtime.strategies.values()))
+        strategy.bracket = False
+        trade = strategy.active_trades['S0']
+
+        runtime.sync_triggers()
+        self.assertEqual(registrar.registered[trade.id], {'entry': ('ABOVE', 100.0), 'stop': ('BELOW', 90.0)})
+
+        strategy.execute_market_entry(trade) # Entry in flight: nothing to watch
+        runtime.sync_triggers()
+        self.assertEqual(registrar.registered[trade.id], {})
+
+        self.assertTrue(wait_until(lambda: self.r.xlen(settings.REDIS_STREAM_ORDERS) >= 2))
+        self.drain_orders(strategy) # Filled
+        self.assertEqual(trade.status, 'OPEN')
+        runtime.sync_triggers()
+        self.assertEqual(set(registrar.registered[trade.id]), {'breakeven', 'target', 'stop'})
+        self.assertEqual(registrar.registered[trade.id]['stop'], ('BELOW', 90.0))
+
+        trade.order_state = 'EXIT_SENT' # Exit in flight
+        runtime.sync_triggers()
+        self.assertEqual(registrar.registered[trade.id], {})
+        del strategy.active_trades['S0'] # Closed
+        runtime.sync_triggers()
+        self.assertNotIn(trade.id, registrar.registered)
+
+
+@unittest.skipUnless(fakeredis is not None, 'fakeredis not installed')
+class LatencyRecorderTests(unittest.TestCase):
+    """Samples recorded from several threads while flushing are all counted."""
+
+    def test_concurrent_record_and_flush(self):
+        import threading
+        from latency import LatencyRecorder, _day_key
+        r = fakeredis.FakeRedis(decode_responses=True)
+        recorder = LatencyRecorder(r, flush_sec=float('inf'))
+        threads = [threading.Thread(target=lambda: [recorder.record('hop', 0.001) for _ in range(5000)]) for _ in range(4)]
+        for t in threads: t.start()
+        while any(t.is_alive() for t in threads): recorder.flush()
+        for t in threads: t.join()
+        recorder.flush()
+        self.assertEqual(sum(int(c) for c in r.hvals(_day_key('hop'))), 20000)
+
+
+@unittest.skipUnless(fakeredis is not None, 'fakeredis not installed')
+class ArchiveTradesTests(TestCase):
+    """Today's trades are not archived while an engine may still write them."""
+
+    def setUp(self):
+        self.r = fakeredis.FakeRedis(decode_responses=True)
+        patcher = mock.patch('redis.from_url', return_value=self.r)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        model = StrategySettings.objects.create(name='T')
+        now = datetime.now(settings.IST)
+        for symbol, ts in (('OLD', now - timedelta(days=1)), ('NEW', now)):
+            CashBreakoutTrade.objects.create(strategy=model, symbol=symbol, security_id='1', quantity=1, status='CLOSED',
+                                             entry_level=100, stop_level=90, target_level=120, candle_ts=ts, created_at=ts)
+
+    def archive(self):
+        from io import StringIO
+        from django.core.management import call_command
+        call_command('archive_trades', stdout=StringIO())
+        return sorted(CashBreakoutTrade.objects.values_list('symbol', flat=True))
+
+    def test_running_engine_keeps_todays_trades(self):
+        self.r.zadd(settings.REDIS_ENGINE_MEMBERS_KEY, {'engine-1': time.time()})
+        self.assertEqual(self.archive(), ['NEW'])
+
+    def test_stopped_engine_archives_everything(self):
+        self.r.zadd(settings.REDIS_ENGINE_MEMBERS_KEY, {'engine-1': time.time() - settings.ENGINE_MEMBER_TTL_SEC - 1})
+        self.assertEqual(self.archive(), [])
+
+    def test_id_conflict_keeps_the_live_row(self):
+        from dashboard.models import ArchivedTrade
+        from trade_state import TRADE_FIELDS
+        row = CashBreakoutTrade.objects.filter(symbol='OLD').values(*TRADE_FIELDS).get()
+        ArchivedTrade.objects.create(trade_date=row['candle_ts'].date(), **dict(row, symbol='OTHER'))
+        self.assertEqual(self.archive(), ['NEW', 'OLD']) # Batch rolled back, nothing lost
+        self.assertEqual(ArchivedTrade.objects.get().symbol, 'OTHER')
+
+    def test_unknown_engine_status_keeps_todays_trades(self):
+        with mock.patch('redis.from_url', side_effect=ConnectionError('refused')):
+            self.assertEqual(self.archive(), ['NEW'])
+
+
+class WarmRestartTests(EngineTestCase):
+    """Unacked fills are replayed before new traffic; the snapshot restores only the same session."""
+
+    fill_latency = 'const:10000'
+
+    def runtime_with_entry(self):
+        self.make_trade()
+        runtime = self.engine.StrategyRuntime()
+        strategy = next(iter(runtime.strategies.values()))
+        strategy.bracket = False
+        trade = strategy.active_trades['S0']
+        strategy.execute_market_entry(trade)
+        return runtime, strategy, trade
+
+    def test_dead_consumers_fill_is_claimed_and_applied_first(self):
+        runtime, strategy, trade = self.runtime_with_entry()
+        stream, group = settings.REDIS_STREAM_ORDERS, settings.REDIS_CONSUMER_GROUP
+        self.assertTrue(wait_until(lambda: self.r.xlen(stream) >= 1)) # Sim's ack update
+        self.r.xgroup_create(stream, group, id='$', mkstream=True)
+        fill = {'orderId': trade.entry_order_id, 'orderStatus': 'TRADED', 'tradedPrice': 101.0}
+        self.r.xadd(stream, {'p': json.dumps(fill)})
+        self.r.xreadgroup(group, 'algo_worker_dead', {stream: '>'}) # Delivered, never acked
+        later = self.r.xadd(stream, {'p': json.dumps({'orderId': 'OTHER', 'orderStatus': 'PENDING'})})
+
+        with override_settings(PENDING_CLAIM_MIN_IDLE_MS=0):
+            replayed = self.engine.recover_pending_messages([stream], runtime, {})
+        self.assertEqual(replayed, 1)
+        self.assertEqual(trade.status, 'OPEN')
+        self.assertEqual(self.row().entry_price, 101.0)
+        self.assertEqual(self.r.xpending(stream, group)['pending'], 0) # Acked by the new owner
+        new = self.r.xreadgroup(group, settings.REDIS_CONSUMER_NAME, {stream: '>'})
+        self.assertEqual([m for m, _ in new[0][1]], [later]) # New traffic only after the replay
+
+    def snapshot_then_restart(self, saved_at):
+        self.make_trade(status='OPEN', entry_price=100.5)
+        runtime = self.engine.StrategyRuntime()
+        now = self.now
+        self.now = saved_at
+        runtime.save_snapshot({'1000': 104.0})
+        self.now = now
+        restarted = self.engine.StrategyRuntime()
+        strategy = next(iter(restarted.strategies.values()))
+        strategy.active_trades, strategy.trades_loaded_from_db = {}, False # DB load failed
+        ltp = {}
+        return restarted.restore_snapshot(ltp), ltp, strategy
+
+    def test_snapshot_round_trip(self):
+        restored, ltp, strategy = self.snapshot_then_restart(self.now)
+        self.assertEqual((restored, ltp), (1, {'1000': 104.0}))
+        trade = strategy.active_trades['S0']
+        row = self.row()
+        for f in ('id', 'status', 'entry_price', 'entry_level', 'stop_level', 'target_level', 'quantity', 'candle_ts'):
+            self.assertEqual(getattr(trade, f), getattr(row, f), f)
+
+    def test_previous_session_snapshot_is_ignored(self):
+        restored, ltp, strategy = self.snapshot_then_restart(self.now - timedelta(days=1))
+        self.assertEqual((restored, ltp, strategy.active_trades), (0, {}, {}))
+
+
+@unittest.skipUnless(fakeredis is not None, 'fakeredis not installed')
+@override_settings(ENGINE_PARTITIONS=8)
+class PartitionMembershipTests(SimpleTestCase):
+    """Live engine instances split the partitions; a dead one's partitions move to the survivors."""
+
+    def setUp(self):
+        from partitions import PartitionMembership
+        self.r = fakeredis.FakeRedis(decode_responses=True)
+        self.a = PartitionMembership(self.r, 'engine-a')
+        self.b = PartitionMembership(self.r, 'engine-b')
+
+    def settle(self, *members):
+        for _ in range(3): # Join, release by the previous owner, acquire
+            for m in members: m.heartbeat()
+
+    def leases(self):
+        from partitions import _lease_key
+        return {p: self.r.get(_lease_key(p)) for p in range(8)}
+
+    def test_two_members_split_the_partitions(self):
+        self.assertEqual(self.a.heartbeat(), set(range(8))) # Alone: owns everything
+        self.settle(self.b, self.a)
+        self.assertTrue(self.a.owned and self.b.owned)
+        self.assertEqual(self.a.owned | self.b.owned, set(range(8)))
+        self.assertFalse(self.a.owned & self.b.owned)
+        self.assertEqual(self.leases(), {p: 'engine-a' if p in self.a.owned else 'engine-b' for p in range(8)})
+
+    def test_expired_member_hands_its_partitions_over(self):
+        from partitions import _lease_key
+        self.settle(self.a, self.b)
+        b_owned = set(self.b.owned)
+        # engine-b dies: its heartbeat ages out and its leases expire
+        self.r.zadd(settings.REDIS_ENGINE_MEMBERS_KEY, {'engine-b': time.time() - settings.ENGINE_MEMBER_TTL_SEC - 1})
+        for p in b_owned: self.r.delete(_lease_key(p))
+        self.assertEqual(self.a.heartbeat(), set(range(8)))
+        self.assertEqual(set(self.leases().values()), {'engine-a'})
+        self.assertEqual(self.r.zrange(settings.REDIS_ENGINE_MEMBERS_KEY, 0, -1), ['engine-a'])
+
+    def test_graceful_leave_releases_leases(self):
+        self.settle(self.a, self.b)
+        self.b.leave()
+        self.assertEqual(self.a.heartbeat(), set(range(8)))
+
+
+@override_settings(ENGINE_PARTITIONS=4)
+class OrderRoutingTests(EngineTestCase):
+    """Order updates land on the orders stream of the partition that sent the order."""
+
+    fill_latency = 'const:10000'
+
+    def test_update_without_security_id_follows_the_sender(self):
+        from partitions import order_update_stream, partition_for, partition_stream, remember_order
+        orders = settings.REDIS_STREAM_ORDERS
+        owner = partition_stream(orders, partition_for('1003'))
+        remember_order(self.r, 'OID1', '1003')
+        self.assertEqual(order_update_stream(self.r, {'OrderNo': 'OID1', 'OrderStatus': 'TRADED'}), owner)
+        self.assertEqual(order_update_stream(self.r, {'SecurityId': '1003', 'OrderNo': 'X'}), owner)
+        self.assertEqual(order_update_stream(self.r, {'OrderNo': 'UNKNOWN'}), orders) # Forwarded by any engine
+
+    def test_engine_order_update_reaches_its_partition(self):
+        from partitions import partition_for, partition_stream
+        self.make_trade(3)
+        strategy = self.engine.CashBreakoutStrategy(set(range(4)), strategy_settings=self.model)
+        strategy.bracket = False
+        trade = strategy.active_trades['S3']
+        strategy.execute_market_entry(trade)
+        stream = partition_stream(settings.REDIS_STREAM_ORDERS, partition_for(trade.security_id))
+        self.assertTrue(wait_until(lambda: self.r.xlen(stream) >= 1))
+        self.assertEqual(json.loads(self.r.xrange(stream)[0][1]['p'])['OrderNo'], trade.entry_order_id)
+        self.assertEqual(int(self.r.hget(settings.REDIS_ORDER_PARTITION_HASH, trade.entry_order_id)),
+                         partition_for(trade.security_id))
+
+    def test_apply_partitions_drops_what_moved_away(self):
+        from partitions import partition_for
+        sids = [str(1000 + i) for i in range(12)]
+        keep = partition_for(sids[0])
+        for i in range(12): self.make_trade(i)
+        runtime = self.engine.StrategyRuntime(owned_partitions=set(range(4)))
+        ltp = {sid: 100.0 for sid in sids}
+        self.engine.apply_partitions(runtime, {keep}, ltp)
+        owned = {sid for sid in sids if partition_for(sid) == keep}
+        self.assertEqual(set(ltp), owned)
+        strategy = next(iter(runtime.strategies.values()))
+        self.assertEqual({t.security_id for t in strategy.active_trades.values()}, owned)
+
+
+class CandleStoreTests(SimpleTestCase):
+    """Columnar day files: write_day -> memory-mapped CandleStore.load, writer restarts, export merge."""
+
+    day = '2025-01-10'
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+
+    def candle(self, symbol, minute, close, sid=None):
+        ts = settings.IST.localize(datetime(2025, 1, 10, 9, 15)) + timedelta(minutes=minute)
+        return {'symbol': symbol, 'security_id': sid, 'ts': ts.isoformat(),
+                'open': close - 1, 'high': close + 1, 'low': close - 2, 'close': close}
+
+    def test_round_trip_with_missing_minutes(self):
+        from candle_store import CandleStore, SESSION_MINUTES, session_open_epoch, write_day
+        t0 = session_open_epoch(self.day)
+        rows = {'B': {t0 + 60: (1.0, 2.0, 0.5, 1.5)},
+                'A': {t0 + 120: (10.0, 11.0, 9.0, 10.5), t0: (9.0, 10.0, 8.0, 9.5)}}
+        self.assertEqual(write_day(self.root, self.day, rows, {'A': '11', 'B': '22'}), 3)
+
+        store = CandleStore(self.root)
+        self.assertEqual(store.days(), [self.day])
+        cd = store.day(self.day)
+        self.assertIsInstance(cd.arrays['close'], np.memmap)
+        self.assertEqual((cd.symbols, cd.security_ids), (['A', 'B'], ['11', '22']))
+        self.assertEqual(list(cd.get('A')['ts']), [t0, t0 + 120]) # Time-ordered inside the symbol
+
+        out = store.load(['B', 'X', 'A'], [self.day, '2025-01-13']) # X and the second day are not stored
+        close = out['close']
+        self.assertEqual(close.shape, (3, 2, SESSION_MINUTES))
+        self.assertEqual((close[2, 0, 0], close[2, 0, 2], close[0, 0, 1]), (9.5, 10.5, 1.5))
+        self.assertTrue(np.isnan(close[2, 0, 1])) # A has no 09:16 candle
+        self.assertTrue(np.isnan(close[1]).all() and np.isnan(close[:, 1]).all())
+        self.assertEqual(np.count_nonzero(~np.isnan(close)), 3)
+
+    def test_restarted_writer_keeps_the_stored_day(self):
+        from candle_store import CandleStore, CandleStoreWriter
+        writer = CandleStoreWriter(self.root)
+        writer.add(self.candle('A', 0, 100.0, sid='11'))
+        writer.add(self.candle('A', 1, 101.0, sid='11'))
+        self.assertEqual(writer.flush(keep_today=False), 2)
+
+        restarted = CandleStoreWriter(self.root)
+        restarted.add(self.candle('A', 1, 102.0)) # Re-sent minute replaces the stored one; the stored id is kept
+        restarted.add(self.candle('B', 2, 50.0, sid='22'))
+        self.assertEqual(restarted.flush(keep_today=False), 3)
+        cd = CandleStore(self.root).day(self.day)
+        self.assertEqual(list(cd.get('A')['close']), [100.0, 102.0])
+        self.assertEqual(cd.security_ids, ['11', '22'])
+
+    @unittest.skipUnless(fakeredis is not None, 'fakeredis not installed')
+    def test_export_merges_with_the_stored_day(self):
+        from candle_store import CandleStore, CandleStoreWriter
+        from django.core.management import call_command
+        writer = CandleStoreWriter(self.root) # Written live by the data worker
+        writer.add(self.candle('A', 0, 100.0, sid='11'))
+        writer.add(self.candle('A', 1, 101.0, sid='11'))
+        writer.flush(keep_today=False)
+
+        r = fakeredis.FakeRedis(decode_responses=True)
+        history = [self.candle('A', 1, 101.5, sid='11'), self.candle('A', 2, 103.0, sid='11'),
+                   dict(self.candle('A', 0, 1.0, sid='11'), ts='2025-01-09T15:29:00+05:30')] # Other day: skipped
+        r.rpush(f"{settings.HISTORY_KEY_PREFIX}:11:1m", *[json.dumps(c) for c in history], 'not json')
+        out = io.StringIO()
+        with override_settings(SECURITY_ID_MAP={'A': 11}), \
+             mock.patch('dashboard.management.commands.export_candles.redis.from_url', return_value=r):
+            call_command('export_candles', date=self.day, dir=self.root, stdout=out)
+
+        self.assertIn('exported 2 candles for 1 symbols; day now holds 3 candles', out.getvalue())
+        self.assertIn('Skipped 1 unreadable', out.getvalue())
+        self.assertEqual(list(CandleStore(self.root).day(self.day).get('A')['close']), [100.0, 101.5, 103.0])
+
+
+class SymbolMatcherTests(SimpleTestCase):
+    """cache_instruments: one indexed pass over the CSV, then per-target exact / prefix / contains / fuzzy matching."""
+
+    CSV = (
+        'SEM_EXM_EXCH_ID,SEM_SEGMENT,SEM_SMST_SECURITY_ID,SEM_INSTRUMENT_NAME,SEM_TRADING_SYMBOL\n'
+        'BSE,E,500209,EQUITY,INFY\n'          # Other exchange
+        'NSE,E,1594,EQUITY,INFY\n'
+        'NSE,E,9999,EQUITY,INFY-EQ\n'         # Same cleaned symbol: first row wins
+        'NSE,D,35001,FUTSTK,INFY-Jan2025-FUT\n'
+        'NSE,E,3456,EQUITY,TATAMOTORS\n'
+        'NSE,E,3457,EQUITY,TATAMOTORSDVR\n'
+        'NSE,E,16669,EQUITY,BAJAJ-AUTO\n'
+        'NSE,E,2885,EQUITY,RELIANCE\n'
+        'NSE,E,17\n'                          # Short row
+    )
+
+    def matcher(self):
+        from dashboard.management.commands.cache_instruments import SymbolMatcher, clean_symbol
+        matcher = SymbolMatcher()
+        for symbol in ('INFY', 'TATAMOTORS', 'TATAMOTORSDVR', 'BAJAJ-AUTO', 'RELIANCE'):
+            matcher.add(clean_symbol(symbol), {'csv_symbol': symbol})
+        matcher.build()
+        return matcher
+
+    def test_match_methods(self):
+        matcher = self.matcher()
+        for target, expected in [
+            ('INFY', ('INFY', 'exact')),
+            ('bajaj-auto', ('BAJAJAUTO', 'exact')),      # Cleaned before lookup
+            ('TATAMOT', ('TATAMOTORS', 'prefix')),      # CSV symbol starts with the target (shortest)
+            ('INFYLTD', ('INFY', 'prefix')),            # Target starts with a CSV symbol (longest)
+            ('MOTORSDV', ('TATAMOTORSDVR', 'contains')),
+            ('MOTORS', ('TATAMOTORS', 'contains')),     # Shortest container
+            ('RELAINCE', ('RELIANCE', 'fuzzy')),
+            ('ZZZZ', (None, None)),
+            ('-EQ', (None, None)),
+        ]:
+            with self.subTest(target=target):
+                self.assertEqual(matcher.match(target), expected)
+
+    def test_is_equity_row(self):
+        from dashboard.management.commands.cache_instruments import is_equity_row
+        for row, expected in [
+            (('NSE', 'E', 'EQUITY'), True),
+            ((' nse_eq ', 'eq', 'eq'), True),
+            ((None, None, None), True),            # Columns missing from the CSV
+            (('BSE', 'E', 'EQUITY'), False),
+            (('NSE', 'D', 'EQUITY'), False),
+            (('NSE', 'E', 'FUTSTK'), False),
+        ]:
+            with self.subTest(row=row):
+                self.assertEqual(is_equity_row(*row), expected)
+
+    def test_csv_is_filtered_to_nse_equity(self):
+        from dashboard.management.commands.cache_instruments import fetch_instrument_map_from_dhan_csv
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as fh:
+            fh.write(self.CSV)
+        self.addCleanup(os.remove, fh.name)
+        with mock.patch('builtins.print'):
+            found = fetch_instrument_map_from_dhan_csv({'INFY', 'TATAMOT', 'NOSUCH'}, fh.name)
+        self.assertEqual({s: (e['security_id'], e['match']) for s, e in found.items()},
+                         {'INFY': ('1594', 'exact'), 'TATAMOT': ('3456', 'prefix')})
+        self.assertEqual(found['INFY']['exchange_segment'], 'NSE')
+
+
+class ScripMasterTests(SimpleTestCase):
+    """Conditional download of the scrip master: 304 reuses the cache, failures fall back, partial bodies are dropped."""
+
+    URL = 'https://example.invalid/scrip.csv'
+
+    class Response:
+        def __init__(self, status_code, chunks=(), headers=None, error=None):
+            self.status_code, self.chunks, self.headers, self.error = status_code, chunks, headers or {}, error
+
+        def raise_for_status(self):
+            if self.status_code >= 400: raise requests.HTTPError(f"{self.status_code} Error")
+
+        def iter_content(self, size):
+            yield from self.chunks
+            if self.error: raise self.error
+
+        def close(self):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            self.close()
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache = os.path.join(tmp.name, 'cache', 'scrip.csv')
+        printer = mock.patch('builtins.print')
+        printer.start()
+        self.addCleanup(printer.stop)
+
+    def read(self, response):
+        """(rows, report, requests.get mock) of one open_scrip_master call answered with `response`."""
+        from scrip_master import open_scrip_master
+        side_effect = response if isinstance(response, Exception) else None
+        with mock.patch('scrip_master.requests.get', return_value=response, side_effect=side_effect) as get:
+            with open_scrip_master(url=self.URL, cache_path=self.cache) as (stream, report):
+                rows = list(csv.reader(stream))
+        return rows, report, get
+
+    def download(self, body='SYMBOL,ID\nINFY,1594\n', etag='"v1"'):
+        return self.read(self.Response(200, [body[:7].encode(), body[7:].encode()], {'ETag': etag}))
+
+    def test_not_modified_reads_the_cache(self):
+        from scrip_master import load_meta
+        rows, report, _ = self.download()
+        self.assertEqual((rows, report.source), ([['SYMBOL', 'ID'], ['INFY', '1594']], 'download'))
+        self.assertEqual(load_meta(self.cache)['etag'], '"v1"')
+
+        rows, report, get = self.read(self.Response(304))
+        self.assertEqual(get.call_args.kwargs['headers'], {'If-None-Match': '"v1"'})
+        self.assertEqual((rows[1], report.source, report.etag), (['INFY', '1594'], 'cache (not modified)', '"v1"'))
+
+    def test_failed_request_falls_back_to_the_cache(self):
+        from scrip_master import open_scrip_master
+        with mock.patch('scrip_master.requests.get', side_effect=requests.ConnectionError('down')):
+            with self.assertRaises(Exception):
+                with open_scrip_master(url=self.URL, cache_path=self.cache):
+                    pass # No cached copy yet
+        self.download()
+        for failure in (requests.ConnectionError('down'), self.Response(503)):
+            with self.subTest(failure=failure):
+                rows, report, _ = self.read(failure)
+                self.assertEqual((rows[1], report.source), (['INFY', '1594'], 'cache (offline)'))
+
+    def test_partial_download_keeps_the_cache(self):
+        from scrip_master import load_meta
+        self.download()
+        broken = self.Response(200, [b'SYMBOL,ID\nTCS,11536\n'], {'ETag': '"v2"'},
+                               error=requests.exceptions.ChunkedEncodingError('connection reset'))
+        with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+            self.read(broken)
+        with open(self.cache) as fh:
+            self.assertEqual(fh.read(), 'SYMBOL,ID\nINFY,1594\n')
+        self.assertEqual(load_meta(self.cache)['etag'], '"v1"')
+        self.assertEqual(sorted(os.listdir(os.path.dirname(self.cache))), ['scrip.csv', 'scrip.csv.meta.json']) # No temp file left
+
+
+@unittest.skipUnless(fakeredis is not None, 'fakeredis not installed')
+@override_settings(SIGNAL_FILTER_CANDLE_SIZE=True, SIGNAL_FILTER_RELOAD_SEC=300)
+class CandleSignalFilterTests(TestCase):
+    """Data worker pre-filter: only breakout candidates pass, tagged with their prev-day high."""
+
+    def setUp(self):
+        from prev_day_levels import encode_levels, write_levels
+        from trading_calendar import expected_session
+        self.r = fakeredis.FakeRedis(decode_responses=True)
+        self.session = expected_session()
+        write_levels(self.r, self.session, {'A': encode_levels(100, 95, 98, self.session.isoformat())})
+        StrategySettings.objects.create(name='Tight', is_enabled=True, max_candle_pct=0.02)
+        StrategySettings.objects.create(name='Loose', is_enabled=True, max_candle_pct=0.03)
+        StrategySettings.objects.create(name='Off', is_enabled=False, max_candle_pct=0.5)
+        printer = mock.patch('builtins.print')
+        printer.start()
+        self.addCleanup(printer.stop)
+
+    def candle(self, symbol='A', open_=99.0, close=101.0, high=None, low=None):
+        return {'symbol': symbol, 'open': open_, 'close': close,
+                'high': high if high is not None else close, 'low': low if low is not None else open_}
+
+    def test_only_candidates_pass(self):
+        from signal_filter import CandleSignalFilter
+        f = CandleSignalFilter(self.r)
+        for candle, expected in [
+            (self.candle(), True),
+            (self.candle(open_=100.5), False),                   # Opened above the level
+            (self.candle(close=99.5), False),                    # Closed below it
+            (self.candle(symbol='B'), False),                    # No prev-day level
+            (self.candle(high=101.4, low=98.6), True),           # 2.8% range: within the loosest enabled limit
+            (self.candle(high=102.0, low=98.0), False),          # 4.0% range
+        ]:
+            with self.subTest(candle=candle):
+                self.assertEqual(f.check(candle), expected)
+                self.assertEqual(candle.get('pdh'), 100.0 if expected else None)
+        self.assertEqual((f.max_candle_pct, f.seen, f.passed), (0.03, 6, 2))
+
+    def test_levels_and_limits_are_reloaded(self):
+        from prev_day_levels import encode_levels, write_levels
+        from signal_filter import CandleSignalFilter
+        f = CandleSignalFilter(self.r)
+        self.assertFalse(f.check(self.candle(symbol='B')))
+        write_levels(self.r, self.session, {'B': encode_levels(100, 95, 98, self.session.isoformat())})
+        StrategySettings.objects.filter(name='Loose').update(is_enabled=False)
+        self.assertFalse(f.check(self.candle(symbol='B'))) # Until SIGNAL_FILTER_RELOAD_SEC passes
+
+        f.loaded_at -= settings.SIGNAL_FILTER_RELOAD_SEC
+        self.assertTrue(f.check(self.candle(symbol='B', open_=99.5)))
+        self.assertEqual(f.max_candle_pct, 0.02)
+        self.assertIn(f.db.name, self.r.hgetall(settings.REDIS_DB_HEALTH_KEY))
+
+    def test_db_unavailable_uses_the_default_limit(self):
+        from signal_filter import CandleSignalFilter
+        f = CandleSignalFilter(self.r)
+        with mock.patch.object(f.db, 'ensure', return_value=False):
+            f.load()
+        self.assertEqual(f.max_candle_pct, settings.MAX_CANDLE_PCT)
+        with override_settings(SIGNAL_FILTER_CANDLE_SIZE=False):
+            f.load()
+        self.assertIsNone(f.max_candle_pct)
+
+
+@unittest.skipUnless(fakeredis is not None, 'fakeredis not installed')
+@override_settings(PREV_DAY_FETCH_ATTEMPTS=3, PREV_DAY_RETRY_BACKOFF_SEC=0, PREV_DAY_WRITE_CHUNK=2)
+class PrevDayFetcherTests(SimpleTestCase):
+    """fetch_prev_day_ohlc pool: retried failures, empty and stale bars, levels written as they arrive."""
+
+    class Broker:
+        NSE = 'NSE_EQ'
+
+        def __init__(self, script):
+            self.script = {sid: list(responses) for sid, responses in script.items()} # security id -> responses in call order
+            self.calls = defaultdict(list)
+            self.lock = threading.Lock()
+
+        def historical_daily_data(self, security_id, exchange_segment, instrument_type, from_date, to_date):
+            with self.lock:
+                self.calls[security_id].append((from_date, to_date))
+                responses = self.script[security_id]
+                response = responses.pop(0) if len(responses) > 1 else responses[0]
+            if isinstance(response, Exception): raise response
+            return response
+
+    @staticmethod
+    def bars(*bars):
+        return {'status': 'success', 'data': [{'tradingDate': d, 'high': h, 'low': h - 5, 'close': h - 2} for d, h in bars]}
+
+    def test_run_accounting(self):
+        from datetime import date
+        from prev_day_fetcher import PrevDayFetcher
+        from prev_day_levels import load_levels
+        r = fakeredis.FakeRedis(decode_responses=True)
+        session = date(2025, 1, 10)
+        broker = self.Broker({
+            '1': [self.bars(('2025-01-09', 90), ('2025-01-10', 100), ('2025-01-13', 999))], # Bar after the session ignored
+            '2': [{'status': 'failure', 'remarks': 'DH-904'}, self.bars(('2025-01-09', 200))],  # Retried; old bar = stale
+            '3': [{'status': 'success', 'data': []}],                                            # Empty: not retried
+            '4': [ConnectionError('reset')],                                                     # Fails every attempt
+        })
+        with mock.patch('builtins.print'):
+            report = PrevDayFetcher(broker, r, session, workers=2).run({'A': '1', 'B': '2', 'C': '3', 'D': '4'})
+
+        self.assertEqual({k: report[k] for k in ('symbols', 'fetched', 'written', 'stale', 'empty', 'failed', 'retries')},
+                         {'symbols': 4, 'fetched': 2, 'written': 2, 'stale': 1, 'empty': 1, 'failed': 1, 'retries': 3})
+        self.assertEqual(report['failed_symbols'], ['D'])
+        self.assertEqual({sid: len(calls) for sid, calls in broker.calls.items()}, {'1': 1, '2': 2, '3': 1, '4': 3})
+        self.assertEqual(broker.calls['1'][0], ('2025-01-03', '2025-01-11')) # Lookback window up to the session
+        self.assertEqual(load_levels(r, session), {'A': (100.0, 95.0, 98.0, '2025-01-10'),
+                                                   'B': (200.0, 195.0, 198.0, '2025-01-09')})
+        self.assertEqual(json.loads(r.get(settings.REDIS_PREV_DAY_REPORT_KEY))['failed'], 1)
+
+
+@override_settings(DB_HEALTH_CHECK_SEC=30, DB_WRITE_CHECK_SEC=1, DB_RECONNECT_BACKOFF_SEC=0.5,
+                   DB_RECONNECT_BACKOFF_MAX_SEC=2)
+class DBConnectionManagerTests(SimpleTestCase):
+    """Connection checks between batches: throttled, reconnect when unusable or too old, back off when down."""
+
+    class Connection:
+        def __init__(self):
+            self.connection = None
+            self.in_atomic_block = False
+            self.usable = True
+            self.down = False
+            self.opened = 0
+
+        def ensure_connection(self):
+            if self.connection is None:
+                if self.down: raise ConnectionError('could not connect')
+                self.opened += 1
+                self.connection = object()
+
+        def is_usable(self):
+            return self.usable
+
+        def close(self):
+            self.connection = None
+
+    def setUp(self):
+        self.conn = self.Connection()
+        self.now = 1000.0
+        for target, value in (('db_health.connections', {'default': self.conn}),
+                              ('db_health.time', mock.Mock(monotonic=lambda: self.now)),
+                              ('builtins.print', mock.Mock())):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def manager(self):
+        from db_health import DBConnectionManager
+        return DBConnectionManager('test')
+
+    def test_checks_are_throttled(self):
+        db = self.manager()
+        self.assertTrue(db.ensure())
+        self.now += 10
+        self.assertTrue(db.ensure())       # Within DB_HEALTH_CHECK_SEC
+        self.assertTrue(db.before_writes()) # Past DB_WRITE_CHECK_SEC
+        self.assertEqual((db.checks, self.conn.opened), (2, 1))
+
+    def test_unusable_or_expired_connection_is_replaced(self):
+        db = self.manager()
+        db.max_age = 60
+        db.ensure()
+        self.conn.usable = False
+        self.now += 30
+        self.assertTrue(db.ensure())
+        self.conn.usable = True
+        self.now += 30
+        self.conn.in_atomic_block = True # Never closed mid-transaction
+        self.assertTrue(db.ensure())
+        self.assertEqual(db.reconnects, 1)
+        self.conn.in_atomic_block = False
+        self.now += 30
+        self.assertTrue(db.ensure())
+        self.assertEqual((db.reconnects, self.conn.opened), (2, 3))
+        self.assertEqual(db.stats()['age_sec'], 0.0)
+
+    def test_failed_connect_backs_off(self):
+        db = self.manager()
+        self.conn.down = True
+        attempts = []
+        for step in (0, 0.4, 0.1, 0.5, 0.5, 1.0, 2.0, 2.0):
+            self.now += step
+            checks = db.checks
+            self.assertFalse(db.ensure())
+            attempts.append(db.checks > checks)
+        # Retries after 0.5, 1, 2 and then 2 s (DB_RECONNECT_BACKOFF_MAX_SEC)
+        self.assertEqual(attempts, [True, False, True, False, True, False, True, True])
+        self.assertEqual((db.failures, db.healthy, db.last_error), (5, False, 'could not connect'))
+
+        self.conn.down = False
+        self.now += 2
+        self.assertTrue(db.ensure())
+        self.assertEqual((db.healthy, db.backoff), (True, 0.5))
+
+
+class PnLTrackerTests(unittest.TestCase):
+    """Incremental mark-to-market: totals follow opens, marks and closes; daily limits read the total."""
+
+    def test_mark_open_close(self):
+        from pnl_tracker import PnLTracker
+        pnl = PnLTracker()
+        pnl.open('1', 'A', 10, 100.0)
+        pnl.open('2', 'B', 5, 200.0)
+        pnl.open('3', 'C', 0, 50.0) # Nothing to track
+        pnl.mark('1', 103.0)
+        pnl.mark('2', 190.0)
+        pnl.mark('9', 1.0)          # Not a position
+        self.assertEqual((pnl.unrealized, pnl.gross_exposure), (30.0 - 50.0, 1030.0 + 950.0))
+
+        pnl.open('1', 'A', 10, 101.0) # Re-opened (reload): replaces the old mark
+        self.assertEqual((pnl.unrealized, pnl.gross_exposure), (-50.0, 1010.0 + 950.0))
+
+        pnl.close('2', -50.0)
+        snap = pnl.snapshot()
+        self.assertEqual({k: snap[k] for k in ('realized', 'unrealized', 'total', 'gross_exposure', 'open_positions', 'closed')},
+                         {'realized': -50.0, 'unrealized': 0.0, 'total': -50.0, 'gross_exposure': 1010.0,
+                          'open_positions': 1, 'closed': 1})
+        self.assertEqual(snap['symbols'], {'A': [10, 101.0, 0.0]})
+
+    def test_incremental_totals_match_a_recount(self):
+        import random
+        from pnl_tracker import PnLTracker
+        rng = random.Random(7)
+        pnl = PnLTracker()
+        for sid in map(str, range(20)):
+            pnl.open(sid, f'S{sid}', rng.randint(1, 50), rng.uniform(50, 500))
+        for _ in range(2000):
+            pnl.mark(str(rng.randrange(20)), rng.uniform(50, 500))
+        unrealized = sum((p[3] - p[2]) * p[1] for p in pnl.positions.values())
+        exposure = sum(p[3] * p[1] for p in pnl.positions.values())
+        self.assertAlmostEqual(pnl.unrealized, unrealized, places=6)
+        self.assertAlmostEqual(pnl.gross_exposure, exposure, places=6)
+
+    def test_limit_breached(self):
+        from types import SimpleNamespace
+        from pnl_tracker import PnLTracker
+        pnl = PnLTracker()
+        pnl.reset([SimpleNamespace(security_id='1', symbol='A', quantity=10, entry_price=100.0)], realized=100.0)
+        cfg = SimpleNamespace(pnl_exit_enabled=True, pnl_profit_target=1000, pnl_stop_loss=800)
+        for ltp, expected in [(180.0, None), (190.0, 'Daily Profit Target'), (50.0, None),
+                              (10.0, 'Daily Stop Loss')]: # Unrealized -900 + realized 100
+            with self.subTest(ltp=ltp):
+                pnl.mark('1', ltp)
+                self.assertEqual(pnl.limit_breached(cfg), expected)
+        cfg.pnl_exit_enabled = False
+        self.assertIsNone(pnl.limit_breached(cfg))
+        cfg.pnl_exit_enabled, cfg.pnl_stop_loss = True, 0 # Zero = no limit
+        self.assertIsNone(pnl.limit_breached(cfg))
+
+
+class EngineSettingsTests(TestCase):
+    """Immutable settings snapshot: diff names what changed, ignoring load time."""
+
+    def setUp(self):
+        self.model = StrategySettings.objects.create(name='T', is_enabled=True, max_total_trades=10)
+
+    def test_diff(self):
+        from engine_settings import MODEL_FIELDS, TRADE_RELEVANT_FIELDS, EngineSettings
+        old = EngineSettings.from_model(self.model)
+        self.assertEqual(old.diff(None), set(MODEL_FIELDS) | {'strategy_id', 'entry_offset_pct', 'stop_offset_pct',
+                                                               'risk_multiplier', 'breakeven_trigger_r',
+                                                               'max_monitoring_minutes'})
+        time.sleep(0.001)
+        self.assertEqual(EngineSettings.from_model(self.model).diff(old), set()) # loaded_at is not a change
+
+        self.model.max_total_trades = 20
+        self.model.max_candle_pct = 0.01
+        self.assertEqual(EngineSettings.from_model(self.model).diff(old), {'max_total_trades', 'max_candle_pct'})
+        self.model.is_enabled = False
+        changed = EngineSettings.from_model(self.model).diff(old)
+        self.assertEqual(changed & TRADE_RELEVANT_FIELDS, {'is_enabled'})
+        self.assertEqual(EngineSettings.from_model(None).diff(old) & TRADE_RELEVANT_FIELDS, {'strategy_id', 'is_enabled'})
+
+        with override_settings(RISK_MULTIPLIER=settings.RISK_MULTIPLIER + 1):
+            self.assertEqual(EngineSettings.from_model(self.model).diff(EngineSettings.from_model(self.model)), set())
+            self.assertIn('risk_multiplier', EngineSettings.from_model(self.model).diff(old))
+
+    def test_snapshot_is_immutable(self):
+        from engine_settings import EngineSettings
+        snapshot = EngineSettings.from_model(self.model)
+        with self.assertRaises(AttributeError):
+            snapshot.max_total_trades = 99
+        with self.assertRaises(AttributeError):
+            del snapshot.name
+        self.assertEqual(snapshot.max_total_trades, 10)
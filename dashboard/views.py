@@ -2,6 +2,7 @@ from django.shortcuts import render, redirect
 from django.conf import settings
 from django.contrib import messages
 from django.utils import timezone
+from django.db.models import Count, Sum
 from datetime import datetime
 import redis
 import json
@@ -23,8 +24,12 @@ except ImportError:
     dhanhq = lambda ctx: None
 
 # --- Import Models and Forms ---
-from .models import DhanCredentials, StrategySettings, CashBreakoutTrade 
+from .models import DhanCredentials, StrategySettings, CashBreakoutTrade, DailyTradeSummary
 from .forms import DhanCredentialsForm, StrategySettingsForm
+from latency import latency_summary
+from sim_broker import get_simulated_broker, order_id_from
+from broker_limiter import BrokerLimiter, LimitedBroker
+from trade_events import append_events
 
 logger = logging.getLogger(__name__)
 
@@ -33,7 +38,7 @@ def initialize_redis():
     """Initializes Redis connection with Heroku SSL fix."""
     try:
         # CRITICAL FIX: Add ssl_cert_reqs=None and decode_responses=True for Heroku Redis SSL connection
-        r = redis.from_url(settings.REDIS_URL, decode_responses=True, ssl_cert_reqs=None)
+        r = redis.from_url(settings.REDIS_URL, **settings.REDIS_CONN_KWARGS)
         r.ping()
         return r
     except Exception as e:
@@ -41,10 +46,18 @@ def initialize_redis():
         return None 
 
 r = initialize_redis()
+BROKER_LIMITER = BrokerLimiter(r) # Manual actions share the engines' broker rate budget
 
 # --- Dhan SDK Client Helper ---
 def get_dhan_rest_client(client_id: str, access_token: str) -> Optional[object]:
+    """Dhan REST client behind the shared broker rate limiter."""
+    dhan = _build_dhan_rest_client(client_id, access_token)
+    return LimitedBroker(dhan, BROKER_LIMITER) if dhan else None
+
+def _build_dhan_rest_client(client_id: str, access_token: str) -> Optional[object]:
     """Initializes and returns the Dhan REST client using the most compatible pattern."""
+    if settings.BROKER_MODE == 'SIM':
+        return get_simulated_broker(r, background=False) # Order events run in the engine's loop
     if not access_token or not client_id:
         return None
     
@@ -143,9 +156,9 @@ def dashboard_view(request):
                 strategy_form.save()
                 messages.success(request, f"Strategy '{strategy.name}' settings updated.")
                 
-                # Notify Algo Engine via Redis to reload settings
+                # Notify Algo Engine via its control stream to reload settings
                 if r:
-                    r.publish(settings.REDIS_CONTROL_CHANNEL, json.dumps({'action': 'UPDATE_CONFIG'}))
+                    r.xadd(settings.REDIS_STREAM_CONTROL, {'p': json.dumps({'action': 'UPDATE_CONFIG'})})
                 
                 return redirect('dashboard')
             else:
@@ -161,22 +174,33 @@ def dashboard_view(request):
                     
                     if dhan:
                         if 'manual_square_off' in request.POST and trade.status == 'OPEN':
-                            # Place Market SELL order to exit long position
-                            response = dhan.place_order(
-                                security_id=trade.security_id,
-                                exchange_segment=dhan.NSE, 
-                                transaction_type=dhan.SELL,
-                                quantity=abs(trade.quantity),
-                                order_type=dhan.MARKET,
-                                product_type=dhan.INTRA,
-                                price=0
-                            )
+                            if trade.order_state == 'BRACKET':
+                                # Bracket position: exiting the bracket order cancels its legs and sells at market
+                                response = dhan.cancel_order(trade.entry_order_id)
+                            else:
+                                # Place Market SELL order to exit long position
+                                response = dhan.place_order(
+                                    security_id=trade.security_id,
+                                    exchange_segment=dhan.NSE, 
+                                    transaction_type=dhan.SELL,
+                                    quantity=abs(trade.quantity),
+                                    order_type=dhan.MARKET,
+                                    product_type=dhan.INTRA,
+                                    price=0,
+                                    tag=f"T{trade.pk}-M"
+                                )
                             
-                            if response.get('orderId'):
+                            if order_id_from(response):
                                 trade.status = 'PENDING_EXIT'
-                                trade.exit_order_id = response['orderId']
+                                trade.exit_order_id = order_id_from(response)
+                                trade.order_state = 'EXIT_ACK'
+                                trade.correlation_id = f"T{trade.pk}-M"
+                                trade.order_sent_at = timezone.now()
                                 trade.exit_reason = 'MANUAL SQUARE OFF'
                                 trade.save()
+                                append_events([(trade.pk, {'status': trade.status, 'exit_order_id': trade.exit_order_id,
+                                                           'order_state': trade.order_state, 'correlation_id': trade.correlation_id,
+                                                           'order_sent_at': trade.order_sent_at, 'exit_reason': trade.exit_reason})])
                                 messages.warning(request, f"Manual Square Off order placed for {trade.symbol}.")
                             else:
                                 err_msg = response.get('message', 'Unknown Error')
@@ -190,12 +214,13 @@ def dashboard_view(request):
                                 trade.status = 'EXPIRED'
                                 trade.exit_reason = 'MANUAL CANCELLED'
                                 trade.save()
+                                append_events([(trade.pk, {'status': trade.status, 'exit_reason': trade.exit_reason})])
                                 messages.success(request, f"Pending entry for {trade.symbol} cancelled.")
                             else:
                                 messages.error(request, f"API Error cancelling {trade.symbol}: {response}")
 
-                        # Notify algo engines to update their internal state immediately
-                        r.publish(settings.REDIS_CONTROL_CHANNEL, json.dumps({'action': 'UPDATE_CONFIG'}))
+                        # Notify algo engines to update their internal state immediately (trade rows changed)
+                        r.xadd(settings.REDIS_STREAM_CONTROL, {'p': json.dumps({'action': 'UPDATE_CONFIG', 'reload_trades': True})})
 
                     else:
                         messages.error(request, "Dhan Client not initialized. Check Access Token.")
@@ -221,7 +246,37 @@ def dashboard_view(request):
     # Global Status Check (from Redis keys set by workers)
     data_engine_status = r.get(settings.REDIS_STATUS_DATA_ENGINE) if r else 'N/A (Redis Down)'
     algo_engine_status = r.get(settings.REDIS_STATUS_ALGO_ENGINE) if r else 'N/A (Redis Down)'
+
+    # Tick -> Fill latency per hop (today)
+    try:
+        latency_rows = latency_summary(r) if r else []
+    except Exception as e:
+        logger.error(f"Latency summary failed: {e}")
+        latency_rows = []
+
+    # Live mark-to-market P&L per engine/strategy (published by the algo engine)
+    pnl_rows = []
+    try:
+        day_start = datetime.now(settings.IST).replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+        for name, raw in sorted((r.hgetall(settings.REDIS_PNL_KEY) if r else {}).items()):
+            row = json.loads(raw)
+            if row.get('ts', 0) < day_start: continue
+            row['name'] = name
+            pnl_rows.append(row)
+    except Exception as e:
+        logger.error(f"P&L snapshot read failed: {e}")
     
+    # Recent days (archived trades, see archive_trades)
+    daily_rows = []
+    try:
+        daily_rows = list(DailyTradeSummary.objects.values('trade_date').annotate(
+            trades=Sum('trades'), wins=Sum('wins'), unfilled=Sum('unfilled'), pnl=Sum('pnl'), symbols=Count('symbol', distinct=True)
+        ).order_by('-trade_date')[:settings.DASHBOARD_SUMMARY_DAYS])
+        for row in daily_rows:
+            row['win_rate'] = row['wins'] / row['trades'] * 100 if row['trades'] else 0.0
+    except Exception as e:
+        logger.error(f"Daily summary read failed: {e}")
+
     context = {
         'form': form,
         'credentials': credentials,
@@ -229,5 +284,8 @@ def dashboard_view(request):
         'live_trades': live_trades,
         'data_engine_status': data_engine_status,
         'algo_engine_status': algo_engine_status,
+        'latency_rows': latency_rows,
+        'pnl_rows': pnl_rows,
+        'daily_rows': daily_rows,
     }
     return render(request, 'dashboard/index.html', context)
\ No newline at end of file
@@ -0,0 +1,112 @@
+# db_health.py - Database connection management for long-running processes
+"""
+Django only recycles persistent connections (CONN_MAX_AGE) around HTTP requests.
+The Algo Engine, Data Worker and management commands have no requests, so
+DBConnectionManager does it for them without touching the connection on every
+loop iteration:
+
+- ensure(): checks the connection at most every DB_HEALTH_CHECK_SEC (is_usable()
+  is a round trip on PostgreSQL). A broken connection, or one older than
+  CONN_MAX_AGE, is closed and reopened here, between batches, never mid-session.
+- before_writes(): the same check with a DB_WRITE_CHECK_SEC budget, called before
+  a batch of messages that may write trades.
+- A failed reconnect backs off exponentially (DB_RECONNECT_BACKOFF_SEC, doubling
+  up to DB_RECONNECT_BACKOFF_MAX_SEC); callers see False and keep going, the ORM
+  call that follows raises as it would have anyway.
+- stats() has the connection age, checks, reconnects and failures; publish()
+  writes them to the REDIS_DB_HEALTH_KEY hash under the process name.
+
+Django connections are per thread: use one manager per thread that does DB work.
+"""
+import json
+import time
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.db import connections
+
+
+class DBConnectionManager:
+    def __init__(self, name: str, alias: str = 'default', redis_conn=None):
+        self.name = name
+        self.alias = alias
+        self.r = redis_conn
+        max_age = settings.DATABASES[alias].get('CONN_MAX_AGE') or 0
+        self.max_age = max_age if max_age and max_age > 0 else None # None = keep while usable
+
+        self.raw = None # Underlying DB-API connection we last saw
+        self.connected_at: Optional[float] = None
+        self.last_check = 0.0
+        self.healthy = True
+        self.retry_at = 0.0
+        self.backoff = settings.DB_RECONNECT_BACKOFF_SEC
+        self.checks = 0
+        self.reconnects = 0
+        self.failures = 0
+        self.last_error = None
+
+    def ensure(self, budget: Optional[float] = None) -> bool:
+        """True if the connection is usable (or will be opened lazily by the next query)."""
+        now = time.monotonic()
+        if budget is None: budget = settings.DB_HEALTH_CHECK_SEC
+        if self.healthy and now - self.last_check < budget: return True
+        if not self.healthy and now < self.retry_at: return False
+        self.last_check = now
+        self.checks += 1
+
+        conn = connections[self.alias]
+        if conn.connection is not None and conn.connection is not self.raw:
+            self.raw, self.connected_at = conn.connection, now # Opened by a query since the last check
+        try:
+            if conn.connection is None:
+                conn.ensure_connection()
+            elif not conn.is_usable():
+                self._reconnect(conn, 'unusable')
+            elif self._expired(now) and not conn.in_atomic_block:
+                self._reconnect(conn, 'expired')
+            if conn.connection is not self.raw:
+                self.raw, self.connected_at = conn.connection, now
+            self.healthy = True
+            self.backoff = settings.DB_RECONNECT_BACKOFF_SEC
+            return True
+        except Exception as e:
+            self.failures += 1
+            self.healthy = False
+            self.last_error = str(e)[:200]
+            self.retry_at = now + self.backoff
+            print(f"DB [{self.name}]: Connection failed ({e}). Retry in {self.backoff:.1f}s.")
+            self.backoff = min(self.backoff * 2, settings.DB_RECONNECT_BACKOFF_MAX_SEC)
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return False
+
+    def _reconnect(self, conn, reason: str):
+        conn.close()
+        conn.ensure_connection()
+        self.reconnects += 1
+        print(f"DB [{self.name}]: Reconnected ({reason}).")
+
+    def before_writes(self) -> bool:
+        return self.ensure(settings.DB_WRITE_CHECK_SEC)
+
+    def _expired(self, now: float) -> bool:
+        return self.max_age is not None and self.connected_at is not None and now - self.connected_at >= self.max_age
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'healthy': self.healthy,
+            'age_sec': round(time.monotonic() - self.connected_at, 1) if self.connected_at is not None else None,
+            'checks': self.checks,
+            'reconnects': self.reconnects,
+            'failures': self.failures,
+            'last_error': self.last_error,
+        }
+
+    def publish(self):
+        if self.r is None: return
+        try:
+            self.r.hset(settings.REDIS_DB_HEALTH_KEY, self.name, json.dumps(self.stats(), separators=(',', ':')))
+        except Exception as e:
+            print(f"DB Health Publish Error: {e}")
@@ -548,6 +548,12 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'algotrader.settings')
 import django
 django.setup()
 from django.conf import settings
+from partitions import route_stream, order_update_stream
+import latency
+from latency import LatencyRecorder
+from price_triggers import TriggerBook
+from signal_filter import CandleSignalFilter
+from candle_store import CandleStoreWriter
 
 # --- 1. ROBUST IMPORT ---
 try:
@@ -577,7 +583,7 @@ except Exception:
     MODE_FULL = 17 
 
 # --- Configuration ---
-r = redis.from_url(settings.REDIS_URL, decode_responses=True, ssl_cert_reqs=None)
+r = redis.from_url(settings.REDIS_URL, **settings.REDIS_CONN_KWARGS)
 IST = settings.IST
 SECURITY_ID_TO_SYMBOL = {str(v): k for k, v in settings.SECURITY_ID_MAP.items()}
 INSTRUMENTS_TO_SUBSCRIBE: List[tuple] = []
@@ -588,8 +594,13 @@ class LiveCandleAggregator:
         self.r = redis_conn
         self.aggregators: Dict[str, Dict[str, Any]] = {} 
         self.last_ltp: Dict[str, float] = {}
+        self.latency = LatencyRecorder(redis_conn)
+        self.triggers = TriggerBook(redis_conn) if settings.PRICE_TRIGGERS_ENABLED else None
+        self.signals = CandleSignalFilter(redis_conn) if settings.SIGNAL_FILTER_ENABLED else None
+        self.store = CandleStoreWriter() if settings.CANDLE_STORE_ENABLED else None
 
     def process_tick(self, tick_data: Dict[str, Any]):
+        received = time.time()
         security_id = str(tick_data.get('securityId', ''))
         ltp = float(tick_data.get('LTP') or tick_data.get('last_price') or tick_data.get('lp') or 0.0)
         
@@ -605,6 +616,20 @@ class LiveCandleAggregator:
         if not security_id or ltp == 0: return
 
         self.last_ltp[security_id] = ltp
+        if self.triggers is not None: self.triggers.on_tick(security_id, ltp, received)
+        if ts_raw:
+            self.latency.record(latency.HOP_EXCHANGE_TO_WORKER, received - timestamp.timestamp())
+        self.latency.maybe_flush()
+
+        # Live tick for the engine monitor (routed to the owning engine's partition)
+        try:
+            self.r.xadd(
+                route_stream(settings.REDIS_STREAM_MARKET, security_id),
+                {'p': json.dumps({'securityId': security_id, 'LTP': ltp, 'LTT': ts_raw, 'wr': received})},
+                maxlen=settings.MARKET_STREAM_MAXLEN, approximate=True
+            )
+        except Exception as e:
+            print(f"Tick Stream Error: {e}")
         
         # Candle Logic
         candle_ts = timestamp.replace(second=0, microsecond=0)
@@ -634,7 +659,8 @@ class LiveCandleAggregator:
             'open': candle['open'],
             'high': candle['high'],
             'low': candle['low'],
-            'close': candle['close']
+            'close': candle['close'],
+            'fz': time.time() # Finalize stamp for latency accounting
         }
         payload_json = json.dumps(payload)
 
@@ -644,10 +670,16 @@ class LiveCandleAggregator:
             self.r.rpush(history_key, payload_json)
             self.r.ltrim(history_key, -400, -1) 
         except: pass
-
-        # B. STREAM
+        if self.store is not None: self.store.add(payload) # Flushed to disk by its own thread
+
+        # B. STREAM (pre-filtered: only breakout candidates, on the signal stream)
+        stream = settings.REDIS_STREAM_CANDLES
+        if self.signals is not None:
+            if not self.signals.check(payload): return
+            stream = settings.REDIS_STREAM_SIGNALS
+            payload_json = json.dumps(payload)
         try:
-            self.r.xadd(settings.REDIS_STREAM_CANDLES, {'p': payload_json})
+            self.r.xadd(route_stream(stream, candle['security_id']), {'p': payload_json})
         except Exception as e:
             print(f"Stream Error: {e}")
 
@@ -701,7 +733,8 @@ def on_order_update_message(order_data):
     try:
         payload = order_data.get('Data', order_data)
         if payload:
-            r.xadd(settings.REDIS_STREAM_ORDERS, {'p': json.dumps(payload)})
+            payload['wr'] = time.time()
+            r.xadd(order_update_stream(r, payload), {'p': json.dumps(payload)})
             print(f"[{datetime.now()}] Order Update pushed.")
     except Exception as e:
         print(f"Order Stream Error: {e}")
@@ -744,17 +777,21 @@ def main_worker_loop():
         r.set(settings.REDIS_STATUS_DATA_ENGINE, 'FATAL_ERROR_NO_INSTRUMENTS')
         return
 
-    t1 = threading.Thread(target=run_market_feed_worker, args=(dhan_context,), daemon=True)
-    t2 = threading.Thread(target=run_order_update_worker, args=(dhan_context,), daemon=True)
+    threads = [threading.Thread(target=run_market_feed_worker, args=(dhan_context,), daemon=True)]
+    if aggregator.triggers is not None:
+        threads.append(threading.Thread(target=aggregator.triggers.run_registrations, args=(settings.REDIS_CONSUMER_NAME,), daemon=True))
+    if aggregator.store is not None:
+        threads.append(threading.Thread(target=aggregator.store.run_flusher, daemon=True))
+    # SIM (paper trading): fills come from sim_broker inside the engine, not the Dhan order feed
+    if settings.BROKER_MODE != 'SIM':
+        threads.append(threading.Thread(target=run_order_update_worker, args=(dhan_context,), daemon=True))
 
-    t1.start()
-    t2.start()
+    for t in threads: t.start()
 
     r.set(settings.REDIS_STATUS_DATA_ENGINE, 'RUNNING')
-    print("Data Worker: Aggregating Candles & Streaming Orders.")
+    print(f"Data Worker: Aggregating Candles & Streaming Orders (Broker: {settings.BROKER_MODE}).")
     
-    t1.join()
-    t2.join()
+    for t in threads: t.join()
 
 if __name__ == '__main__':
     main_worker_loop()
\ No newline at end of file
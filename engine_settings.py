@@ -0,0 +1,76 @@
+# engine_settings.py - Immutable strategy settings snapshot for the Algo Engine hot path
+"""
+EngineSettings is a frozen, __slots__-based copy of one StrategySettings row plus the
+module-level strategy constants the engine evaluates on every candle/tick.
+
+- Hot-path reads are plain slot lookups (no Django model descriptors, no
+  django.conf.settings LazySettings __getattr__).
+- A reload builds a new snapshot and the strategy swaps its reference in one
+  assignment, so a half-applied config is never observed.
+- diff() names the changed fields so the engine only re-reads active trades from
+  the DB when a trade-relevant field changed.
+
+Entry/stop offsets, R multiple, breakeven trigger and entry expiry come from
+algotrader/settings.py, as the engine has always used them.
+"""
+import time
+from typing import Any, Dict, Optional, Set
+
+from django.conf import settings
+
+# StrategySettings columns copied into the snapshot
+MODEL_FIELDS = (
+    'name', 'strategy_type', 'is_enabled',
+    'max_trades_per_stock', 'max_total_trades', 'max_candle_pct', 'per_trade_sl_amount',
+    'start_time', 'end_time',
+    'pnl_exit_enabled', 'pnl_profit_target', 'pnl_stop_loss',
+    'manual_override',
+)
+
+# algotrader/settings.py constants -> snapshot field
+CONSTANT_FIELDS = {
+    'ENTRY_OFFSET_PCT': 'entry_offset_pct',
+    'STOP_OFFSET_PCT': 'stop_offset_pct',
+    'RISK_MULTIPLIER': 'risk_multiplier',
+    'BREAKEVEN_TRIGGER_R': 'breakeven_trigger_r',
+    'MAX_MONITORING_MINUTES': 'max_monitoring_minutes',
+}
+
+# Changes that invalidate the in-memory active trade set. Limits, risk and timing only
+# affect new signals / the next monitor pass, so they are applied without a DB reload.
+TRADE_RELEVANT_FIELDS = frozenset({'strategy_id', 'is_enabled'})
+
+
+class EngineSettings:
+    __slots__ = ('strategy_id', 'loaded_at') + MODEL_FIELDS + tuple(CONSTANT_FIELDS.values())
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            object.__setattr__(self, name, values.get(name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("EngineSettings is immutable; build a new snapshot instead")
+
+    def __delattr__(self, name):
+        raise AttributeError("EngineSettings is immutable; build a new snapshot instead")
+
+    @classmethod
+    def from_model(cls, model) -> 'EngineSettings':
+        values: Dict[str, Any] = {'strategy_id': getattr(model, 'pk', None), 'loaded_at': time.time()}
+        for name in MODEL_FIELDS:
+            values[name] = getattr(model, name, None) if model is not None else None
+        for const, name in CONSTANT_FIELDS.items():
+            values[name] = getattr(settings, const)
+        if model is None: values['is_enabled'] = False
+        return cls(**values)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__ if name != 'loaded_at'}
+
+    def diff(self, other: Optional['EngineSettings']) -> Set[str]:
+        """Fields whose values differ from `other` (all fields if there is no previous snapshot)."""
+        if other is None: return set(self.as_dict())
+        return {name for name in self.__slots__ if name != 'loaded_at' and getattr(self, name) != getattr(other, name)}
+
+    def __repr__(self):
+        return f"EngineSettings({self.name!r}, enabled={self.is_enabled})"
@@ -0,0 +1,128 @@
+# latency.py - Per-hop latency histograms (tick -> signal -> order -> fill)
+"""
+Hot-path friendly latency accounting shared by the Data Worker and Algo Engine.
+
+- Producers stamp wall-clock epoch seconds into stream payloads
+  ('wr' = worker receive, 'fz' = candle finalize).
+- Each process records hop deltas into fixed log-spaced buckets in memory
+  (one bisect + one list increment per sample, no Redis round-trip).
+- Buckets are flushed with a single pipelined HINCRBY batch every
+  LATENCY_FLUSH_SEC into 'latency:<date>:<hop>' hashes (bucket upper bound -> count),
+  so any process (the dashboard) can compute p50/p95/p99 from Redis.
+- Samples come from several threads (main loop, broker limiter callers, square-off
+  pool), so the counts are guarded by a lock; Redis I/O happens outside it.
+"""
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+# Hops, in pipeline order
+HOP_EXCHANGE_TO_WORKER = 'exchange_to_worker'   # LTT -> worker receive
+HOP_WORKER_TO_ENGINE = 'worker_to_engine'       # worker receive -> engine read (ticks)
+HOP_FINALIZE_TO_ENGINE = 'finalize_to_engine'   # candle finalize -> engine read
+HOP_ENGINE_TO_SIGNAL = 'engine_to_signal'       # engine read of trigger tick -> entry decision
+HOP_SIGNAL_TO_SENT = 'signal_to_sent'           # entry decision -> place_order call
+HOP_SENT_TO_ACK = 'sent_to_ack'                 # place_order call -> broker order id returned
+HOP_ACK_TO_FILL = 'ack_to_fill'                 # order id returned -> TRADED update read
+HOP_TICK_TO_FILL = 'tick_to_fill'               # worker receive of trigger tick -> fill (end to end)
+
+
+# Broker rate limiter queueing delay, one hop per lane (see broker_limiter.py)
+HOP_BROKER_QUEUE_PREFIX = 'broker_queue_'
+
+HOPS = [
+    HOP_EXCHANGE_TO_WORKER, HOP_WORKER_TO_ENGINE, HOP_FINALIZE_TO_ENGINE, HOP_ENGINE_TO_SIGNAL,
+    HOP_SIGNAL_TO_SENT, HOP_SENT_TO_ACK, HOP_ACK_TO_FILL, HOP_TICK_TO_FILL,
+    HOP_BROKER_QUEUE_PREFIX + 'exit', HOP_BROKER_QUEUE_PREFIX + 'entry', HOP_BROKER_QUEUE_PREFIX + 'info',
+]
+
+# Bucket upper bounds in microseconds: 10us .. ~100s, ~12% apart
+BUCKETS_US: List[int] = []
+_b = 10.0
+while _b < 100_000_000:
+    BUCKETS_US.append(int(_b))
+    _b *= 1.12
+BUCKETS_US.append(100_000_000)
+
+
+def _day_key(hop: str, day: Optional[str] = None) -> str:
+    day = day or datetime.now(settings.IST).strftime('%Y-%m-%d')
+    return f"{settings.REDIS_LATENCY_PREFIX}:{day}:{hop}"
+
+
+class LatencyRecorder:
+    """In-process bucket counts, periodically merged into Redis."""
+
+    def __init__(self, redis_conn, flush_sec: Optional[float] = None):
+        self.r = redis_conn
+        self.flush_sec = flush_sec if flush_sec is not None else settings.LATENCY_FLUSH_SEC
+        self.counts: Dict[str, List[int]] = {}
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+
+    def record(self, hop: str, seconds: float):
+        """Adds one sample. Negative or absurd deltas (clock skew, stale replays) are dropped."""
+        if seconds < 0 or seconds > 100: return
+        i = bisect_left(BUCKETS_US, seconds * 1_000_000)
+        with self.lock:
+            counts = self.counts.get(hop)
+            if counts is None:
+                counts = self.counts[hop] = [0] * len(BUCKETS_US)
+            counts[i] += 1
+
+    def since(self, hop: str, stamp, now: Optional[float] = None):
+        """Records now - stamp (epoch seconds) if the stamp is present."""
+        if not stamp: return
+        self.record(hop, (now or time.time()) - float(stamp))
+
+    def maybe_flush(self):
+        if time.monotonic() - self.last_flush >= self.flush_sec:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        with self.lock:
+            if not self.counts: return
+            counts, self.counts = self.counts, {}
+        try:
+            pipe = self.r.pipeline(transaction=False)
+            for hop, buckets in counts.items():
+                key = _day_key(hop)
+                for i, c in enumerate(buckets):
+                    if c: pipe.hincrby(key, BUCKETS_US[i], c)
+                pipe.expire(key, settings.LATENCY_RETENTION_SEC)
+            pipe.execute()
+        except Exception as e:
+            print(f"Latency Flush Error: {e}")
+
+
+def _percentile(buckets: Dict[int, int], total: int, q: float) -> float:
+    rank = q * total
+    running = 0
+    for upper in sorted(buckets):
+        running += buckets[upper]
+        if running >= rank: return upper / 1000.0
+    return 0.0
+
+
+def latency_summary(redis_conn, day: Optional[str] = None) -> List[Dict[str, object]]:
+    """Per-hop count and p50/p95/p99 in milliseconds (bucket upper bounds) for a day."""
+    pipe = redis_conn.pipeline(transaction=False)
+    for hop in HOPS: pipe.hgetall(_day_key(hop, day))
+    rows = []
+    for hop, raw in zip(HOPS, pipe.execute()):
+        buckets = {int(k): int(v) for k, v in (raw or {}).items()}
+        total = sum(buckets.values())
+        if not total: continue
+        rows.append({
+            'hop': hop,
+            'count': total,
+            'p50_ms': _percentile(buckets, total, 0.50),
+            'p95_ms': _percentile(buckets, total, 0.95),
+            'p99_ms': _percentile(buckets, total, 0.99),
+        })
+    return rows
@@ -0,0 +1,147 @@
+# partitions.py - Symbol partitioning shared by the Data Worker and Algo Engine
+"""
+Hash-partitions securities across algo engine instances.
+
+- Every security maps to a fixed partition: crc32(security_id) % ENGINE_PARTITIONS.
+- The Data Worker publishes candles/ticks/order updates to the partition stream
+  (e.g. 'stream:dhan:candles:p3'). With ENGINE_PARTITIONS == 1 the base stream
+  names are used, so a single engine behaves exactly as before.
+- Engines heartbeat into a membership ZSET. Partition owners are chosen by
+  rendezvous hashing over live members, so a join/death only moves the partitions
+  that hash to the changed member. Ownership is enforced with a per-partition
+  lease key (SET NX EX) so two instances never consume the same partition.
+  A single engine heartbeats too, so live_engines() tells tools whether one runs.
+"""
+import re
+import time
+import zlib
+from typing import List, Optional, Set
+
+from django.conf import settings
+
+_PARTITION_SUFFIX = re.compile(r':p\d+$')
+
+
+def partition_count() -> int:
+    return max(1, int(settings.ENGINE_PARTITIONS))
+
+
+def partition_for(security_id) -> int:
+    """Stable partition for a security id (same on every process/host)."""
+    n = partition_count()
+    if n == 1: return 0
+    return zlib.crc32(str(security_id).encode()) % n
+
+
+def partition_stream(base: str, partition: int) -> str:
+    if partition_count() == 1: return base
+    return f"{base}:p{partition}"
+
+
+def route_stream(base: str, security_id) -> str:
+    """Stream a message about `security_id` should be published to."""
+    return partition_stream(base, partition_for(security_id))
+
+
+def base_stream(name: str) -> str:
+    """'stream:dhan:candles:p3' -> 'stream:dhan:candles'"""
+    return _PARTITION_SUFFIX.sub('', name)
+
+
+def _lease_key(partition: int) -> str:
+    return f"{settings.REDIS_ENGINE_LEASE_PREFIX}:{partition}"
+
+
+class PartitionMembership:
+    """Heartbeat + lease based partition assignment for one engine instance."""
+
+    def __init__(self, redis_conn, member: str):
+        self.r = redis_conn
+        self.member = member
+        self.owned: Set[int] = set()
+
+    def _live_members(self):
+        now = time.time()
+        self.r.zadd(settings.REDIS_ENGINE_MEMBERS_KEY, {self.member: now})
+        self.r.zremrangebyscore(settings.REDIS_ENGINE_MEMBERS_KEY, '-inf', now - settings.ENGINE_MEMBER_TTL_SEC)
+        return self.r.zrange(settings.REDIS_ENGINE_MEMBERS_KEY, 0, -1)
+
+    @staticmethod
+    def _owner(partition: int, members) -> str:
+        # Rendezvous (highest random weight) hashing
+        return max(members, key=lambda m: zlib.crc32(f"{m}:{partition}".encode()))
+
+    def heartbeat(self) -> Optional[Set[int]]:
+        """
+        Refreshes membership and leases. Returns the new owned set if it changed,
+        otherwise None.
+        """
+        n = partition_count()
+        if n == 1:
+            self._live_members() # Liveness only (see live_engines)
+            if self.owned != {0}:
+                self.owned = {0}
+                return self.owned
+            return None
+
+        members = self._live_members()
+        desired = {p for p in range(n) if self._owner(p, members) == self.member}
+        ttl = settings.ENGINE_MEMBER_TTL_SEC
+
+        owned = set()
+        for p in range(n):
+            key = _lease_key(p)
+            if p in desired:
+                # Acquire (or renew) the lease; a previous owner releases on its next heartbeat
+                if self.r.set(key, self.member, nx=True, ex=ttl) or self.r.get(key) == self.member:
+                    self.r.expire(key, ttl)
+                    owned.add(p)
+            elif p in self.owned and self.r.get(key) == self.member:
+                self.r.delete(key)
+
+        if owned != self.owned:
+            self.owned = owned
+            return owned
+        return None
+
+    def leave(self):
+        """Graceful shutdown: hand partitions over immediately."""
+        self.r.zrem(settings.REDIS_ENGINE_MEMBERS_KEY, self.member)
+        for p in self.owned:
+            if self.r.get(_lease_key(p)) == self.member:
+                self.r.delete(_lease_key(p))
+        self.owned = set()
+
+
+def live_engines(redis_conn) -> List[str]:
+    """Engine instances that sent a heartbeat within ENGINE_MEMBER_TTL_SEC."""
+    return redis_conn.zrangebyscore(settings.REDIS_ENGINE_MEMBERS_KEY, time.time() - settings.ENGINE_MEMBER_TTL_SEC, '+inf')
+
+
+# --- ORDER ROUTING ---
+
+def remember_order(redis_conn, order_id, security_id):
+    """Records which partition owns an order so updates without a security id can be routed."""
+    if partition_count() == 1 or not order_id: return
+    try:
+        redis_conn.hset(settings.REDIS_ORDER_PARTITION_HASH, str(order_id), partition_for(security_id))
+    except Exception as e:
+        print(f"Order Partition Map Error: {e}")
+
+
+def order_update_stream(redis_conn, payload) -> str:
+    """
+    Picks the orders stream for a broker order update:
+    security id -> its partition, else the recorded order owner, else the base stream
+    (read by every engine, which forwards it to the owner).
+    """
+    if partition_count() == 1: return settings.REDIS_STREAM_ORDERS
+    sec_id = payload.get('SecurityId') or payload.get('securityId')
+    if sec_id: return route_stream(settings.REDIS_STREAM_ORDERS, sec_id)
+    oid = payload.get('OrderNo') or payload.get('orderId')
+    if oid:
+        try:
+            p = redis_conn.hget(settings.REDIS_ORDER_PARTITION_HASH, str(oid))
+            if p is not None: return partition_stream(settings.REDIS_STREAM_ORDERS, int(p))
+        except Exception: pass
+    return settings.REDIS_STREAM_ORDERS
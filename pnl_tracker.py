@@ -0,0 +1,93 @@
+# pnl_tracker.py - Incremental mark-to-market P&L and exposure per strategy
+"""
+Keeps live P&L for one strategy's open positions without touching the trades table.
+
+- open()/close() are called from order reconciliation (fills); mark() on every LTP
+  change. Each call is O(1): the position's previous mark is kept, and the totals
+  (unrealized P&L, gross exposure) are adjusted by the delta.
+- Realized P&L is seeded from the strategy's daily_pnl Redis key on (re)load, so the
+  day total survives engine restarts.
+- snapshot() is a compact dict the runtime publishes to Redis at a bounded rate
+  (PNL_PUBLISH_INTERVAL_SEC) for the dashboard and risk checks.
+"""
+import time
+from typing import Any, Dict, Optional
+
+# Position slots: [symbol, quantity, entry_price, last_price, unrealized]
+_SYM, _QTY, _ENTRY, _LTP, _UPNL = range(5)
+
+
+class PnLTracker:
+    def __init__(self):
+        self.positions: Dict[str, list] = {} # security_id -> position slots
+        self.realized = 0.0
+        self.unrealized = 0.0
+        self.gross_exposure = 0.0
+        self.closed_today = 0
+        self.updated_at = 0.0
+
+    def reset(self, open_trades, realized: float = 0.0):
+        """Rebuilds from the strategy's open trades (after load_trades / rebalance)."""
+        self.positions = {}
+        self.realized = float(realized or 0.0)
+        self.unrealized = 0.0
+        self.gross_exposure = 0.0
+        for t in open_trades:
+            self.open(t.security_id, t.symbol, t.quantity, t.entry_price)
+
+    # --- EVENTS ---
+    def open(self, security_id: str, symbol: str, quantity: int, entry_price: Optional[float]):
+        if not entry_price or not quantity: return
+        if security_id in self.positions: self._drop(security_id)
+        self.positions[security_id] = [symbol, quantity, entry_price, entry_price, 0.0]
+        self.gross_exposure += quantity * entry_price
+        self.updated_at = time.time()
+
+    def mark(self, security_id: str, ltp: float):
+        """O(1) re-mark of one position on a price change."""
+        pos = self.positions.get(security_id)
+        if pos is None or ltp == pos[_LTP]: return
+        qty = pos[_QTY]
+        upnl = (ltp - pos[_ENTRY]) * qty
+        self.unrealized += upnl - pos[_UPNL]
+        self.gross_exposure += (ltp - pos[_LTP]) * qty
+        pos[_LTP] = ltp
+        pos[_UPNL] = upnl
+        self.updated_at = time.time()
+
+    def close(self, security_id: str, realized_pnl: float):
+        if security_id in self.positions: self._drop(security_id)
+        self.realized += realized_pnl or 0.0
+        self.closed_today += 1
+        self.updated_at = time.time()
+
+    def _drop(self, security_id: str):
+        pos = self.positions.pop(security_id)
+        self.unrealized -= pos[_UPNL]
+        self.gross_exposure -= pos[_QTY] * pos[_LTP]
+
+    # --- READS ---
+    @property
+    def total(self) -> float:
+        return self.realized + self.unrealized
+
+    def limit_breached(self, cfg) -> Optional[str]:
+        """Exit reason if the strategy's daily P&L limits are enabled and hit, else None."""
+        if not cfg.pnl_exit_enabled: return None
+        total = self.total
+        if cfg.pnl_profit_target and total >= cfg.pnl_profit_target: return "Daily Profit Target"
+        if cfg.pnl_stop_loss and total <= -abs(cfg.pnl_stop_loss): return "Daily Stop Loss"
+        return None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'realized': round(self.realized, 2),
+            'unrealized': round(self.unrealized, 2),
+            'total': round(self.total, 2),
+            'gross_exposure': round(self.gross_exposure, 2),
+            'open_positions': len(self.positions),
+            'closed': self.closed_today,
+            # symbol -> [qty, ltp, unrealized]
+            'symbols': {p[_SYM]: [p[_QTY], p[_LTP], round(p[_UPNL], 2)] for p in self.positions.values()},
+            'ts': round(self.updated_at, 3),
+        }
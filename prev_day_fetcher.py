@@ -0,0 +1,165 @@
+# prev_day_fetcher.py - Concurrent, rate-limited previous-day OHLC fetch (fetch_prev_day_ohlc)
+"""
+Pre-market the strategies need each symbol's levels from the previous session
+(see prev_day_levels.py for the date-keyed cache). PrevDayFetcher gets them for
+the symbols the cache is missing:
+
+- historical_daily_data calls run on a pool of PREV_DAY_FETCH_WORKERS threads.
+  The client is a broker_limiter.LimitedBroker, so every call takes a token from
+  the shared 'data' bucket (BROKER_DATA_RATE_PER_SEC, the broker's Data API
+  limit) and engines / dashboard calls are paced against the same budget.
+- Only the PREV_DAY_LOOKBACK_DAYS calendar days up to the session are requested;
+  the last bar dated on or before the session is used. A bar older than the
+  session is still cached but counted as stale (the next run fetches it again).
+- A failed call (exception, error response, rate-limit timeout) is retried with
+  tenacity, exponential backoff from PREV_DAY_RETRY_BACKOFF_SEC, up to
+  PREV_DAY_FETCH_ATTEMPTS attempts. A successful response without bars is not
+  retried (counted as empty).
+- Results are written to the session's hash as they arrive, PREV_DAY_WRITE_CHUNK
+  fields per pipelined HSET, so a run that dies half way keeps what it fetched.
+- report() has wall-clock time, fetched / stale / empty / failed counts, retries
+  and the failed symbols; run() also stores it under REDIS_PREV_DAY_REPORT_KEY.
+"""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from tenacity import Retrying, retry_if_exception_type, stop_after_attempt, wait_exponential
+
+from prev_day_levels import encode_levels, write_levels
+
+
+class FetchError(Exception):
+    """Error response from the broker (retried)."""
+
+
+def _bar_date(value) -> Optional[str]:
+    """YYYY-MM-DD of a bar's date / start time (epoch seconds or ISO string)."""
+    if value is None or value == '': return None
+    if isinstance(value, (int, float)): return datetime.fromtimestamp(value, tz=settings.IST).strftime('%Y-%m-%d')
+    return str(value)[:10]
+
+
+def last_bar(response: Dict[str, Any], until: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Last daily bar of a historical_daily_data response dated on or before `until`, or None."""
+    data = response.get('data')
+    if isinstance(data, list):
+        bars = [{'high': float(b.get('high', 0)), 'low': float(b.get('low', 0)), 'close': float(b.get('close', 0)),
+                 'date': _bar_date(b.get('tradingDate') or b.get('start_Time') or b.get('timestamp'))} for b in data]
+    elif isinstance(data, dict) and data.get('high'):
+        # dhanhq v2: dict of parallel lists
+        stamps = data.get('timestamp') or data.get('start_Time') or [None] * len(data['high'])
+        bars = [{'high': float(h), 'low': float(l), 'close': float(c), 'date': _bar_date(t)}
+                for h, l, c, t in zip(data['high'], data['low'], data['close'], stamps)]
+    else:
+        return None
+    if until: bars = [b for b in bars if b['date'] is None or b['date'] <= until] # No partial bar of the day being traded
+    return bars[-1] if bars else None
+
+
+class PrevDayFetcher:
+    def __init__(self, dhan, redis_conn, session: date, workers: Optional[int] = None, lookback_days: Optional[int] = None):
+        self.dhan = dhan
+        self.r = redis_conn
+        self.session = session # Trading date whose levels are wanted
+        self.workers = workers or settings.PREV_DAY_FETCH_WORKERS
+        self.lookback_days = lookback_days or settings.PREV_DAY_LOOKBACK_DAYS
+        self.lock = threading.Lock()
+
+        self.started = 0.0
+        self.finished = 0.0
+        self.total = 0
+        self.fetched = 0
+        self.stale: List[str] = [] # Last bar older than the session (refetched next run)
+        self.empty: List[str] = []
+        self.failed: Dict[str, str] = {} # symbol -> last error
+        self.retries = 0
+        self.written = 0
+
+    # --- POOL TASK ---
+    def _before_retry(self, state):
+        with self.lock: self.retries += 1
+
+    def _call(self, security_id: str, from_date: str, to_date: str) -> Dict[str, Any]:
+        response = self.dhan.historical_daily_data(
+            security_id=str(security_id),
+            exchange_segment=self.dhan.NSE,
+            instrument_type='EQUITY',
+            from_date=from_date,
+            to_date=to_date
+        )
+        if not isinstance(response, dict) or response.get('status') != 'success':
+            raise FetchError(str(response)[:200])
+        return response
+
+    def fetch_one(self, symbol: str, security_id: str, from_date: str, to_date: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+        retrying = Retrying(
+            stop=stop_after_attempt(settings.PREV_DAY_FETCH_ATTEMPTS),
+            wait=wait_exponential(multiplier=settings.PREV_DAY_RETRY_BACKOFF_SEC, max=settings.PREV_DAY_RETRY_BACKOFF_MAX_SEC),
+            retry=retry_if_exception_type(Exception),
+            before_sleep=self._before_retry,
+            reraise=True,
+        )
+        return symbol, last_bar(retrying(self._call, security_id, from_date, to_date), self.session.isoformat())
+
+    # --- RUN ---
+    def _write(self, chunk: Dict[str, str]):
+        write_levels(self.r, self.session, chunk)
+        self.written += len(chunk)
+
+    def run(self, instruments: Dict[str, Any]) -> Dict[str, Any]:
+        """Fetches symbol -> security id; returns the report."""
+        self.started = time.time()
+        self.total = len(instruments)
+        from_date = (self.session - timedelta(days=self.lookback_days)).strftime('%Y-%m-%d')
+        to_date = (self.session + timedelta(days=1)).strftime('%Y-%m-%d')
+
+        pending: Dict[str, str] = {}
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='prevday') as pool:
+            futures = {pool.submit(self.fetch_one, symbol, sid, from_date, to_date): symbol for symbol, sid in instruments.items()}
+            for future in as_completed(futures):
+                symbol = futures[future]
+                try:
+                    _, bar = future.result()
+                except Exception as e:
+                    if not self.failed: print(f"Prev-Day Fetch: First failure ({symbol}): {e}")
+                    self.failed[symbol] = str(e)[:200]
+                    continue
+                if bar is None:
+                    self.empty.append(symbol)
+                    continue
+                self.fetched += 1
+                if bar['date'] and bar['date'] != self.session.isoformat(): self.stale.append(symbol)
+                pending[symbol] = encode_levels(bar['high'], bar['low'], bar['close'], bar['date'] or self.session.isoformat())
+                if len(pending) >= settings.PREV_DAY_WRITE_CHUNK:
+                    self._write(pending)
+                    pending = {}
+        if pending: self._write(pending)
+        self.finished = time.time()
+
+        report = self.report()
+        try:
+            self.r.set(settings.REDIS_PREV_DAY_REPORT_KEY, json.dumps(report, separators=(',', ':')))
+        except Exception as e:
+            print(f"Prev-Day Report Error: {e}")
+        return report
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            'session': self.session.isoformat(),
+            'started_at': datetime.fromtimestamp(self.started, tz=settings.IST).isoformat() if self.started else None,
+            'wall_sec': round((self.finished or time.time()) - self.started, 2) if self.started else None,
+            'symbols': self.total,
+            'fetched': self.fetched,
+            'written': self.written,
+            'stale': len(self.stale),
+            'empty': len(self.empty),
+            'failed': len(self.failed),
+            'retries': self.retries,
+            'workers': self.workers,
+            'failed_symbols': sorted(self.failed)[:50],
+        }
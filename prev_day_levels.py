@@ -0,0 +1,108 @@
+# prev_day_levels.py - Date-keyed cache of previous-session OHLC levels in Redis
+"""
+Levels are stored per session, one hash per trading date:
+
+    <PREV_DAY_HASH>:<YYYY-MM-DD>   symbol -> "high,low,close,YYYYMMDD"
+
+The trailing field is the date of the bar the levels came from; a value whose
+bar date is not the hash's session is stale (e.g. no bar yet for that symbol)
+and is fetched again by the next fetch_prev_day_ohlc run. Each hash expires
+after PREV_DAY_LEVELS_TTL_SEC.
+
+- load_levels() / load_highs() read one session in a single HGETALL (default:
+  trading_calendar.expected_session()). A missing session is logged and returns
+  no levels; live code never reads an older session instead. The legacy
+  PREV_DAY_HASH hash of JSON values (no TTL, no longer written) is only read when
+  asked for (legacy=True, backtest of old recordings).
+- levels_from_candle_store() computes a session's levels from the on-disk
+  candle store (high = max high, low = min low, close = last 1-minute close),
+  with no API calls.
+"""
+import json
+from datetime import date
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from trading_calendar import expected_session
+
+Levels = Tuple[float, float, float, Optional[str]] # high, low, close, bar date (YYYY-MM-DD)
+
+
+def levels_key(session: Optional[date] = None) -> str:
+    session = session or expected_session()
+    return f"{settings.PREV_DAY_HASH}:{session.isoformat()}"
+
+
+def encode_levels(high: float, low: float, close: float, bar_date: Optional[str]) -> str:
+    return f"{float(high)!r},{float(low)!r},{float(close)!r},{(bar_date or '').replace('-', '')}"
+
+
+def parse_levels(raw) -> Optional[Levels]:
+    """Compact value or legacy JSON ({"high": ..., "low": ..., "close": ..., "date": ...})."""
+    if not raw: return None
+    if raw[0] == '{':
+        d = json.loads(raw)
+        return float(d.get('high', 0)), float(d.get('low', 0)), float(d.get('close', 0)), d.get('date')
+    high, low, close, day = raw.split(',')
+    return float(high), float(low), float(close), (f"{day[:4]}-{day[4:6]}-{day[6:]}" if day else None)
+
+
+def load_levels(r, session: Optional[date] = None, legacy: bool = False) -> Dict[str, Levels]:
+    key = levels_key(session)
+    raw = r.hgetall(key)
+    if not raw and legacy: raw = r.hgetall(settings.PREV_DAY_HASH)
+    if not raw:
+        print(f"WARNING: No prev-day levels cached under {key} (run fetch_prev_day_ohlc).")
+        return {}
+    levels = {}
+    for symbol, value in raw.items():
+        try:
+            parsed = parse_levels(value)
+        except (ValueError, TypeError):
+            continue
+        if parsed: levels[symbol] = parsed
+    return levels
+
+
+def load_highs(r, session: Optional[date] = None) -> Dict[str, float]:
+    return {symbol: lv[0] for symbol, lv in load_levels(r, session).items() if lv[0]}
+
+
+def stale_symbols(r, symbols, session: date):
+    """Symbols with no cached levels for `session`, or levels from another bar date."""
+    key = levels_key(session)
+    cached = r.hgetall(key) or {}
+    wanted = session.isoformat()
+    stale = []
+    for symbol in symbols:
+        try:
+            lv = parse_levels(cached.get(symbol))
+        except (ValueError, TypeError):
+            lv = None
+        if lv is None or lv[3] != wanted: stale.append(symbol)
+    return stale
+
+
+def write_levels(r, session: date, values: Dict[str, str]):
+    """One pipelined HSET (+ TTL refresh) of encoded levels."""
+    if not values: return
+    key = levels_key(session)
+    pipe = r.pipeline(transaction=False)
+    pipe.hset(key, mapping=values)
+    pipe.expire(key, settings.PREV_DAY_LEVELS_TTL_SEC)
+    pipe.execute()
+
+
+def levels_from_candle_store(store, day: str) -> Dict[str, str]:
+    """symbol -> encoded levels of one stored day, or {} if the day is not stored."""
+    cd = store.day(day)
+    if cd is None or not len(cd): return {}
+    starts = cd.offsets[:-1]
+    present = np.diff(cd.offsets) > 0
+    highs = np.maximum.reduceat(np.asarray(cd.arrays['high']), starts[present])
+    lows = np.minimum.reduceat(np.asarray(cd.arrays['low']), starts[present])
+    closes = np.asarray(cd.arrays['close'])[cd.offsets[1:][present] - 1]
+    symbols = [s for s, p in zip(cd.symbols, present) if p]
+    return {s: encode_levels(float(h), float(l), float(c), day) for s, h, l, c in zip(symbols, highs, lows, closes)}
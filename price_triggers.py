@@ -0,0 +1,245 @@
+# price_triggers.py - Price-crossing triggers watched by the Data Worker
+"""
+Instead of waking on every tick of every symbol, the Algo Engine registers the
+price levels its trades care about (entry, stop, target, breakeven) and the Data
+Worker tells it when one is crossed.
+
+- TriggerRegistrar (engine) diffs the triggers each active trade wants against
+  what it has registered and XADDs SET / CANCEL messages to
+  REDIS_STREAM_TRIGGER_REGS. Each trigger is keyed '<trade id>:<kind>'.
+- TriggerBook (worker) consumes that stream with a consumer group and keeps, per
+  security, two sorted price lists (ABOVE: fires when LTP >= price, BELOW: fires
+  when LTP <= price). A tick only bisects the lists of its own security.
+- A crossed trigger is removed (one-shot) and a compact event is XADDed to the
+  partition stream of REDIS_STREAM_TRIGGER_EVENTS. The engine forgets the fired
+  key, so if the trade still wants it (e.g. the order was deferred) it is
+  registered again on the next sync. If the event can't be published the
+  trigger goes back into the book.
+- The registrar seeds what it has registered from REDIS_TRIGGER_HASH on its first
+  sync (and after a failed send), so triggers of trades that closed while the
+  engine was down, or while Redis was failing, are cancelled rather than left
+  armed.
+- Every applied registration is mirrored in the REDIS_TRIGGER_HASH hash and
+  registrations are acked only after that, so a restarted worker reloads the
+  book from the hash and then resumes the stream where it left off. Entries from
+  a previous trading day are dropped on load.
+"""
+import json
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import redis
+from django.conf import settings
+
+from partitions import route_stream
+
+SIDE_ABOVE = 'ABOVE'
+SIDE_BELOW = 'BELOW'
+
+
+def trigger_key(trade_id, kind: str) -> str:
+    return f"{trade_id}:{kind}"
+
+
+class _SymbolTriggers:
+    """Sorted trigger prices of one security (parallel price/key lists per side)."""
+    __slots__ = ('above', 'above_keys', 'below', 'below_keys')
+
+    def __init__(self):
+        self.above: List[float] = []
+        self.above_keys: List[str] = []
+        self.below: List[float] = []
+        self.below_keys: List[str] = []
+
+    def add(self, side: str, price: float, key: str):
+        prices, keys = (self.above, self.above_keys) if side == SIDE_ABOVE else (self.below, self.below_keys)
+        i = bisect_right(prices, price)
+        prices.insert(i, price)
+        keys.insert(i, key)
+
+    def remove(self, side: str, key: str):
+        prices, keys = (self.above, self.above_keys) if side == SIDE_ABOVE else (self.below, self.below_keys)
+        if key in keys:
+            i = keys.index(key)
+            del prices[i], keys[i]
+
+    def crossed(self, ltp: float) -> List[str]:
+        """Pops and returns the keys crossed by `ltp`."""
+        fired = []
+        i = bisect_right(self.above, ltp) # ABOVE triggers priced <= ltp
+        if i:
+            fired.extend(self.above_keys[:i])
+            del self.above[:i], self.above_keys[:i]
+        j = bisect_left(self.below, ltp) # BELOW triggers priced >= ltp
+        if j < len(self.below):
+            fired.extend(self.below_keys[j:])
+            del self.below[j:], self.below_keys[j:]
+        return fired
+
+    def __len__(self):
+        return len(self.above) + len(self.below)
+
+
+class TriggerBook:
+    """Worker side: registrations in, crossing events out."""
+
+    def __init__(self, redis_conn):
+        self.r = redis_conn
+        self.lock = threading.Lock()
+        self.books: Dict[str, _SymbolTriggers] = {} # security id -> sorted triggers
+        self.regs: Dict[str, Dict[str, Any]] = {}   # key -> registration
+
+    def load(self) -> int:
+        """Rebuilds the book from the persisted hash (today's registrations only)."""
+        today = datetime.now(settings.IST).strftime('%Y-%m-%d')
+        stale = []
+        with self.lock:
+            for key, raw in (self.r.hgetall(settings.REDIS_TRIGGER_HASH) or {}).items():
+                reg = json.loads(raw)
+                if reg.get('d') != today:
+                    stale.append(key)
+                    continue
+                self._add(key, reg)
+        if stale: self.r.hdel(settings.REDIS_TRIGGER_HASH, *stale)
+        return len(self.regs)
+
+    # --- REGISTRATIONS ---
+    def _add(self, key: str, reg: Dict[str, Any]):
+        self._remove(key)
+        reg['price'] = float(reg['price'])
+        self.regs[key] = reg
+        self.books.setdefault(str(reg['sid']), _SymbolTriggers()).add(reg['side'], reg['price'], key)
+
+    def _remove(self, key: str):
+        reg = self.regs.pop(key, None)
+        if reg is None: return
+        book = self.books.get(str(reg['sid']))
+        if book is None: return
+        book.remove(reg['side'], key)
+        if not len(book): del self.books[str(reg['sid'])]
+
+    def apply(self, msg: Dict[str, Any], pipe):
+        """Applies one SET / CANCEL message; the hash update is queued on `pipe`."""
+        key = trigger_key(msg['t'], msg['k'])
+        with self.lock:
+            if msg.get('a') == 'SET':
+                reg = {'sid': str(msg['sid']), 'side': msg['side'], 'price': float(msg['price']),
+                       't': msg['t'], 'k': msg['k'], 'd': msg.get('d')}
+                self._add(key, reg)
+                pipe.hset(settings.REDIS_TRIGGER_HASH, key, json.dumps(reg))
+            else:
+                self._remove(key)
+                pipe.hdel(settings.REDIS_TRIGGER_HASH, key)
+
+    def run_registrations(self, consumer: str):
+        """Blocking loop: own pending entries first (restart), then new registrations."""
+        stream, group = settings.REDIS_STREAM_TRIGGER_REGS, settings.REDIS_TRIGGER_GROUP
+        try:
+            self.r.xgroup_create(stream, group, id='0', mkstream=True)
+        except redis.exceptions.ResponseError:
+            pass # Group exists
+        print(f"Trigger Book: {self.load()} registrations reloaded.")
+        last_id = '0' # Own pending list first, then '>' for new entries
+        while True:
+            try:
+                resp = self.r.xreadgroup(group, consumer, {stream: last_id}, count=500, block=1000) or []
+                messages = resp[0][1] if resp else []
+                if not messages:
+                    last_id = '>'
+                    continue
+                pipe = self.r.pipeline(transaction=False)
+                for message_id, data in messages:
+                    if last_id != '>': last_id = message_id
+                    if data: self.apply(json.loads(data['p']), pipe)
+                pipe.xack(stream, group, *[m for m, _ in messages])
+                pipe.execute()
+            except Exception as e:
+                print(f"Trigger Registration Error: {e}")
+                time.sleep(1)
+
+    # --- TICKS ---
+    def on_tick(self, security_id: str, ltp: float, received: float):
+        """Hot path: one dict miss for securities without triggers."""
+        if security_id not in self.books: return
+        with self.lock:
+            book = self.books.get(security_id)
+            if book is None: return
+            fired = [self.regs.pop(key) for key in book.crossed(ltp)]
+            if not len(book): del self.books[security_id]
+        if not fired: return
+        try:
+            pipe = self.r.pipeline(transaction=False)
+            stream = route_stream(settings.REDIS_STREAM_TRIGGER_EVENTS, security_id)
+            for reg in fired:
+                pipe.xadd(stream, {'p': json.dumps({'t': reg['t'], 'k': reg['k'], 'securityId': security_id,
+                                                    'px': reg['price'], 'LTP': ltp, 'wr': received})},
+                          maxlen=settings.TRIGGER_STREAM_MAXLEN, approximate=True)
+            pipe.hdel(settings.REDIS_TRIGGER_HASH, *[trigger_key(reg['t'], reg['k']) for reg in fired])
+            pipe.execute()
+        except Exception as e:
+            # Not delivered: back into the book, so the next crossing tick fires them again
+            with self.lock:
+                for reg in fired:
+                    key = trigger_key(reg['t'], reg['k'])
+                    if key not in self.regs: self._add(key, reg)
+            print(f"Trigger Event Error: {e}")
+
+
+class TriggerRegistrar:
+    """Engine side: keeps the worker's book in line with what the active trades want."""
+
+    def __init__(self, redis_conn):
+        self.r = redis_conn
+        # trade id -> kind -> (side, price); None until seeded from the worker's book (see seed)
+        self.registered: Optional[Dict[Any, Dict[str, Tuple[str, float]]]] = None
+
+    def seed(self, today: str):
+        """
+        What the worker holds (REDIS_TRIGGER_HASH), so the first sync after a restart or a failed
+        send cancels the triggers of trades that closed in between instead of leaving them armed.
+        """
+        registered: Dict[Any, Dict[str, Tuple[str, float]]] = {}
+        for raw in (self.r.hgetall(settings.REDIS_TRIGGER_HASH) or {}).values():
+            reg = json.loads(raw)
+            if reg.get('d') == today:
+                registered.setdefault(reg['t'], {})[reg['k']] = (reg['side'], float(reg['price']))
+        self.registered = registered
+
+    def sync(self, wanted: Dict[Any, Tuple[str, Dict[str, Tuple[str, float]]]]):
+        """wanted: trade id -> (security id, {kind: (side, price)}). Sends only the differences."""
+        msgs = []
+        today = datetime.now(settings.IST).strftime('%Y-%m-%d')
+        if self.registered is None:
+            try:
+                self.seed(today)
+            except Exception as e:
+                print(f"Trigger Seed Error: {e}")
+                return
+        for trade_id, (sid, triggers) in wanted.items():
+            have = self.registered.get(trade_id, {})
+            if have == triggers: continue
+            for kind, (side, price) in triggers.items():
+                if have.get(kind) != (side, price):
+                    msgs.append({'a': 'SET', 't': trade_id, 'k': kind, 'sid': sid, 'side': side, 'price': price, 'd': today})
+            msgs.extend({'a': 'CANCEL', 't': trade_id, 'k': kind} for kind in have if kind not in triggers)
+            self.registered[trade_id] = dict(triggers)
+        for trade_id in [t for t in self.registered if t not in wanted]:
+            msgs.extend({'a': 'CANCEL', 't': trade_id, 'k': kind} for kind in self.registered.pop(trade_id))
+        if not msgs: return
+        try:
+            pipe = self.r.pipeline(transaction=False)
+            for msg in msgs:
+                pipe.xadd(settings.REDIS_STREAM_TRIGGER_REGS, {'p': json.dumps(msg, separators=(',', ':'))},
+                          maxlen=settings.TRIGGER_STREAM_MAXLEN, approximate=True)
+            pipe.execute()
+        except Exception as e:
+            self.registered = None # Re-seeded from the worker's book on the next sync
+            print(f"Trigger Sync Error: {e}")
+
+    def fired(self, trade_id, kind: str):
+        """The worker dropped a crossed trigger: re-register it if the trade still wants it."""
+        have = self.registered.get(trade_id) if self.registered is not None else None
+        if have: have.pop(kind, None)
@@ -0,0 +1,181 @@
+# scrip_master.py - Streaming, disk-cached ingestion of Dhan's scrip master CSV (cache_instruments)
+"""
+The detailed scrip master is a large CSV (hundreds of thousands of rows) that
+changes at most daily. open_scrip_master() yields a text stream of it without
+ever holding the whole file in memory:
+
+- --file: a local copy is read directly (no network; fully offline).
+- Otherwise the URL is requested with If-None-Match / If-Modified-Since from
+  the cached copy's metadata (SCRIP_MASTER_CACHE_PATH + '.meta.json'). A 304
+  reads the cached file; a 200 is parsed as it streams in while being written
+  to a temporary file that replaces the cache (with the new ETag /
+  Last-Modified) only once the whole body was read.
+- If the request fails and a cached copy exists, the cached copy is used.
+
+The caller reads rows with csv.reader and keeps only the columns it needs;
+ScripMasterReport has the source, bytes read, rows, wall-clock time and peak RSS.
+"""
+import io
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import requests
+from django.conf import settings
+
+CHUNK_BYTES = 1 << 16
+
+
+def peak_rss_mb() -> float:
+    """Process peak RSS (ru_maxrss is KB on Linux, bytes on macOS)."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+class ScripMasterReport:
+    def __init__(self):
+        self.started = time.time()
+        self.rss_before_mb = peak_rss_mb()
+        self.source = ''         # file / download / cache (not modified) / cache (offline)
+        self.path = ''
+        self.bytes = 0
+        self.rows = 0
+        self.etag = None
+        self.last_modified = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'source': self.source,
+            'path': self.path,
+            'mb': round(self.bytes / (1024 * 1024), 1),
+            'rows': self.rows,
+            'wall_sec': round(time.time() - self.started, 2),
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+            'rss_growth_mb': round(peak_rss_mb() - self.rss_before_mb, 1),
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+        }
+
+    def __str__(self):
+        d = self.as_dict()
+        return (f"{d['source']} {d['path']}: {d['rows']} rows, {d['mb']} MB in {d['wall_sec']}s "
+                f"(peak RSS {d['peak_rss_mb']} MB, +{d['rss_growth_mb']} MB)")
+
+
+class _CountingStream(io.RawIOBase):
+    """Raw byte stream over response chunks; copies every chunk to `sink` and counts bytes."""
+
+    def __init__(self, chunks: Iterator[bytes], report: ScripMasterReport, sink=None):
+        self.chunks = chunks
+        self.report = report
+        self.sink = sink
+        self.pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.pending:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            if self.sink is not None:
+                self.sink.write(chunk)
+            self.report.bytes += len(chunk)
+            self.pending = chunk
+        n = min(len(b), len(self.pending))
+        b[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
+
+    def drain(self):
+        """Reads (and copies) whatever the parser left unread."""
+        while self.readinto(bytearray(CHUNK_BYTES)):
+            pass
+
+
+def _text(raw) -> io.TextIOWrapper:
+    return io.TextIOWrapper(io.BufferedReader(raw, CHUNK_BYTES), encoding='utf-8-sig', errors='replace', newline='')
+
+
+def load_meta(cache_path: str) -> Dict[str, Any]:
+    try:
+        with open(cache_path + '.meta.json') as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_meta(cache_path: str, meta: Dict[str, Any]):
+    tmp = cache_path + '.meta.json.tmp'
+    with open(tmp, 'w') as fh:
+        json.dump(meta, fh)
+    os.replace(tmp, cache_path + '.meta.json')
+
+
+@contextmanager
+def _open_file(path: str, report: ScripMasterReport, source: str):
+    report.source, report.path = source, path
+    with open(path, 'rb', buffering=0) as fh:
+        raw = _CountingStream(iter(lambda: fh.read(CHUNK_BYTES), b''), report)
+        yield _text(raw)
+
+
+@contextmanager
+def open_scrip_master(file_path: Optional[str] = None, url: Optional[str] = None,
+                      cache_path: Optional[str] = None) -> Iterator[Tuple[io.TextIOWrapper, ScripMasterReport]]:
+    """Yields (text stream, report). See the module docstring for the sources."""
+    report = ScripMasterReport()
+    if file_path:
+        with _open_file(file_path, report, 'file') as stream:
+            yield stream, report
+        return
+
+    url = url or settings.SCRIP_MASTER_URL
+    cache_path = cache_path or settings.SCRIP_MASTER_CACHE_PATH
+    cached = os.path.exists(cache_path)
+    meta = load_meta(cache_path) if cached else {}
+    headers = {}
+    if cached and meta.get('url') == url:
+        if meta.get('etag'): headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'): headers['If-Modified-Since'] = meta['last_modified']
+
+    resp = None
+    try:
+        resp = requests.get(url, headers=headers, stream=True, timeout=settings.SCRIP_MASTER_TIMEOUT_SEC)
+        if resp.status_code != 304:
+            resp.raise_for_status()
+    except requests.RequestException as e:
+        if resp is not None: resp.close()
+        if not cached:
+            raise Exception(f"Failed to fetch instrument CSV from Dhan: {e}")
+        print(f"Scrip Master: Download failed ({e}); using cached copy from {meta.get('fetched_at', '?')}.")
+        resp = None
+
+    if resp is None or resp.status_code == 304:
+        if resp is not None: resp.close()
+        report.etag, report.last_modified = meta.get('etag'), meta.get('last_modified')
+        with _open_file(cache_path, report, 'cache (not modified)' if resp is not None else 'cache (offline)') as stream:
+            yield stream, report
+        return
+
+    # 200: parse while copying to a temporary file; it becomes the cache only when complete
+    report.source, report.path = 'download', url
+    report.etag, report.last_modified = resp.headers.get('ETag'), resp.headers.get('Last-Modified')
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    tmp = f"{cache_path}.tmp{os.getpid()}"
+    try:
+        with resp, open(tmp, 'wb') as sink:
+            raw = _CountingStream(resp.iter_content(CHUNK_BYTES), report, sink)
+            yield _text(raw), report
+            raw.drain()
+        os.replace(tmp, cache_path)
+        _save_meta(cache_path, {'url': url, 'etag': report.etag, 'last_modified': report.last_modified,
+                                'bytes': report.bytes, 'fetched_at': datetime.now(settings.IST).isoformat()})
+    finally:
+        if os.path.exists(tmp): os.remove(tmp)
@@ -0,0 +1,78 @@
+# signal_filter.py - Breakout pre-filter applied by the Data Worker at candle finalization
+"""
+The engine's breakout test (open < prev-day high < close) rejects almost every
+finalized 1-minute candle. With SIGNAL_FILTER_ENABLED the Data Worker runs the
+same test once per candle and publishes only the candidates to the
+(partition-routed) REDIS_STREAM_SIGNALS stream, which the engine then consumes
+instead of REDIS_STREAM_CANDLES. Every candle still goes to the history lists.
+
+- Prev-day highs of the expected session are read in one HGETALL
+  (prev_day_levels.load_highs) and refreshed every
+  SIGNAL_FILTER_RELOAD_SEC (picks up the morning fetch_prev_day_ohlc run).
+- With SIGNAL_FILTER_CANDLE_SIZE, candles whose range (high - low) / open is above
+  the loosest max_candle_pct of the enabled strategies are dropped as well; each
+  strategy then applies its own max_candle_pct in process_new_candle.
+- Candidates carry the prev-day high ('pdh') so the engine needs no lookup.
+"""
+import time
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+
+from db_health import DBConnectionManager
+from prev_day_levels import load_highs
+
+
+def candle_range_pct(candle: Dict[str, Any]) -> float:
+    open_p = float(candle['open'])
+    if open_p <= 0: return 0.0
+    return (float(candle['high']) - float(candle['low'])) / open_p
+
+
+def is_breakout_candidate(candle: Dict[str, Any], pdh: Optional[float], max_candle_pct: Optional[float] = None) -> bool:
+    if not pdh: return False
+    if not (float(candle['open']) < pdh < float(candle['close'])): return False
+    return max_candle_pct is None or candle_range_pct(candle) <= max_candle_pct
+
+
+class CandleSignalFilter:
+    def __init__(self, redis_conn):
+        self.r = redis_conn
+        self.pdh: Dict[str, float] = {} # symbol -> prev day high
+        self.max_candle_pct: Optional[float] = None
+        self.loaded_at = 0.0
+        self.passed = 0
+        self.seen = 0
+        self.db = DBConnectionManager(f"{settings.REDIS_CONSUMER_NAME}:signal_filter", redis_conn=redis_conn)
+
+    def load(self):
+        try:
+            self.pdh = load_highs(self.r)
+        except Exception as e:
+            print(f"Signal Filter: Prev-day load failed ({e}).")
+        self.max_candle_pct = self._candle_size_limit() if settings.SIGNAL_FILTER_CANDLE_SIZE else None
+        self.db.publish()
+        self.loaded_at = time.monotonic()
+        print(f"Signal Filter: {len(self.pdh)} prev-day highs, candle size limit {self.max_candle_pct}. "
+              f"Passed {self.passed}/{self.seen} candles so far.")
+
+    def _candle_size_limit(self) -> Optional[float]:
+        """Loosest max_candle_pct of the enabled strategies (each strategy re-checks its own)."""
+        if not self.db.ensure(): return settings.MAX_CANDLE_PCT
+        try:
+            from dashboard.models import StrategySettings
+            pcts = [p for p in StrategySettings.objects.filter(is_enabled=True).values_list('max_candle_pct', flat=True) if p]
+            return max(pcts) if pcts else settings.MAX_CANDLE_PCT
+        except Exception as e:
+            print(f"Signal Filter: Strategy settings unavailable ({e}). Using MAX_CANDLE_PCT.")
+            return settings.MAX_CANDLE_PCT
+
+    def check(self, candle: Dict[str, Any]) -> bool:
+        """True if the candle is a breakout candidate; tags it with its prev-day high."""
+        if time.monotonic() - self.loaded_at >= settings.SIGNAL_FILTER_RELOAD_SEC: self.load()
+        self.seen += 1
+        pdh = self.pdh.get(candle['symbol'])
+        if not is_breakout_candidate(candle, pdh, self.max_candle_pct): return False
+        candle['pdh'] = pdh
+        self.passed += 1
+        return True
@@ -0,0 +1,405 @@
+# sim_broker.py - Local stand-in for the dhanhq REST client (BROKER_MODE=SIM)
+"""
+Simulated broker implementing the dhanhq surface used by the engine and dashboard
+(place_order / cancel_order / modify_order / get_order_by_id / get_order_by_correlationID /
+historical_daily_data).
+
+- place_order blocks for the configured ACK latency and returns the dhanhq response
+  shape ({'status', 'remarks', 'data': {'orderId', 'orderStatus'}}).
+- Order updates are XADDed onto REDIS_STREAM_ORDERS (partition-routed) in the same
+  shape on_order_update_message forwards: PENDING on ack, PART_TRADED for partial
+  fills, then TRADED / REJECTED / CANCELLED.
+- Market orders fill at the latest LTP seen on the market stream(s), falling back to
+  the last 1m close in the candle history list, plus configured slippage.
+- Bracket orders (product_type BO): once the entry fills, a stop leg (LegNo 2) and a
+  target leg (LegNo 3) are watched against the LTP; the first to trigger fills and the
+  other is cancelled. modify_order(leg_name='STOP_LOSS_LEG') moves the stop trigger and
+  cancel_order on a filled bracket exits it at market.
+- Latencies are distributions in milliseconds: 'const:5', 'uniform:5,20',
+  'normal:20,5', 'lognormal:3,0.5' (mu/sigma of ln(ms)).
+- The order book lives in Redis (SIM_BROKER_KEY_PREFIX): orders and correlation ids
+  in hashes, scheduled order events in a sorted set scored by due time. The engine
+  and the dashboard share it (a manual cancel / square-off sees engine orders) and it
+  survives restarts. Engine processes run an event loop (and a price feed); an event
+  belongs to whichever loop removes it from the set first, and order changes hold a
+  per-order Redis lock. The dashboard's client (background=False) starts no threads:
+  it places / cancels orders and leaves their events to the engines' loops.
+"""
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+from django.conf import settings
+
+from partitions import order_update_stream, partition_count, partition_stream
+
+
+def order_id_from(resp) -> Optional[str]:
+    """orderId from a place_order response (dhanhq nests it under 'data'; older shapes are flat)."""
+    if not isinstance(resp, dict): return None
+    data = resp.get('data')
+    if isinstance(data, dict) and data.get('orderId'): return str(data['orderId'])
+    return resp.get('orderId')
+
+
+# Bracket order legs: Dhan order-book legName -> order update LegNo
+LEG_NUMBERS = {'ENTRY_LEG': 1, 'STOP_LOSS_LEG': 2, 'TARGET_LEG': 3}
+
+
+def leg_number(data) -> int:
+    """Bracket leg of an order update / order-book entry (1 = entry, or not a bracket order)."""
+    leg = data.get('LegNo') or data.get('legNo') or LEG_NUMBERS.get(data.get('legName'), 1)
+    try:
+        return int(leg)
+    except (TypeError, ValueError):
+        return 1
+
+
+def order_status_from(resp) -> Dict[str, Any]:
+    """{'order_id', 'status', 'price', 'leg'} from a get_order_by_id / get_order_by_correlationID response."""
+    data = resp.get('data') if isinstance(resp, dict) else None
+    if isinstance(data, list): data = data[0] if data else None
+    if not isinstance(data, dict): return {'order_id': None, 'status': None, 'price': None, 'leg': 1}
+    return {
+        'order_id': data.get('orderId') or data.get('OrderNo'),
+        'status': data.get('orderStatus') or data.get('OrderStatus'),
+        'price': data.get('averageTradedPrice') or data.get('AvgTradedPrice') or data.get('tradedPrice') or data.get('TradedPrice'),
+        'leg': leg_number(data),
+    }
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """'uniform:5,20' -> callable returning seconds."""
+    kind, _, args = (spec or 'const:0').partition(':')
+    vals = [float(v) for v in args.split(',') if v.strip()] or [0.0]
+    if kind == 'const':
+        return lambda: vals[0] / 1000.0
+    if kind == 'uniform':
+        return lambda: random.uniform(vals[0], vals[1]) / 1000.0
+    if kind == 'normal':
+        return lambda: max(0.0, random.gauss(vals[0], vals[1])) / 1000.0
+    if kind == 'lognormal':
+        return lambda: random.lognormvariate(vals[0], vals[1]) / 1000.0
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class _PriceFeed(threading.Thread):
+    """Tails the market stream(s) with plain XREAD to keep a local LTP map."""
+
+    def __init__(self, redis_conn):
+        super().__init__(daemon=True)
+        self.r = redis_conn
+        self.ltp: Dict[str, float] = {}
+        self.streams = {partition_stream(settings.REDIS_STREAM_MARKET, p): '$' for p in range(partition_count())}
+
+    def run(self):
+        while True:
+            try:
+                for stream, messages in self.r.xread(self.streams, count=500, block=1000) or []:
+                    for message_id, data in messages:
+                        self.streams[stream] = message_id
+                        tick = json.loads(data['p'])
+                        ltp = float(tick.get('LTP') or 0)
+                        if ltp > 0: self.ltp[str(tick.get('securityId'))] = ltp
+            except Exception as e:
+                print(f"SimBroker PriceFeed Error: {e}")
+                time.sleep(1)
+
+
+class SimulatedDhan:
+    """Drop-in for dhanhq(...) with configurable ack/fill latency, rejects and partial fills."""
+
+    # dhanhq constants the code references
+    NSE, BSE = 'NSE_EQ', 'BSE_EQ'
+    BUY, SELL = 'BUY', 'SELL'
+    MARKET, LIMIT, SL, SLM = 'MARKET', 'LIMIT', 'STOP_LOSS', 'STOP_LOSS_MARKET'
+    INTRA, CNC, BO, CO = 'INTRADAY', 'CNC', 'BO', 'CO'
+
+    LEG_POLL_SEC = 0.05   # Bracket legs are checked against the LTP this often
+    EVENT_POLL_SEC = 0.05 # Events scheduled by another process are picked up within this
+    TERMINAL = ('TRADED', 'CANCELLED', 'REJECTED')
+
+    def __init__(self, redis_conn, price_fn: Optional[Callable[[str], Optional[float]]] = None,
+                 ack_latency: Optional[str] = None, fill_latency: Optional[str] = None,
+                 reject_rate: Optional[float] = None, partial_fill_rate: Optional[float] = None,
+                 slippage_pct: Optional[float] = None, background: bool = True):
+        self.r = redis_conn
+        self.ack_latency = parse_latency(ack_latency or settings.SIM_BROKER_ACK_LATENCY)
+        self.fill_latency = parse_latency(fill_latency or settings.SIM_BROKER_FILL_LATENCY)
+        self.reject_rate = settings.SIM_BROKER_REJECT_RATE if reject_rate is None else reject_rate
+        self.partial_fill_rate = settings.SIM_BROKER_PARTIAL_FILL_RATE if partial_fill_rate is None else partial_fill_rate
+        self.slippage_pct = settings.SIM_BROKER_SLIPPAGE_PCT if slippage_pct is None else slippage_pct
+
+        prefix = settings.SIM_BROKER_KEY_PREFIX
+        self.orders_key, self.tags_key = f"{prefix}:orders", f"{prefix}:tags"
+        self.events_key, self.seq_key, self.lock_prefix = f"{prefix}:events", f"{prefix}:seq", f"{prefix}:lock"
+
+        self.price_fn = price_fn
+        self.feed = None
+        if price_fn is None and background:
+            self.feed = _PriceFeed(redis_conn)
+            self.feed.start()
+
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        if background: threading.Thread(target=self._event_loop, daemon=True).start()
+
+    # --- PRICES ---
+    def _price(self, security_id: str) -> Optional[float]:
+        if self.price_fn: return self.price_fn(security_id)
+        ltp = self.feed.ltp.get(security_id) if self.feed else None
+        if ltp: return ltp
+        try:
+            raw = self.r.lindex(f"{settings.HISTORY_KEY_PREFIX}:{security_id}:1m", -1)
+            if raw: return float(json.loads(raw)['close'])
+        except Exception: pass
+        return None
+
+    # --- ORDER BOOK ---
+    def _load(self, order_id: str) -> Optional[Dict[str, Any]]:
+        raw = self.r.hget(self.orders_key, order_id) if order_id else None
+        return json.loads(raw) if raw else None
+
+    def _save(self, order: Dict[str, Any]):
+        pipe = self.r.pipeline()
+        pipe.hset(self.orders_key, order['order_id'], json.dumps(order))
+        if order.get('tag'): pipe.hset(self.tags_key, order['tag'], order['order_id'])
+        pipe.expire(self.orders_key, settings.SIM_BROKER_ORDER_TTL_SEC)
+        pipe.expire(self.tags_key, settings.SIM_BROKER_ORDER_TTL_SEC)
+        pipe.execute()
+
+    @contextmanager
+    def _locked(self, order_id: str):
+        """Yields the order (None if unknown) under its Redis lock; changes are saved on exit."""
+        with self.r.lock(f"{self.lock_prefix}:{order_id}", timeout=5, blocking_timeout=5):
+            order = self._load(order_id)
+            yield order
+            if order is not None: self._save(order)
+
+    def order_book(self) -> Dict[str, Dict[str, Any]]:
+        """All simulated orders by id."""
+        return {order_id: json.loads(raw) for order_id, raw in self.r.hgetall(self.orders_key).items()}
+
+    # --- EVENT DELIVERY ---
+    def _schedule(self, delay: float, order_id: str, event: str):
+        member = f"{self.r.incr(self.seq_key)}|{order_id}|{event}"
+        self.r.zadd(self.events_key, {member: time.time() + delay})
+        self.wakeup.set()
+
+    def _event_loop(self):
+        while not self.stopped.is_set():
+            try:
+                due = self.r.zrangebyscore(self.events_key, '-inf', time.time(), start=0, num=100)
+                for member in due:
+                    if self.r.zrem(self.events_key, member): # Claimed by this process
+                        _, order_id, event = member.split('|', 2)
+                        self._process(order_id, event)
+                if due: continue
+                head = self.r.zrange(self.events_key, 0, 0, withscores=True)
+                wait = min(self.EVENT_POLL_SEC, head[0][1] - time.time()) if head else self.EVENT_POLL_SEC
+                self.wakeup.wait(timeout=max(0.0, wait))
+                self.wakeup.clear()
+            except Exception as e:
+                print(f"SimBroker Event Loop Error: {e}")
+                time.sleep(1)
+
+    def _process(self, order_id: str, event: str):
+        updates = []
+        with self._locked(order_id) as order:
+            if not order: return
+            if event in ('LEGS', 'EXIT'):
+                updates = self._apply_legs(order, event)
+            elif order['status'] not in self.TERMINAL:
+                updates = self._apply(order, event)
+        for update in updates: self._emit(update)
+
+    def close(self):
+        """Stops this process's event loop (pending events stay in Redis for the other loops)."""
+        self.stopped.set()
+        self.wakeup.set()
+
+    def _apply(self, order: Dict[str, Any], event: str) -> list:
+        """Advances an order (lock held) and returns the update payloads to publish."""
+        if event == 'ACK':
+            return [self._update(order)]
+
+        if event == 'FILL':
+            price = order['price'] or self._price(order['security_id'])
+            if not price:
+                order['status'] = 'REJECTED'
+                order['remarks'] = 'No market price'
+                return [self._update(order)]
+            slip = self.slippage_pct if order['side'] == self.BUY else -self.slippage_pct
+            price = round(price * (1 + slip), 2)
+
+            remaining = order['quantity'] - order['filled']
+            lot = remaining
+            if remaining > 1 and random.random() < self.partial_fill_rate:
+                lot = random.randint(1, remaining - 1)
+                self._schedule(self.fill_latency(), order['order_id'], 'FILL')
+
+            order['avg_price'] = (order['avg_price'] * order['filled'] + price * lot) / (order['filled'] + lot)
+            order['filled'] += lot
+            order['last_price'] = price
+            order['status'] = 'TRADED' if order['filled'] >= order['quantity'] else 'PART_TRADED'
+            if order['status'] == 'TRADED' and order.get('bo'):
+                # Entry leg done: stop and target legs go live around the fill price
+                profit, stop = order['bo']
+                order['legs'] = {'stop': round(order['avg_price'] - stop, 2), 'target': round(order['avg_price'] + profit, 2)}
+                order['leg_view'] = self._update(order, 2, 'TRIGGER_PENDING')
+                self._schedule(self.LEG_POLL_SEC, order['order_id'], 'LEGS')
+            return [self._update(order)]
+        return []
+
+    def _apply_legs(self, order: Dict[str, Any], event: str) -> list:
+        """Bracket legs (lock held): the first leg to trigger fills, the other is cancelled."""
+        if not order.get('legs'): return []
+        price = self._price(order['security_id'])
+        stop, target = order['legs']['stop'], order['legs']['target']
+        if event == 'EXIT' or (price and price <= stop):
+            if not price: # Exit with no market price: retry on the next poll
+                self._schedule(self.LEG_POLL_SEC, order['order_id'], event)
+                return []
+            filled, other, fill_price = 2, 3, round(price * (1 - self.slippage_pct), 2)
+        elif price and price >= target:
+            filled, other, fill_price = 3, 2, target
+        else:
+            self._schedule(self.LEG_POLL_SEC, order['order_id'], 'LEGS')
+            return []
+        order['legs'] = None
+        order['exit_price'] = fill_price
+        order['leg_view'] = self._update(order, filled, 'TRADED', fill_price)
+        return [order['leg_view'], self._update(order, other, 'CANCELLED')]
+
+    def _update(self, order: Dict[str, Any], leg: int = 1, leg_status: Optional[str] = None,
+                leg_price: float = 0.0) -> Dict[str, Any]:
+        if leg > 1:
+            # Bracket exit leg: a SELL of the entry quantity (stop = SL-M, target = LIMIT)
+            return {
+                'OrderNo': order['order_id'],
+                'SecurityId': order['security_id'],
+                'TxnType': 'S',
+                'Product': order['product_type'],
+                'OrderType': self.SLM if leg == 2 else self.LIMIT,
+                'Quantity': order['quantity'],
+                'TradedQty': order['quantity'] if leg_status == 'TRADED' else 0,
+                'RemainingQuantity': 0 if leg_status == 'TRADED' else order['quantity'],
+                'Price': 0 if leg == 2 else (order['legs'] or {}).get('target', leg_price),
+                'TriggerPrice': (order['legs'] or {}).get('stop', leg_price) if leg == 2 else 0,
+                'TradedPrice': leg_price,
+                'AvgTradedPrice': leg_price,
+                'OrderStatus': leg_status,
+                'LegNo': leg,
+                'correlationId': order.get('tag'),
+                'Remarks': '',
+                'LastUpdatedTime': datetime.now(settings.IST).strftime('%Y-%m-%d %H:%M:%S'),
+            }
+        return {
+            'OrderNo': order['order_id'],
+            'SecurityId': order['security_id'],
+            'TxnType': 'B' if order['side'] == self.BUY else 'S',
+            'Product': order['product_type'],
+            'OrderType': order['order_type'],
+            'Quantity': order['quantity'],
+            'TradedQty': order['filled'],
+            'RemainingQuantity': order['quantity'] - order['filled'],
+            'Price': order['price'],
+            'TriggerPrice': order['trigger_price'],
+            'TradedPrice': round(order['avg_price'], 2) if order['status'] == 'TRADED' else order['last_price'],
+            'AvgTradedPrice': round(order['avg_price'], 2),
+            'OrderStatus': order['status'],
+            'LegNo': 1,
+            'correlationId': order.get('tag'),
+            'Remarks': order.get('remarks', ''),
+            'LastUpdatedTime': datetime.now(settings.IST).strftime('%Y-%m-%d %H:%M:%S'),
+        }
+
+    def _emit(self, payload: Dict[str, Any]):
+        payload['wr'] = time.time()
+        try:
+            self.r.xadd(order_update_stream(self.r, payload), {'p': json.dumps(payload)})
+        except Exception as e:
+            print(f"SimBroker Emit Error: {e}")
+
+    # --- DHANHQ SURFACE ---
+    def place_order(self, security_id, exchange_segment, transaction_type, quantity, order_type,
+                    product_type, price, trigger_price=0, disclosed_quantity=0, after_market_order=False,
+                    validity='DAY', amo_time='OPEN', bo_profit_value=None, bo_stop_loss_Value=None,
+                    tag=None, should_slice=False):
+        time.sleep(self.ack_latency())
+
+        if quantity <= 0 or random.random() < self.reject_rate:
+            return {'status': 'failure', 'remarks': {'error_code': 'SIM-REJ', 'error_message': 'Simulated rejection'}, 'data': ''}
+
+        order_id = f"SIM{int(time.time() * 1000)}{self.r.incr(self.seq_key) % 10000:04d}"
+        self._save({
+            'order_id': order_id, 'security_id': str(security_id), 'side': transaction_type,
+            'quantity': int(quantity), 'order_type': order_type, 'product_type': product_type,
+            'price': float(price or 0), 'trigger_price': float(trigger_price or 0),
+            'filled': 0, 'avg_price': 0.0, 'last_price': 0.0, 'status': 'PENDING', 'tag': tag,
+            'bo': [float(bo_profit_value or 0), float(bo_stop_loss_Value or 0)] if product_type == self.BO else None,
+            'legs': None, 'leg_view': None,
+        })
+        self._schedule(0, order_id, 'ACK')
+        if order_type == self.MARKET:
+            self._schedule(self.fill_latency(), order_id, 'FILL')
+        return {'status': 'success', 'remarks': '', 'data': {'orderId': order_id, 'orderStatus': 'PENDING'}}
+
+    def cancel_order(self, order_id):
+        time.sleep(self.ack_latency())
+        with self._locked(order_id) as order:
+            if order and order.get('legs'):
+                # Filled bracket: exit at market (stop leg fills, target leg is cancelled)
+                self._schedule(self.fill_latency(), order_id, 'EXIT')
+                return {'status': 'success', 'remarks': '', 'data': {'orderId': order_id, 'orderStatus': 'TRANSIT'}}
+            if not order or order['status'] in self.TERMINAL:
+                return {'status': 'failure', 'remarks': 'Order not open', 'data': ''}
+            order['status'] = 'CANCELLED'
+            update = self._update(order)
+        self._emit(update)
+        return {'status': 'success', 'remarks': '', 'data': {'orderId': order_id, 'orderStatus': 'CANCELLED'}}
+
+    def modify_order(self, order_id, order_type, leg_name, quantity, price, trigger_price,
+                     disclosed_quantity=0, validity='DAY'):
+        time.sleep(self.ack_latency())
+        with self._locked(order_id) as order:
+            if order and order.get('legs') and leg_name == 'STOP_LOSS_LEG':
+                order['legs']['stop'] = float(trigger_price or price)
+                order['leg_view'] = self._update(order, 2, 'TRIGGER_PENDING')
+                return {'status': 'success', 'remarks': '', 'data': {'orderId': order_id, 'orderStatus': 'TRIGGER_PENDING'}}
+            if not order or order['status'] in self.TERMINAL:
+                return {'status': 'failure', 'remarks': 'Order not open', 'data': ''}
+            order.update({'order_type': order_type, 'quantity': int(quantity or order['quantity']),
+                          'price': float(price or 0), 'trigger_price': float(trigger_price or 0)})
+        return {'status': 'success', 'remarks': '', 'data': {'orderId': order_id, 'orderStatus': order['status']}}
+
+    def get_order_by_id(self, order_id):
+        order = self._load(order_id)
+        if not order: return {'status': 'failure', 'remarks': 'Unknown order', 'data': ''}
+        # A filled bracket reports its live (or filled) exit leg
+        return {'status': 'success', 'remarks': '', 'data': [order.get('leg_view') or self._update(order)]}
+
+    def get_order_by_correlationID(self, correlation_id):
+        order = self._load(self.r.hget(self.tags_key, correlation_id)) if correlation_id else None
+        if not order: return {'status': 'failure', 'remarks': 'Unknown correlation id', 'data': ''}
+        return {'status': 'success', 'remarks': '', 'data': self._update(order)}
+
+    def historical_daily_data(self, security_id, exchange_segment, instrument_type, from_date, to_date, expiry_code=0):
+        return {'status': 'failure', 'remarks': 'Historical data is not available in simulation', 'data': ''}
+
+
+_SIM_BROKER = None
+
+def get_simulated_broker(redis_conn, background: bool = True) -> SimulatedDhan:
+    """
+    One simulator per process; the order book itself is in Redis. background=False
+    (dashboard workers) gives a place / cancel client without event loop or price feed.
+    """
+    global _SIM_BROKER
+    if _SIM_BROKER is None:
+        _SIM_BROKER = SimulatedDhan(redis_conn, background=background)
+    return _SIM_BROKER
@@ -0,0 +1,219 @@
+# squareoff.py - Concurrent square-off of a strategy's open positions
+"""
+SquareOffJob flattens every open position of one strategy (End of Day / P&L halt).
+
+- Exit orders go out from a small thread pool. The broker client is wrapped by
+  broker_limiter.LimitedBroker, so the burst is paced on the exit lane of the shared
+  order rate limit (ahead of entries and informational calls).
+- Only broker calls run on pool threads. Trade state, DB and Redis writes are applied
+  by poll() on the engine's main loop, which keeps consuming the order stream so
+  fills confirm while the remaining exits are still going out.
+- Every exit must be confirmed (fill -> trade CLOSED) within EOD_CONFIRM_DEADLINE_SEC.
+  Past the deadline the broker's order status decides: a missed fill is reconciled,
+  a rejected/cancelled order is resent, a still-working order is cancelled and
+  resent (a bracket whose exit legs are still open is not cancelled twice). After
+  EOD_MAX_RETRIES checks the position is escalated for manual action.
+- Once every position is confirmed or escalated, report() has the timings (first/last
+  broker ack, time to fully flat), retries and escalations per symbol.
+
+workers=0 runs the broker calls inline (deterministic, used by the backtest).
+"""
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+
+from sim_broker import order_id_from, order_status_from
+from trade_state import IDLE_ORDER_STATES
+
+OPEN_ORDER_STATUSES = ('PENDING', 'TRANSIT', 'OPEN', 'TRIGGER_PENDING', 'PART_TRADED')
+DEAD_ORDER_STATUSES = ('REJECTED', 'CANCELLED', 'EXPIRED')
+
+
+def query_order(broker, order_id=None, correlation_id=None) -> Dict[str, Any]:
+    """Broker view of one order, by order id or (ack never received) by correlation id."""
+    if order_id and hasattr(broker, 'get_order_by_id'):
+        return order_status_from(broker.get_order_by_id(order_id))
+    if correlation_id and hasattr(broker, 'get_order_by_correlationID'):
+        return order_status_from(broker.get_order_by_correlationID(correlation_id))
+    return order_status_from(None)
+
+
+class SquareOffJob:
+    def __init__(self, strategy, broker, reason: str, workers: Optional[int] = None, escalated=()):
+        self.strategy = strategy
+        self.broker = broker
+        self.reason = reason
+        self.deadline_sec = settings.EOD_CONFIRM_DEADLINE_SEC
+        self.max_retries = settings.EOD_MAX_RETRIES
+        workers = settings.EOD_SQUAREOFF_WORKERS if workers is None else workers
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='squareoff') if workers > 0 else None
+
+        self.started = time.time()
+        self.started_at = datetime.now(settings.IST)
+        self.items: Dict[str, Dict[str, Any]] = {} # symbol -> per-position tracking
+        self.escalated = set(escalated) # Left for manual action (carried over from earlier jobs)
+        self.done = False
+        self.finished_at = None
+
+    def _ms(self, t: Optional[float] = None) -> float:
+        return round(((t or time.time()) - self.started) * 1000, 1)
+
+    def _submit(self, fn, *args) -> Future:
+        if self.pool is not None: return self.pool.submit(fn, *args)
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    # --- POOL TASKS (broker calls only) ---
+    def _send(self, trade):
+        resp, sent_t, ack_t = self.strategy.send_exit_order(trade, self.broker)
+        return ('sent', resp, sent_t, ack_t)
+
+    def _check(self, order_id, correlation_id):
+        """Deadline passed: asks the broker what happened to the exit; a still-working exit order is cancelled."""
+        info = query_order(self.broker, order_id, correlation_id)
+        # Open bracket legs (2/3) mean the square-off cancel is still being worked: cancelling the
+        # bracket again would send a second market exit, so it is left to the next check / escalation
+        if info['status'] in OPEN_ORDER_STATUSES and info['order_id'] and info['leg'] == 1:
+            self.broker.cancel_order(info['order_id'])
+            info = query_order(self.broker, info['order_id']) # It may have filled while we cancelled
+        return ('checked', info)
+
+    # --- MAIN LOOP ---
+    def start(self):
+        for trade in list(self.strategy.active_trades.values()):
+            self._track(trade)
+        print(f"SQUARE-OFF: {self.strategy.settings.name} flattening {len(self.items)} positions ({self.reason}).")
+        self.poll()
+
+    def _track(self, trade):
+        """OPEN trades get an exit order; exits already in flight are only watched."""
+        if trade.symbol in self.items or trade.symbol in self.escalated or trade.status not in ('OPEN', 'PENDING_EXIT'): return
+        item = self.items[trade.symbol] = {
+            'trade': trade, 'attempts': 0, 'checks': 0,
+            'ack_ms': None, 'confirmed_ms': None, 'escalated': False, 'last_status': None,
+            'deadline': time.monotonic() + self.deadline_sec, 'future': None,
+        }
+        if trade.status == 'OPEN' and trade.order_state in IDLE_ORDER_STATES: self._resend(item)
+
+    def _resend(self, item):
+        """New exit leg: state and correlation id are set here, the broker call runs on the pool."""
+        self.strategy.mark_exit_sent(item['trade'])
+        item['future'] = self._submit(self._send, item['trade'])
+
+    def on_closed(self, trade):
+        """Called from order reconciliation when an exit fill closes a tracked trade."""
+        item = self.items.get(trade.symbol)
+        if item is not None and item['trade'] is trade and item['confirmed_ms'] is None:
+            item['confirmed_ms'] = self._ms()
+
+    def poll(self):
+        """Applies finished broker calls, then retries or escalates exits past their deadline."""
+        if self.done: return
+        for trade in list(self.strategy.active_trades.values()):
+            self._track(trade) # Late entry fills
+
+        now = time.monotonic()
+        pending = 0
+        for symbol, item in self.items.items():
+            if item['confirmed_ms'] is not None or item['escalated']: continue
+            trade = item['trade']
+
+            future = item['future']
+            if future is not None and future.done():
+                item['future'] = None
+                try:
+                    self._apply(item, future.result())
+                except Exception as e:
+                    print(f"SQUARE-OFF: {symbol} broker call failed: {e}")
+                    item['deadline'] = now # Retry (or escalate) on this pass
+
+            if trade.status == 'CLOSED' or self.strategy.active_trades.get(symbol) is not trade:
+                if item['confirmed_ms'] is None: item['confirmed_ms'] = self._ms()
+                continue
+
+            pending += 1
+            if item['future'] is None and now >= item['deadline']:
+                if item['checks'] >= self.max_retries:
+                    self._escalate(item)
+                    continue
+                item['checks'] += 1
+                item['deadline'] = now + self.deadline_sec
+                print(f"SQUARE-OFF: {symbol} exit not confirmed (order {trade.exit_order_id}). Checking with broker.")
+                item['future'] = self._submit(self._check, trade.exit_order_id, trade.correlation_id)
+
+        if pending == 0: self._finish()
+
+    def _apply(self, item, result):
+        trade = item['trade']
+        kind = result[0]
+        if kind == 'sent':
+            _, resp, sent_t, ack_t = result
+            item['attempts'] += 1
+            # Confirmation clock starts at the ack; a rejected placement is retried on the next poll
+            item['deadline'] = time.monotonic() + (self.deadline_sec if order_id_from(resp) else 0)
+            if item['ack_ms'] is None: item['ack_ms'] = self._ms(ack_t)
+            self.strategy.record_exit(trade, self.reason, resp, sent_t, ack_t)
+            return
+
+        info = result[1]
+        status = item['last_status'] = info['status']
+        order_id = info['order_id'] or trade.exit_order_id
+        if status == 'TRADED':
+            # The fill happened but its update never reached us: reconcile from the broker's view
+            print(f"SQUARE-OFF: {trade.symbol} exit {order_id} found TRADED at broker. Reconciling.")
+            self.strategy.reconcile_order_update({'orderId': order_id, 'orderStatus': 'TRADED', 'LegNo': info['leg'],
+                                                  'tradedPrice': info['price'] or 0, 'correlationId': trade.correlation_id})
+        elif status in DEAD_ORDER_STATUSES or (status is None and not order_id):
+            # Rejected / cancelled / never reached the broker: release the leg, then send a new one
+            if order_id and status:
+                self.strategy.reconcile_order_update({'orderId': order_id, 'orderStatus': status, 'correlationId': trade.correlation_id})
+            self._resend(item)
+
+    def _escalate(self, item):
+        trade = item['trade']
+        item['escalated'] = True
+        self.escalated.add(trade.symbol)
+        print(f"SQUARE-OFF CRITICAL: {trade.symbol} still not flat after {item['attempts']} exit orders, {item['checks']} checks "
+              f"(last order {trade.exit_order_id}, status {item['last_status']}). MANUAL ACTION REQUIRED.")
+        self.strategy.flag_exit_escalated(trade)
+
+    def _finish(self):
+        self.done = True
+        self.finished_at = self._ms()
+        if self.pool is not None: self.pool.shutdown(wait=False)
+        print(f"SQUARE-OFF DONE: {self._summary()}")
+
+    def _summary(self) -> str:
+        rep = self.report()
+        return (f"{rep['strategy']} {rep['confirmed']}/{rep['positions']} flat in {rep['flat_ms']} ms "
+                f"(acks {rep['first_ack_ms']}-{rep['last_ack_ms']} ms, retries {rep['retries']}, "
+                f"escalated {rep['escalated'] or 'none'}).")
+
+    def report(self) -> Dict[str, Any]:
+        items = list(self.items.values())
+        acks = [i['ack_ms'] for i in items if i['ack_ms'] is not None]
+        confirms = [i['confirmed_ms'] for i in items if i['confirmed_ms'] is not None]
+        return {
+            'strategy': self.strategy.settings.name,
+            'reason': self.reason,
+            'started_at': self.started_at.isoformat(),
+            'done': self.done,
+            'positions': len(items),
+            'confirmed': len(confirms),
+            'escalated': [i['trade'].symbol for i in items if i['escalated']],
+            'retries': sum(i['checks'] for i in items),
+            'first_ack_ms': min(acks) if acks else None,
+            'last_ack_ms': max(acks) if acks else None,
+            'flat_ms': max(confirms) if confirms else None, # Start -> last confirmed exit fill
+            'symbols': {
+                i['trade'].symbol: [i['ack_ms'], i['confirmed_ms'], i['attempts'], i['escalated']]
+                for i in items
+            },
+        }
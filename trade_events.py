@@ -0,0 +1,163 @@
+# trade_events.py - Append-only trade event log, written in batches by the Algo Engine
+"""
+Every CashBreakoutTrade transition (entry sent, open, breakeven, exit sent, closed,
+...) is kept as a TradeEvent row instead of being lost in an in-place UPDATE.
+
+- TradeEventLog.record() diffs a trade against the column values last persisted
+  and buffers one event holding only the changed columns (the CREATED event holds
+  the full row). A save with nothing changed writes nothing.
+- The event type is the new status if it changed, else the new order_state
+  ('IDLE' when cleared), else STOP_MOVED for a stop change, else UPDATE.
+- A change to any DURABLE_FIELDS column (status, order_state, order ids,
+  correlation id) is flushed before record() returns, together with everything
+  buffered before it: a restarted engine must see every order that was sent and
+  every order id it has to match fills against. record() returns False if that
+  flush failed (the caller decides whether to go ahead with the broker call).
+- Monitoring-only changes (stop moves, other updates) are batched: flush() runs
+  every TRADE_EVENT_FLUSH_SEC (or once TRADE_EVENT_BATCH_SIZE events are
+  buffered): one bulk_create of the events and one bulk_update per distinct set
+  of changed columns, in a single transaction. Each row writes only the columns
+  it changed, so writes made by the dashboard to its other columns survive. A
+  failed flush keeps the buffers and is retried on the next call.
+- pending() serves trades with unflushed changes, so DB lookups by order id never
+  see a stale row.
+- replay() folds a trade's events back into its current column values;
+  state_from_events() does it for one trade id straight from the table.
+
+Writers outside the engine (dashboard, management commands) append their own
+events with append_events().
+"""
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import transaction
+
+from dashboard.models import CashBreakoutTrade, TradeEvent
+from trade_state import TradeState, TRADE_FIELDS, TERMINAL_STATUSES
+
+EVENT_CREATED = 'CREATED'
+EVENT_IDLE = 'IDLE'
+EVENT_STOP_MOVED = 'STOP_MOVED'
+EVENT_UPDATE = 'UPDATE'
+
+TIME_FIELDS = ('order_sent_at', 'candle_ts', 'entry_time', 'exit_time', 'created_at')
+
+# Columns a restart must see: order legs in flight and the ids their fills arrive with
+DURABLE_FIELDS = frozenset({'status', 'order_state', 'entry_order_id', 'exit_order_id', 'correlation_id'})
+
+# Column whose value is the event's price
+_EVENT_PRICE_FIELDS = {
+    EVENT_CREATED: 'entry_level',
+    'OPEN': 'entry_price',
+    'CLOSED': 'exit_price',
+    EVENT_STOP_MOVED: 'stop_level',
+}
+
+
+def classify(changes: Dict[str, Any]) -> Tuple[str, Optional[float]]:
+    """(event type, price) of a set of changed columns."""
+    if 'status' in changes: kind = changes['status']
+    elif 'order_state' in changes: kind = changes['order_state'] or EVENT_IDLE
+    elif 'stop_level' in changes: kind = EVENT_STOP_MOVED
+    else: kind = EVENT_UPDATE
+    field = _EVENT_PRICE_FIELDS.get(kind)
+    return kind, (changes.get(field) if field else None)
+
+
+def new_event(trade_id, changes: Dict[str, Any], kind: Optional[str] = None) -> TradeEvent:
+    auto_kind, price = classify(changes)
+    kind = kind or auto_kind
+    if kind == EVENT_CREATED: price = changes.get('entry_level')
+    payload = {f: (v.isoformat() if isinstance(v, datetime) else v) for f, v in changes.items()} # Full precision
+    return TradeEvent(trade_id=trade_id, event_type=kind, price=price,
+                      ts=datetime.now(settings.IST), payload=payload)
+
+
+def append_events(events: Iterable[Tuple[Any, Dict[str, Any]]]) -> int:
+    """Immediate insert of (trade id, changed columns) pairs, for writers outside the engine."""
+    rows = [new_event(trade_id, changes) for trade_id, changes in events]
+    if rows: TradeEvent.objects.bulk_create(rows, batch_size=settings.TRADE_EVENT_BATCH_SIZE)
+    return len(rows)
+
+
+def replay(events: Iterable[TradeEvent]) -> Dict[str, Any]:
+    """Current column values from a trade's events (in insertion order)."""
+    state: Dict[str, Any] = {}
+    for event in events:
+        state.update(event.payload)
+    for f in TIME_FIELDS:
+        if isinstance(state.get(f), str): state[f] = datetime.fromisoformat(state[f])
+    return state
+
+
+def state_from_events(trade_id) -> Optional[TradeState]:
+    state = replay(TradeEvent.objects.filter(trade_id=trade_id).order_by('id'))
+    return TradeState(id=trade_id, **state) if state else None
+
+
+class TradeEventLog:
+    def __init__(self):
+        self.events: List[TradeEvent] = []
+        self.dirty: Dict[Any, Tuple[TradeState, Set[str]]] = {} # trade id -> (trade, changed columns)
+        self.persisted: Dict[Any, Dict[str, Any]] = {}          # trade id -> column values last persisted
+        self.last_flush = time.monotonic()
+        self.flushed = 0
+        self.failures = 0
+
+    def track(self, trade: TradeState):
+        """Baseline for a trade loaded from the DB."""
+        if trade.id not in self.dirty: self.persisted[trade.id] = trade.update_fields()
+
+    def created(self, trade: TradeState):
+        self.persisted[trade.id] = trade.update_fields()
+        self.events.append(new_event(trade.id, {f: getattr(trade, f) for f in TRADE_FIELDS if f != 'id'}, EVENT_CREATED))
+
+    def record(self, trade: TradeState) -> bool:
+        """Buffers the trade's changes; durable ones are flushed now. False if that flush failed."""
+        before = self.persisted.get(trade.id)
+        after = trade.update_fields()
+        changes = {f: v for f, v in after.items() if before is None or before.get(f) != v}
+        if not changes: return True
+        self.persisted[trade.id] = after
+        self.events.append(new_event(trade.id, changes))
+        _, fields = self.dirty.setdefault(trade.id, (trade, set()))
+        fields.update(changes)
+        self.dirty[trade.id] = (trade, fields) # Latest object wins (reloads replace TradeStates)
+        if DURABLE_FIELDS.intersection(changes) or len(self.events) >= settings.TRADE_EVENT_BATCH_SIZE:
+            return self.flush()
+        return True
+
+    def pending(self, trade_id) -> Optional[TradeState]:
+        entry = self.dirty.get(trade_id)
+        return entry[0] if entry else None
+
+    def maybe_flush(self):
+        if time.monotonic() - self.last_flush >= settings.TRADE_EVENT_FLUSH_SEC:
+            self.flush()
+
+    def flush(self) -> bool:
+        self.last_flush = time.monotonic()
+        if not self.events and not self.dirty: return True
+        # One bulk_update per changed-column set: a row never writes back columns it didn't change
+        # (e.g. a stop move must not clobber a manual square-off's status from the dashboard)
+        groups: Dict[Tuple[str, ...], List[CashBreakoutTrade]] = {}
+        for trade, changed in self.dirty.values():
+            fields = tuple(sorted(changed))
+            groups.setdefault(fields, []).append(CashBreakoutTrade(id=trade.id, **{f: getattr(trade, f) for f in fields}))
+        try:
+            with transaction.atomic():
+                TradeEvent.objects.bulk_create(self.events, batch_size=settings.TRADE_EVENT_BATCH_SIZE)
+                for fields, rows in groups.items():
+                    CashBreakoutTrade.objects.bulk_update(rows, fields, batch_size=settings.TRADE_EVENT_BATCH_SIZE)
+        except Exception as e:
+            self.failures += 1
+            for event in self.events: event.pk = None # Re-insert on the next attempt
+            print(f"Trade Event Flush Error ({len(self.events)} events, {len(self.dirty)} trades kept for retry): {e}")
+            return False
+        self.flushed += len(self.events)
+        for trade, _ in self.dirty.values():
+            if trade.status in TERMINAL_STATUSES: self.persisted.pop(trade.id, None)
+        self.events, self.dirty = [], {}
+        return True
@@ -0,0 +1,57 @@
+# trade_state.py - In-memory trade representation for the Algo Engine
+"""
+TradeState is a plain __slots__ object holding the CashBreakoutTrade columns the
+engine works with. The strategy's active_trades map holds these instead of model
+instances, so hot-path reads (status, entry_level, stop_level, ...) are slot
+lookups with no ORM descriptor or _state overhead.
+
+Conversion to/from the ORM happens only at the persistence boundary
+(algo_engine.DjangoTradeStore): active trades are loaded with .values(), creates go
+through the model once, and saves hand the changed columns to trade_events.TradeEventLog,
+which appends TradeEvents and writes the rows with bulk_update (order-state changes at
+once, the rest batched).
+"""
+from typing import Any, Dict
+
+# CashBreakoutTrade concrete columns ('strategy' FK held as strategy_id)
+TRADE_FIELDS = (
+    'id', 'strategy_id', 'symbol', 'security_id', 'quantity', 'status', 'exit_reason',
+    'prev_day_high', 'entry_level', 'stop_level', 'target_level',
+    'entry_price', 'exit_price', 'entry_order_id', 'exit_order_id',
+    'order_state', 'correlation_id', 'order_sent_at',
+    'candle_ts', 'entry_time', 'exit_time', 'created_at',
+    'pnl', 'candle_high', 'candle_low', 'volume_price',
+)
+
+# Columns never written back by save (primary key, auto_now_add)
+_IMMUTABLE_FIELDS = ('id', 'created_at')
+UPDATE_FIELDS = tuple(f for f in TRADE_FIELDS if f not in _IMMUTABLE_FIELDS)
+
+# order_state values with no broker request in flight ('BRACKET': exit legs held at the broker)
+IDLE_ORDER_STATES = ('', 'BRACKET')
+
+# Statuses a trade never leaves (archived at end of day by archive_trades)
+TERMINAL_STATUSES = ('CLOSED', 'EXPIRED', 'FAILED_ENTRY')
+
+_DEFAULTS = {'quantity': 0, 'status': 'PENDING_ENTRY', 'order_state': '', 'pnl': 0.0}
+
+
+class TradeState:
+    __slots__ = TRADE_FIELDS
+
+    def __init__(self, **values):
+        for f in TRADE_FIELDS:
+            setattr(self, f, _DEFAULTS.get(f))
+        for f, v in values.items():
+            setattr(self, f, v) # Unknown names raise AttributeError (slots)
+
+    @classmethod
+    def from_model(cls, trade) -> 'TradeState':
+        return cls(**{f: getattr(trade, f) for f in TRADE_FIELDS})
+
+    def update_fields(self) -> Dict[str, Any]:
+        """Writable column values; TradeEventLog diffs them against the last persisted copy."""
+        return {f: getattr(self, f) for f in UPDATE_FIELDS}
+
+    def __repr__(self):
+        return f"{self.symbol} ({self.status}) @ {self.entry_price or 'N/A'}"
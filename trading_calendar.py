@@ -0,0 +1,46 @@
+# trading_calendar.py - NSE trading days (weekends + settings.NSE_HOLIDAYS)
+"""
+Which session's levels a trading day needs:
+
+- is_trading_day(): Monday-Friday and not in NSE_HOLIDAYS.
+- previous_trading_day() / next_trading_day(): strictly before / after a date.
+- expected_session(now): the last completed session before the next trading day
+  to be traded. Pre-market (or during market hours) on a trading day that is the
+  previous trading day; after the close, or on a weekend / holiday, it is the
+  last session that has already ended.
+"""
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+
+from django.conf import settings
+
+SESSION_CLOSE = time(15, 30)
+
+
+def is_trading_day(d: date) -> bool:
+    return d.weekday() < 5 and d.isoformat() not in settings.NSE_HOLIDAYS
+
+
+def previous_trading_day(d: date) -> date:
+    d -= timedelta(days=1)
+    while not is_trading_day(d): d -= timedelta(days=1)
+    return d
+
+
+def next_trading_day(d: date) -> date:
+    d += timedelta(days=1)
+    while not is_trading_day(d): d += timedelta(days=1)
+    return d
+
+
+def upcoming_trading_day(now: Optional[datetime] = None) -> date:
+    """Today if it is a trading day still to be (or being) traded, else the next one."""
+    now = now or datetime.now(settings.IST)
+    today = now.date()
+    if is_trading_day(today) and now.time() < SESSION_CLOSE: return today
+    return next_trading_day(today)
+
+
+def expected_session(now: Optional[datetime] = None) -> date:
+    """Session whose OHLC the upcoming trading day's breakout levels come from."""
+    return previous_trading_day(upcoming_trading_day(now))